@@ -0,0 +1,269 @@
+import os
+import asyncio
+from collections import OrderedDict
+from database import db
+from tenants import tenants
+
+# Отметки пишутся в базу пачкой: не позже чем через столько миллисекунд
+# после первой отметки пачки или сразу, когда накопится ATTENDANCE_BATCH
+ATTENDANCE_FLUSH_MS = float(os.getenv('ATTENDANCE_FLUSH_MS', '20'))
+ATTENDANCE_BATCH = int(os.getenv('ATTENDANCE_BATCH', '200'))
+# Составы скольких событий держать в памяти
+ATTENDANCE_CACHE = 1024
+
+
+# Журнал отметок с отложенной записью.
+# Отметка сразу применяется к составу события в памяти — по нему отрисовывается
+# сообщение события, а нажавший получает ответ, не дожидаясь записи. В базу
+# отметки уходят пачками одной транзакцией; повторные нажатия одного игрока
+# до записи схлопываются в последнее. Запись идемпотентна по (event_id, user_id):
+# INSERT OR IGNORE / DELETE, поэтому повтор пачки ничего не портит.
+# Ответ «Не буду» запоминается в declined — таким игрокам не напоминают.
+# Перед чтением отметок из базы (составы) и при остановке вызывается flush.
+class AttendanceJournal:
+    def __init__(self, db, delay=ATTENDANCE_FLUSH_MS / 1000, batch_size=ATTENDANCE_BATCH,
+                 cache_size=ATTENDANCE_CACHE):
+        self.db = db
+        self.delay = delay
+        self.batch_size = batch_size
+        self.cache_size = cache_size
+        # event_id -> (chat_id события, {user_id: имя} отметившихся «Буду»)
+        self._rosters = OrderedDict()
+        # event_id -> сообщение события в его чате (events.group_msg_id; None — нет)
+        self._messages = {}
+        self._loading = {}
+        # (event_id, user_id) -> (going, user, chat_id события) — ещё не записанные отметки
+        self._pending = {}
+        # Отметки пачки, которая сейчас пишется
+        self._writing = {}
+        # user_id -> (user, chat_id группы) — группы, которые надо запомнить (см. tenants)
+        self._joins = {}
+        self._full = asyncio.Event()
+        self._task = None
+        self._lock = asyncio.Lock()
+        # Вызывается при каждой отметке (event_id, user_id, имя, going):
+        # в режиме рабочих процессов обновляет составы в остальных процессах
+        self.on_change = None
+        # Вызывается при закрытии события (event_id): остальные процессы
+        # забывают его состав и перестают принимать отметки
+        self.on_forget = None
+        self.stats = {'marks': 0, 'rejected': 0, 'loads': 0, 'flushes': 0, 'written': 0, 'max_batch': 0,
+                      'errors': 0}
+
+    async def roster(self, event_id):
+        entry = self._rosters.get(event_id)
+        if entry is not None:
+            self._rosters.move_to_end(event_id)
+            return entry
+        task = self._loading.get(event_id)
+        if task is None:
+            task = self._loading[event_id] = asyncio.create_task(self._load(event_id))
+        return await asyncio.shield(task)
+
+    async def _load(self, event_id):
+        def load_roster(conn):
+            # Отмечаться можно только на открытые события
+            row = conn.execute("SELECT chat_id, group_msg_id FROM events WHERE event_id = ? AND status = 'open'",
+                               (event_id,)).fetchone()
+            if row is None:
+                return None
+            players = conn.execute('''SELECT m.user_id, m.name FROM participants p
+                                      JOIN members m ON m.chat_id = ? AND m.user_id = p.user_id
+                                      WHERE p.event_id = ? ORDER BY p.rowid''', (row[0], event_id)).fetchall()
+            return (row[0], dict(players)), row[1]
+
+        try:
+            loaded = await self.db.read(load_roster)
+        finally:
+            del self._loading[event_id]
+        if loaded is None:
+            return None
+        entry, message_id = loaded
+        if message_id is not None:
+            self._messages[event_id] = message_id
+        self.stats['loads'] += 1
+        # Отметки, которые ещё не записаны, поверх прочитанного
+        for marks in (self._writing, self._pending):
+            for (pending_event, user_id), (going, user, _) in marks.items():
+                if pending_event == event_id:
+                    self._apply(entry[1], user_id, user.full_name, going)
+        self._rosters[event_id] = entry
+        self._evict()
+        return entry
+
+    def _evict(self):
+        pending_events = {event_id for event_id, _ in (*self._writing, *self._pending)}
+        for event_id in list(self._rosters):
+            if len(self._rosters) <= self.cache_size:
+                break
+            if event_id not in pending_events:
+                del self._rosters[event_id]
+                self._messages.pop(event_id, None)
+
+    @staticmethod
+    def _apply(players, user_id, name, going):
+        if going:
+            players.setdefault(user_id, name)
+        else:
+            players.pop(user_id, None)
+
+    # Событие закрыто (см. scheduler): состав больше не нужен, отметки не принимаются
+    # (ещё не записанные отметки запишутся при flush как обычно)
+    def forget(self, event_id, notify=True):
+        self._rosters.pop(event_id, None)
+        self._messages.pop(event_id, None)
+        if notify and self.on_forget is not None:
+            self.on_forget(event_id)
+
+    # Отметка игрока; group — чат, где нажата кнопка. event_id приходит из
+    # callback_data, поэтому чужое событие не принимается: tenant — событие
+    # должно быть этого чата (кнопка в группе), member=True — игрок должен
+    # состоять в чате события (кнопка в личном чате: напоминание или список
+    # событий любой из его групп). Возвращает chat_id события или None, если
+    # такого открытого события нет
+    async def mark(self, event_id, user, going, group=None, tenant=None, member=False):
+        entry = await self.roster(event_id)
+        if (entry is None or (tenant is not None and entry[0] != tenant)
+                or (member and not await self._is_member(entry, user.id))):
+            self.stats['rejected'] += 1
+            return None
+        chat_id, players = entry
+        self._apply(players, user.id, user.full_name, going)
+        self._pending[(event_id, user.id)] = (going, user, chat_id)
+        if group is not None and tenants.is_new(group, user):
+            self._joins[user.id] = (user, group.id)
+        self.stats['marks'] += 1
+        if self.on_change is not None:
+            self.on_change(event_id, user.id, user.full_name, going)
+        self._schedule()
+        return chat_id
+
+    # Игрок в чате события: уже отметился, событие его личного чата или есть в members
+    async def _is_member(self, entry, user_id):
+        chat_id, players = entry
+        if user_id in players or chat_id == user_id:
+            return True
+        return await self.db.fetchone("SELECT 1 FROM members WHERE chat_id = ? AND user_id = ?",
+                                      (chat_id, user_id)) is not None
+
+    # Отметка, сделанная другим процессом: только состав в памяти
+    def apply(self, event_id, user_id, name, going):
+        entry = self._rosters.get(event_id)
+        if entry is not None:
+            self._apply(entry[1], user_id, name, going)
+
+    # Сообщение события в его чате (None — его нет, например событие из /import).
+    # Запоминается только найденное: номер сообщения записывается уже после
+    # его отправки, и первые нажатия могут его не застать
+    async def group_message(self, event_id):
+        message_id = self._messages.get(event_id)
+        if message_id is None:
+            row = await self.db.fetchone("SELECT group_msg_id FROM events WHERE event_id = ?", (event_id,))
+            if row is not None and row[0] is not None:
+                message_id = self._messages[event_id] = row[0]
+        return message_id
+
+    # Имена отметившихся «Буду» в порядке отметки (None — события нет)
+    async def names(self, event_id):
+        entry = await self.roster(event_id)
+        return list(entry[1].values()) if entry is not None else None
+
+    def _schedule(self):
+        if len(self._pending) >= self.batch_size:
+            self._full.set()
+        if self._task is None:
+            self._task = asyncio.create_task(self._flush_soon())
+
+    async def _flush_soon(self):
+        try:
+            while self._pending or self._joins:
+                try:
+                    await asyncio.wait_for(self._full.wait(), self.delay)
+                except asyncio.TimeoutError:
+                    pass
+                self._full.clear()
+                await self.flush()
+        finally:
+            self._task = None
+
+    @staticmethod
+    def _write(conn, marks, joins):
+        for user, group_id in joins:
+            tenants.record(conn, group_id, user)
+        going = [(event_id, user, chat_id) for event_id, (on, user, chat_id) in marks if on]
+        # Игрок мог не нажимать /start — заводим его в команде события,
+        # чтобы не нарушить внешний ключ и попасть в состав
+        conn.executemany("INSERT OR IGNORE INTO users (user_id, name) VALUES (?, ?)",
+                         [(user.id, user.full_name) for _, user, _ in going])
+        conn.executemany("INSERT OR IGNORE INTO members (chat_id, user_id, name) VALUES (?, ?, ?)",
+                         [(chat_id, user.id, user.full_name) for _, user, chat_id in going])
+        conn.executemany("INSERT OR IGNORE INTO participants (event_id, user_id) VALUES (?, ?)",
+                         [(event_id, user.id) for event_id, user, _ in going])
+        conn.executemany("DELETE FROM declined WHERE event_id = ? AND user_id = ?",
+                         [(event_id, user.id) for event_id, user, _ in going])
+        declined = [(event_id, user.id) for event_id, (on, user, _) in marks if not on]
+        conn.executemany("DELETE FROM participants WHERE event_id = ? AND user_id = ?", declined)
+        conn.executemany("INSERT OR IGNORE INTO declined (event_id, user_id) VALUES (?, ?)", declined)
+
+    # Запись накопленных отметок одной транзакцией. Когда flush вернулся,
+    # все отметки, сделанные до вызова, уже в базе
+    async def flush(self):
+        async with self._lock:
+            if not self._pending and not self._joins:
+                return
+            self._writing, self._pending = self._pending, {}
+            joins, self._joins = self._joins, {}
+            marks = [(event_id, mark) for (event_id, _), mark in self._writing.items()]
+            
+            def write_marks(conn):
+                self._write(conn, marks, list(joins.values()))
+            
+            try:
+                await self.db.transaction(write_marks)
+            except Exception as e:
+                # Пачку целиком не записать (например, событие удалили) — пишем
+                # отметки по одной, чтобы одна плохая не потеряла остальные
+                print(f"ERROR flushing {len(marks)} attendance marks: {e!r}")
+                self.stats['errors'] += 1
+                await self._write_each(marks, joins)
+            else:
+                self.stats['flushes'] += 1
+                self.stats['written'] += len(marks)
+                self.stats['max_batch'] = max(self.stats['max_batch'], len(marks))
+            finally:
+                self._writing = {}
+            for user, group_id in joins.values():
+                tenants.remember(user.id, group_id)
+
+    async def _write_each(self, marks, joins):
+        for mark in marks:
+            user = mark[1][1]
+            join = [joins[user.id]] if user.id in joins else []
+            try:
+                await self.db.transaction(lambda conn: self._write(conn, [mark], join))
+            except Exception as e:
+                self.stats['errors'] += 1
+                print(f"ERROR writing attendance mark {mark[0]}/{user.id}: {e!r}")
+            else:
+                self.stats['written'] += 1
+
+    # Остановка: оставшиеся отметки записываются до закрытия базы
+    async def close(self):
+        await self.flush()
+        if self._task is not None:
+            self._full.set()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    # Снимок составов для быстрого перезапуска (см. warm_start.CacheSnapshot);
+    # снимается после close, когда все отметки записаны
+    def snapshot(self):
+        return list(self._rosters.items())
+
+    def load_snapshot(self, state):
+        self._rosters = OrderedDict(state)
+
+    def metrics(self):
+        return {**self.stats, 'pending': len(self._pending), 'events': len(self._rosters)}
+
+
+attendance = AttendanceJournal(db)
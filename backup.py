@@ -0,0 +1,131 @@
+import os
+import time
+import asyncio
+from datetime import datetime
+
+# Как часто делать резервную копию базы (секунды); 0 — не делать
+BACKUP_INTERVAL = float(os.getenv('BACKUP_INTERVAL', str(6 * 3600)))
+# Каталог копий; по умолчанию backups рядом с базой
+BACKUP_DIR = os.getenv('BACKUP_DIR')
+# Сколько последних копий хранить
+BACKUP_KEEP = int(os.getenv('BACKUP_KEEP', '7'))
+# Страниц базы за один шаг копирования и пауза между шагами (секунды):
+# чем меньше шаг, тем короче ожидание запросов бота во время копирования
+BACKUP_PAGES = int(os.getenv('BACKUP_PAGES', '256'))
+BACKUP_PAUSE = float(os.getenv('BACKUP_PAUSE', '0.005'))
+
+
+class BackupCancelled(Exception):
+    pass
+
+
+# Резервные копии работающей базы.
+# Раз в BACKUP_INTERVAL база копируется через SQLite backup API маленькими
+# шагами (Database.backup), поэтому бот продолжает отвечать во время
+# копирования. Копия пишется во временный файл и переименовывается, когда
+# готова; в каталоге остаются BACKUP_KEEP последних. Срок следующей копии
+# считается от последней копии в каталоге — перезапуск бота его не сдвигает.
+class Backups:
+    def __init__(self, db, directory=BACKUP_DIR, interval=BACKUP_INTERVAL, keep=BACKUP_KEEP,
+                 pages=BACKUP_PAGES, pause=BACKUP_PAUSE):
+        self.db = db
+        self.directory = directory or os.path.join(os.path.dirname(os.path.abspath(db.path)), 'backups')
+        self.interval = interval
+        self.keep = keep
+        self.pages = pages
+        self.pause = pause
+        self._prefix = os.path.splitext(os.path.basename(db.path))[0] + '-'
+        self._task = None
+        self._copying = False
+        self._closing = False
+        # Самый большой шаг последней копии: страниц и сколько он держал базу (мс)
+        self._step_started = 0.0
+        self._remaining = None
+        self.stats = {'backups': 0, 'errors': 0, 'steps': 0, 'last_seconds': 0.0, 'last_size': 0,
+                      'last_step_pages': 0, 'last_step_ms': 0.0}
+
+    def start(self):
+        if self.interval > 0 and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while not self._closing:
+            latest = self.latest()
+            wait = latest[1] + self.interval - time.time() if latest else 0
+            if wait > 0:
+                await asyncio.sleep(wait)
+            try:
+                await self.backup()
+            except BackupCancelled:
+                return
+            except Exception as e:
+                self.stats['errors'] += 1
+                print(f"ERROR backing up database: {e!r}")
+                await asyncio.sleep(min(self.interval, 600))
+
+    # Копии в каталоге, от новых к старым: (путь, время, размер)
+    def backups(self):
+        if not os.path.isdir(self.directory):
+            return []
+        found = []
+        for name in os.listdir(self.directory):
+            if name.startswith(self._prefix) and name.endswith('.db'):
+                path = os.path.join(self.directory, name)
+                stat = os.stat(path)
+                found.append((path, stat.st_mtime, stat.st_size))
+        return sorted(found, key=lambda backup: backup[1], reverse=True)
+
+    def latest(self):
+        backups = self.backups()
+        return backups[0] if backups else None
+
+    def _progress(self, status, remaining, total):
+        now = time.perf_counter()
+        self.stats['steps'] += 1
+        pages = (total if self._remaining is None else self._remaining) - remaining
+        self.stats['last_step_pages'] = max(self.stats['last_step_pages'], pages)
+        self.stats['last_step_ms'] = max(self.stats['last_step_ms'], (now - self._step_started) * 1000)
+        self._remaining = remaining
+        # После шага Database.backup выжидает паузу — следующий шаг начнётся после неё
+        self._step_started = now + (self.pause if remaining else 0)
+        if self._closing:
+            raise BackupCancelled()
+
+    async def backup(self):
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"{self._prefix}{datetime.now():%Y%m%d-%H%M%S}.db")
+        start = self._step_started = time.perf_counter()
+        self._remaining = None
+        self.stats['last_step_pages'], self.stats['last_step_ms'] = 0, 0.0
+        self._copying = True
+        try:
+            await self.db.backup(path + '.tmp', self.pages, self.pause, self._progress)
+        except BaseException:
+            if os.path.exists(path + '.tmp'):
+                os.remove(path + '.tmp')
+            raise
+        finally:
+            self._copying = False
+        os.replace(path + '.tmp', path)
+        self.stats['backups'] += 1
+        self.stats['last_seconds'] = time.perf_counter() - start
+        self.stats['last_size'] = os.path.getsize(path)
+        for old, _, _ in self.backups()[self.keep:]:
+            os.remove(old)
+        print(f"Резервная копия базы: {path} ({self.stats['last_size']} байт, "
+              f"{self.stats['last_seconds']:.1f} с)")
+        return path
+
+    # Остановка: идущее копирование прерывается на следующем шаге (поток
+    # копирования не отменить снаружи — дожидаемся его)
+    async def close(self):
+        self._closing = True
+        if self._task is not None:
+            if not self._copying:
+                self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def metrics(self):
+        latest = self.latest()
+        return {**self.stats, 'age_seconds': time.time() - latest[1] if latest else 0.0}
@@ -0,0 +1,112 @@
+# Бенчмарк проверки прав администратора (select_coach, «Назначить первого тренера»).
+# Через локальный фейковый Bot API с задержкой сравниваются прямой вызов
+# get_chat_administrators на каждое нажатие и AdminCache: задержка проверки,
+# число запросов к API, доля попаданий. Проверяются также общий запрос для
+# одновременных нажатий, обновление по chat_member и истечение TTL.
+#
+# Запуск: python benchmarks/bench_admins.py --presses 200 --concurrency 50 --latency 0.03
+import os
+import sys
+import time
+import asyncio
+import argparse
+import statistics
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiogram.types import ChatMemberUpdated
+from chat_admins import AdminCache
+from fake_bot_api import FakeBotAPI
+
+CHAT_ID = -1001
+ADMINS = {1, 2}
+
+
+async def uncached_is_admin(bot, chat_id, user_id):
+    chat_admins = await bot.get_chat_administrators(chat_id)
+    return any(admin.user.id == user_id for admin in chat_admins)
+
+
+async def run_presses(check, presses, concurrency):
+    latencies = []
+
+    async def press(n):
+        start = time.perf_counter()
+        result = await check(n % 4)
+        latencies.append((time.perf_counter() - start) * 1000)
+        assert result == (n % 4 in ADMINS)
+
+    for wave in range(0, presses, concurrency):
+        await asyncio.gather(*(press(n) for n in range(wave, min(presses, wave + concurrency))))
+    latencies.sort()
+    return statistics.median(latencies), latencies[int(len(latencies) * 0.95)]
+
+
+def member_update(user_id, old, new):
+    user = {'id': user_id, 'is_bot': False, 'first_name': f"User {user_id}"}
+    rights = dict.fromkeys((
+        'can_be_edited', 'is_anonymous', 'can_manage_chat', 'can_delete_messages',
+        'can_manage_video_chats', 'can_restrict_members', 'can_promote_members',
+        'can_change_info', 'can_invite_users', 'can_post_stories', 'can_edit_stories',
+        'can_delete_stories'), False)
+
+    def member(status):
+        return {'status': status, 'user': user, **(rights if status == 'administrator' else {})}
+
+    return ChatMemberUpdated.model_validate({
+        'chat': {'id': CHAT_ID, 'type': 'supergroup'},
+        'from': user,
+        'date': int(datetime.now().timestamp()),
+        'old_chat_member': member(old),
+        'new_chat_member': member(new),
+    })
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--presses', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--latency', type=float, default=0.03)
+    args = parser.parse_args()
+
+    api = FakeBotAPI(latency=args.latency)
+    await api.start()
+    api.admins[CHAT_ID] = set(ADMINS)
+    bot = api.bot()
+    try:
+        p50, p95 = await run_presses(lambda uid: uncached_is_admin(bot, CHAT_ID, uid),
+                                     args.presses, args.concurrency)
+        print(f"без кэша: p50 {p50:.2f} мс, p95 {p95:.2f} мс, "
+              f"запросов getChatAdministrators: {api.calls['getChatAdministrators']}")
+
+        api.reset()
+        cache = AdminCache(ttl=300)
+        p50, p95 = await run_presses(lambda uid: cache.is_admin(bot, CHAT_ID, uid),
+                                     args.presses, args.concurrency)
+        calls = api.calls['getChatAdministrators']
+        print(f"с кэшем:  p50 {p50:.3f} мс, p95 {p95:.2f} мс, "
+              f"запросов getChatAdministrators: {calls}")
+        print(f"метрики кэша: {cache.metrics()}")
+        assert calls == 1, "concurrent presses should share one request"
+
+        # Повышение и снятие администратора приходят обновлениями chat_member
+        await cache.on_chat_member(member_update(3, 'member', 'administrator'))
+        await cache.on_chat_member(member_update(2, 'administrator', 'member'))
+        assert await cache.is_admin(bot, CHAT_ID, 3)
+        assert not await cache.is_admin(bot, CHAT_ID, 2)
+        assert api.calls['getChatAdministrators'] == 1, "chat_member updates must not trigger requests"
+
+        # После TTL список запрашивается заново
+        short = AdminCache(ttl=0.05)
+        await short.is_admin(bot, CHAT_ID, 1)
+        await asyncio.sleep(0.06)
+        await short.is_admin(bot, CHAT_ID, 1)
+        assert short.stats['misses'] == 2, short.stats
+    finally:
+        await api.stop()
+    print("Проверки пройдены: один общий запрос, обновления chat_member, истечение TTL")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,229 @@
+# Журнал отметок: отдельная транзакция на каждое нажатие против пачек.
+# В каждом из C чатов все P игроков одновременно нажимают «✅ Буду», «❌ Не буду»,
+# «✅ Буду». «По одной» — прежний mark_callback: транзакция с отметкой и чтение
+# состава из базы для сообщения. «Журнал» — attendance.AttendanceJournal:
+# отметка в составе в памяти, запись пачками.
+# Время ответа — от нажатия до готового текста состава; «до записи» — пока
+# все отметки не окажутся в базе (для журнала — включая close).
+# Проверяется: итог в базе совпадает с составом в памяти, повтор пачки
+# ничего не меняет, close записывает всё несохранённое; отметка на событие
+# чужого чата (подделанный callback) и на закрытое событие не принимается, а
+# из личного чата — принимается на событие любой группы игрока.
+#
+# Запуск: python benchmarks/bench_attendance.py --chats 10 --players 40
+import os
+import sys
+import time
+import asyncio
+import sqlite3
+import argparse
+import tempfile
+from types import SimpleNamespace
+from contextlib import redirect_stdout
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from attendance import AttendanceJournal
+from database import Database
+from load_test import percentile
+from migrations import apply_migrations
+
+FIRST_CHAT_ID = -1000000
+TAPS = (True, False, True)
+
+
+def prepare(path, chats, players):
+    conn = sqlite3.connect(path, isolation_level=None)
+    with redirect_stdout(None):
+        apply_migrations(conn)
+    events = {}
+    conn.execute("BEGIN")
+    for n in range(chats):
+        chat_id = FIRST_CHAT_ID - n
+        conn.executemany("INSERT INTO users (user_id, name, last_chat_id) VALUES (?, ?, ?)",
+                         [(player(n, i), f"Игрок {player(n, i)}", chat_id) for i in range(players)])
+        conn.executemany("INSERT INTO members (chat_id, user_id, name) VALUES (?, ?, ?)",
+                         [(chat_id, player(n, i), f"Игрок {player(n, i)}") for i in range(players)])
+        events[chat_id] = conn.execute("INSERT INTO events (chat_id, date, type) VALUES (?, '25.10', 'Игра')",
+                                       (chat_id,)).lastrowid
+    conn.execute("COMMIT")
+    conn.close()
+    return events
+
+
+def player(n, i):
+    return 100000 + n * 1000 + i
+
+
+# Прежний mark_callback: транзакция на нажатие, затем состав из базы
+async def per_mark(db, event_id, user, going):
+    def apply_mark(conn):
+        row = conn.execute("SELECT chat_id FROM events WHERE event_id = ?", (event_id,)).fetchone()
+        if going:
+            conn.execute("INSERT OR IGNORE INTO users (user_id, name) VALUES (?, ?)", (user.id, user.full_name))
+            conn.execute("INSERT OR IGNORE INTO members (chat_id, user_id, name) VALUES (?, ?, ?)",
+                         (row[0], user.id, user.full_name))
+            conn.execute("INSERT OR IGNORE INTO participants (event_id, user_id) VALUES (?, ?)",
+                         (event_id, user.id))
+        else:
+            conn.execute("DELETE FROM participants WHERE event_id = ? AND user_id = ?", (event_id, user.id))
+        return row[0]
+
+    chat_id = await db.transaction(apply_mark)
+    rows = await db.fetchall('''SELECT m.name FROM participants p
+                                JOIN members m ON m.chat_id = ? AND m.user_id = p.user_id
+                                WHERE p.event_id = ?''', (chat_id, event_id))
+    return [row[0] for row in rows]
+
+
+async def journaled(journal, event_id, user, going, group):
+    await journal.mark(event_id, user, going, group)
+    return await journal.names(event_id)
+
+
+async def run(path, events, players, mark):
+    db = Database(path)
+    transactions = 0
+
+    def observe(label, seconds, rows):
+        nonlocal transactions
+        transactions += label.startswith('tx:')
+
+    db.observer = observe
+    await db.open()
+    journal = AttendanceJournal(db)
+    latencies = []
+
+    async def tap(n, chat_id, event_id, i):
+        user = SimpleNamespace(id=player(n, i), full_name=f"Игрок {player(n, i)}")
+        group = SimpleNamespace(id=chat_id, type='supergroup')
+        for going in TAPS:
+            start = time.perf_counter()
+            if mark == 'journal':
+                await journaled(journal, event_id, user, going, group)
+            else:
+                await per_mark(db, event_id, user, going)
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(tap(n, chat_id, event_id, i)
+                           for n, (chat_id, event_id) in enumerate(events.items()) for i in range(players)))
+    answered = time.perf_counter() - start
+    memory = {event_id: sorted(await journal.names(event_id)) for event_id in events.values()} \
+        if mark == 'journal' else None
+    await journal.close()
+    durable = time.perf_counter() - start
+    await db.close()
+    return {
+        'p50_ms': percentile(latencies, 0.5),
+        'p95_ms': percentile(latencies, 0.95),
+        'answered_s': answered,
+        'durable_s': durable,
+        'transactions': transactions,
+        'max_batch': journal.stats['max_batch'],
+        'memory': memory,
+    }
+
+
+def saved_rosters(path, events):
+    conn = sqlite3.connect(path)
+    rosters = {event_id: sorted(row[0] for row in conn.execute(
+        '''SELECT m.name FROM participants p JOIN events e ON e.event_id = p.event_id
+           JOIN members m ON m.chat_id = e.chat_id AND m.user_id = p.user_id
+           WHERE p.event_id = ?''', (event_id,))) for event_id in events.values()}
+    conn.close()
+    return rosters
+
+
+# Повтор уже записанной пачки (например, после сбоя посреди записи) не меняет итог
+async def check_idempotent(path, events, players):
+    before = saved_rosters(path, events)
+    db = Database(path)
+    await db.open()
+    journal = AttendanceJournal(db)
+    for n, (chat_id, event_id) in enumerate(events.items()):
+        for i in range(players):
+            user = SimpleNamespace(id=player(n, i), full_name=f"Игрок {player(n, i)}")
+            await journal.mark(event_id, user, True)
+    marks = [((event_id, user_id), mark) for (event_id, user_id), mark in journal._pending.items()]
+    await journal.close()
+    for _ in range(2):
+        await db.transaction(lambda conn: AttendanceJournal._write(
+            conn, [(event_id, mark) for (event_id, _), mark in marks], []))
+    await db.close()
+    assert saved_rosters(path, events) == before, "replaying a batch changed attendance"
+
+
+# Подделанный callback: event_id другого чата и закрытое событие (в том числе
+# в другом процессе, где состав уже загружен). Из личного
+# чата — событие любой группы игрока, не только последней
+async def check_rejected(path, events):
+    (chat_id, event_id), (other_chat, other_event), (third_chat, third_event) = list(events.items())[:3]
+    before = saved_rosters(path, events)
+    db = Database(path)
+    await db.open()
+    journal = AttendanceJournal(db)
+    stranger = SimpleNamespace(id=1, full_name="Чужой")
+    assert await journal.mark(other_event, stranger, True, tenant=chat_id) is None, \
+        "a mark for another chat's event was accepted"
+    assert await journal.mark(other_event, stranger, True, member=True) is None, \
+        "a private mark for a chat the user is not in was accepted"
+    # Игрок второй группы (она у него последняя) состоит и в третьей
+    user = SimpleNamespace(id=player(1, 0), full_name=f"Игрок {player(1, 0)}")
+    assert await journal.mark(third_event, user, True, member=True) is None, \
+        "a private mark for a chat the user is not in was accepted"
+    await db.execute("INSERT INTO members (chat_id, user_id, name) VALUES (?, ?, ?)",
+                     (third_chat, user.id, user.full_name))
+    assert await journal.mark(third_event, user, True, member=True) == third_chat, \
+        "a private mark for the user's other group was rejected"
+    await journal.mark(third_event, user, False, member=True)
+    # Закрытие в одном процессе доходит до состава, загруженного в другом
+    # (рабочие процессы: sync 'forget')
+    other = AttendanceJournal(db)
+    member = SimpleNamespace(id=player(0, 0), full_name=f"Игрок {player(0, 0)}")
+    await other.roster(event_id)
+    journal.on_forget = lambda *args: other.forget(*args, notify=False)
+    await db.execute("UPDATE events SET status = 'closed' WHERE event_id = ?", (event_id,))
+    journal.forget(event_id)
+    assert await journal.mark(event_id, stranger, True, tenant=chat_id) is None, \
+        "a mark for a closed event was accepted"
+    assert await other.mark(event_id, member, False, member=True) is None, \
+        "another process accepted a mark for a closed event"
+    await journal.close()
+    members = await db.fetchone("SELECT COUNT(*) FROM members WHERE user_id = 1")
+    await db.close()
+    assert members == (0,) and saved_rosters(path, events) == before, "a rejected mark reached the database"
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--chats', type=int, default=10)
+    parser.add_argument('--players', type=int, default=40)
+    args = parser.parse_args()
+
+    print(f"{args.chats} чатов × {args.players} игроков × {len(TAPS)} нажатия")
+    print(f"{'':>9} | {'p50, мс':>8} {'p95, мс':>8} | {'ответы, с':>9} {'до записи, с':>12} | "
+          f"{'транзакций':>10} {'max пачка':>9}")
+    with tempfile.TemporaryDirectory() as tmp:
+        template = os.path.join(tmp, 'template.db')
+        events = prepare(template, args.chats, args.players)
+        expected = {event_id: sorted(f"Игрок {player(n, i)}" for i in range(args.players))
+                    for n, event_id in enumerate(events.values())}
+        for mark, name in (('per_mark', 'по одной'), ('journal', 'журнал')):
+            path = os.path.join(tmp, f"{mark}.db")
+            with open(template, 'rb') as src, open(path, 'wb') as dst:
+                dst.write(src.read())
+            row = await run(path, events, args.players, mark)
+            print(f"{name:>9} | {row['p50_ms']:>8.2f} {row['p95_ms']:>8.2f} | {row['answered_s']:>9.3f} "
+                  f"{row['durable_s']:>12.3f} | {row['transactions']:>10} {row['max_batch'] or '-':>9}")
+            assert saved_rosters(path, events) == expected, f"{name}: attendance in the database is wrong"
+            if row['memory'] is not None:
+                assert row['memory'] == expected, "in-memory roster differs from the database"
+        await check_idempotent(path, events, args.players)
+        await check_rejected(path, events)
+    print("Проверки пройдены: итог в базе и в памяти совпадает, повтор пачки ничего не меняет, "
+          "отметки на чужие и закрытые события не принимаются, из личного чата — на события любой группы игрока")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,81 @@
+# Микробенчмарк callback_data: кодирование и маршрутизация.
+# "Старый" вариант — строки вида mark_5_1 и цепочка startswith из прежнего
+# handle_callback, "новый" — callbacks.CompactCallback и CallbackRouter.
+#
+# Запуск: python benchmarks/bench_callbacks.py
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from callbacks import (
+    CallbackRouter, SelectEvent, Mark, CreateEvent, FormTeams, SetCoach, SelectCoach,
+    BackToCoachMenu, BackToEvents,
+)
+
+BIG_USER_ID = 2 ** 52
+BIG_EVENT_ID = 2 ** 31
+
+
+def handler(*args):
+    return args
+
+
+# Прежняя маршрутизация: линейная цепочка и разбор split("_")
+def legacy_dispatch(data):
+    if data.startswith("select_event_"):
+        return handler(int(data.rsplit("_", 1)[1]))
+    elif data.startswith("mark_"):
+        _, event_id, status = data.split("_")
+        return handler(int(event_id), int(status))
+    elif data == "create_event":
+        return handler()
+    elif data == "back_to_coach_menu":
+        return handler()
+    elif data == "back_to_events":
+        return handler()
+    elif data == "set_coach":
+        return handler()
+    elif data.startswith("select_coach_"):
+        return handler(int(data.rsplit("_", 1)[1]))
+
+
+def main():
+    router = CallbackRouter()
+    for schema in (SelectEvent, Mark, CreateEvent, FormTeams, SetCoach, SelectCoach, BackToCoachMenu, BackToEvents):
+        router.register(schema, handler)
+
+    samples_legacy = [f"select_coach_{BIG_USER_ID}", f"mark_{BIG_EVENT_ID}_1", "back_to_events"]
+    samples_new = [SelectCoach(user_id=BIG_USER_ID).pack(), Mark(event_id=BIG_EVENT_ID, going=True).pack(),
+                   BackToEvents().pack()]
+
+    print("payload sizes (bytes, limit 64):")
+    for old, new in zip(samples_legacy, samples_new):
+        print(f"  {old!r:>28} {len(old.encode()):>3}  ->  {new!r:>18} {len(new.encode()):>3}")
+
+    def measure(stmt):
+        number = 100000
+        return min(timeit.repeat(stmt, number=number, repeat=5)) / number * 1e9
+
+    print("\nper operation, ns:")
+    print(f"  encode  old: {measure(lambda: f'mark_{BIG_EVENT_ID}_1'):8.0f}"
+          f"   new: {measure(lambda: Mark(event_id=BIG_EVENT_ID, going=True).pack()):8.0f}")
+    for old, new in zip(samples_legacy, samples_new):
+        print(f"  dispatch {old.split('_')[0]:<7} old: {measure(lambda: legacy_dispatch(old)):8.0f}"
+              f"   new: {measure(lambda: router.resolve(new)):8.0f}")
+    print(f"  dispatch legacy payload through new router: {measure(lambda: router.resolve(samples_legacy[1])):8.0f}")
+
+    # Строки с лишними «_» старая схема разбирала неправильно
+    for data in ("select_event_5", "select_coach_123"):
+        try:
+            _, value = data.split("_")
+            outcome = value
+        except ValueError as e:
+            outcome = f"ValueError: {e}"
+        print(f"\n{data!r}: old split -> {outcome}; new router -> {router.resolve(data)[0]!r}", end='')
+    print(f"\nunknown payload 'garbage': {router.resolve('garbage')}")
+
+
+if __name__ == '__main__':
+    main()
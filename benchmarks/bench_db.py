@@ -0,0 +1,168 @@
+# Бенчмарк слоя БД: пропускная способность mark_callback при одновременных нажатиях.
+# "До" — старый обработчик с sqlite3.connect на каждый вызов прямо в event loop,
+# "после" — обработчик из hockey_bot.py поверх database.Database.
+#
+# Запуск: python benchmarks/bench_db.py --updates 200 --latency 0.02
+import os
+import sys
+import time
+import asyncio
+import sqlite3
+import argparse
+import tempfile
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('TOKEN', '0:bench')
+
+from callbacks import Mark
+
+
+class FakeMessage:
+    def __init__(self, latency):
+        self.latency = latency
+        self.chat = SimpleNamespace(id=-1001, type='group')
+        self.message_id = 1
+        self.reply_markup = None
+        self.edits = 0
+
+    async def edit_text(self, text, **kwargs):
+        # Имитация сетевого запроса к Bot API
+        await asyncio.sleep(self.latency)
+        self.edits += 1
+
+
+class FakeBot:
+    def __init__(self, message):
+        self.message = message
+
+    async def edit_message_text(self, text, **kwargs):
+        await self.message.edit_text(text)
+
+
+def make_callback(event_id, user_id, message):
+    async def answer(*args, **kwargs):
+        pass
+    return SimpleNamespace(
+        data=Mark(event_id=event_id, going=True).pack(),
+        from_user=SimpleNamespace(id=user_id, full_name=f"Игрок {user_id}"),
+        message=message,
+        bot=FakeBot(message),
+        answer=answer,
+    )
+
+
+# Старая реализация mark_callback (до перехода на database.py)
+async def legacy_mark_callback(callback, data, path, timeout):
+    event_id, status = data.event_id, int(data.going)
+    user_id = callback.from_user.id
+    conn = sqlite3.connect(path, timeout=timeout)
+    c = conn.cursor()
+    c.execute("DELETE FROM participants WHERE event_id = ? AND user_id = ?", (event_id, user_id))
+    if status == 1:
+        c.execute("INSERT INTO participants (event_id, user_id) VALUES (?, ?)", (event_id, user_id))
+    c.execute('''SELECT u.name FROM participants p
+                 JOIN users u ON p.user_id = u.user_id
+                 WHERE p.event_id = ?''', (event_id,))
+    players = [row[0] for row in c.fetchall()]
+    try:
+        await callback.message.edit_text("\n".join(players))
+    except:
+        pass
+    await callback.answer()
+    conn.commit()
+    conn.close()
+
+
+def prepare(path, players):
+    conn = sqlite3.connect(path)
+    conn.executescript('''
+        CREATE TABLE users (user_id INTEGER PRIMARY KEY, name TEXT, is_coach INTEGER DEFAULT 0);
+        CREATE TABLE events (event_id INTEGER PRIMARY KEY AUTOINCREMENT, date TEXT, type TEXT,
+                             status TEXT DEFAULT 'open', group_msg_id INTEGER);
+        CREATE TABLE participants (event_id INTEGER, user_id INTEGER);
+        INSERT INTO events (date, type) VALUES ('25.10', 'Тренировка');
+    ''')
+    conn.executemany("INSERT INTO users (user_id, name) VALUES (?, ?)",
+                     [(i, f"Игрок {i}") for i in range(players)])
+    conn.commit()
+    conn.close()
+
+
+# Измеряем задержку event loop: насколько опаздывает короткий таймер
+async def loop_lag_probe(stop, samples):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(0.001)
+        samples.append(time.perf_counter() - start - 0.001)
+
+
+async def run(handler, updates, latency):
+    message = FakeMessage(latency)
+    stop = asyncio.Event()
+    lag = []
+    probe = asyncio.create_task(loop_lag_probe(stop, lag))
+    errors = 0
+
+    async def one(user_id):
+        nonlocal errors
+        try:
+            callback = make_callback(1, user_id, message)
+            answer = await handler(callback, Mark.unpack(callback.data))
+            if answer is not None:
+                await answer
+        except Exception:
+            errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(updates)))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await probe
+    return {
+        'updates/s': updates / elapsed,
+        'elapsed_s': elapsed,
+        'errors': errors,
+        'max_loop_lag_ms': max(lag, default=0) * 1000,
+    }
+
+
+def report(name, result):
+    print(f"{name:>8}: {result['updates/s']:8.1f} updates/s, "
+          f"{result['elapsed_s']:.3f} s, errors={result['errors']}, "
+          f"max loop lag={result['max_loop_lag_ms']:.1f} ms")
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--updates', type=int, default=200)
+    parser.add_argument('--latency', type=float, default=0.02, help='задержка edit_text, с')
+    # У sqlite3 по умолчанию 5 с: старый обработчик держит блокировку через await,
+    # и каждый конфликт останавливает весь event loop на это время
+    parser.add_argument('--legacy-timeout', type=float, default=0.1, help='busy timeout старого обработчика, с')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy_path = os.path.join(tmp, 'legacy.db')
+        prepare(legacy_path, args.updates)
+        legacy = await run(lambda cb, data: legacy_mark_callback(cb, data, legacy_path, args.legacy_timeout),
+                           args.updates, args.latency)
+        report('before', legacy)
+
+        os.environ['DB_PATH'] = os.path.join(tmp, 'pooled.db')
+        prepare(os.environ['DB_PATH'], args.updates)
+        import hockey_bot
+        from migrations import migrate
+        await hockey_bot.db.open()
+        await migrate(hockey_bot.db)
+        try:
+            pooled = await run(hockey_bot.mark_callback, args.updates, args.latency)
+            await hockey_bot.roster_updater.flush_all()
+            await hockey_bot.attendance.close()
+        finally:
+            await hockey_bot.db.close()
+        report('after', pooled)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
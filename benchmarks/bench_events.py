@@ -0,0 +1,121 @@
+# Бенчмарк запросов событий по времени.
+# Строит базу старого формата с несколькими сезонами истории (events.date —
+# «ДД.ММ» без года, события создаются по порядку), обновляет её миграциями,
+# проверяет восстановленные годы и сравнивает «ближайшие события» через
+# индекс (status, starts_at) со старым ORDER BY date.
+#
+# Запуск: python benchmarks/bench_events.py --seasons 1 10 50
+import os
+import sys
+import time
+import random
+import asyncio
+import argparse
+import sqlite3
+import tempfile
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import Database
+from event_time import EVENT_TZ, to_timestamp, upcoming, past, between, parse_event_args
+from migrations import MIGRATIONS, apply_migrations
+from tenants import LEGACY_CHAT_ID
+
+EVENTS_PER_SEASON = 300
+LEGACY_SQL = "SELECT event_id, date, type FROM events WHERE status = 'open' ORDER BY date DESC"
+
+
+def check_parsing():
+    now = datetime(2026, 12, 20, 12, 0, tzinfo=EVENT_TZ)
+    cases = {
+        '05.01 Игра': datetime(2027, 1, 5, tzinfo=EVENT_TZ),
+        '25.10 Тренировка': datetime(2026, 10, 25, tzinfo=EVENT_TZ),
+        '21.12 19:30 Игра': datetime(2026, 12, 21, 19, 30, tzinfo=EVENT_TZ),
+        '01.03.2025 Игра': datetime(2025, 3, 1, tzinfo=EVENT_TZ),
+    }
+    for args, expected in cases.items():
+        assert parse_event_args(args, now)[0] == expected, args
+    assert parse_event_args('21.12 19:30 Игра с Динамо', now)[1] == 'Игра с Динамо'
+    for bad in ('31.02 Игра', '25/10 Игра', '25.10'):
+        try:
+            parse_event_args(bad, now)
+        except ValueError:
+            continue
+        raise AssertionError(f"{bad!r} should be rejected")
+
+
+# События идут раз в сутки-двое; последнее — через несколько дней от сегодня.
+# Старый бот не закрывал события, поэтому все они открыты
+def build_legacy(path, seasons):
+    conn = sqlite3.connect(path)
+    conn.executescript(MIGRATIONS[0][2])
+    now = datetime.now(EVENT_TZ)
+    day = now.replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=7)
+    days = []
+    for _ in range(seasons * EVENTS_PER_SEASON):
+        days.append(day)
+        day -= timedelta(days=random.choice((1, 1, 2)))
+    days.reverse()
+    rows = [(event_id, f"{day:%d.%m}") for event_id, day in enumerate(days, 1)]
+    conn.executemany("INSERT INTO events (event_id, date, type) VALUES (?, ?, 'Игра')", rows)
+    conn.commit()
+    conn.close()
+    return {event_id: to_timestamp(day) for event_id, day in enumerate(days, 1)}
+
+
+async def run(path, repeat, truth):
+    conn = sqlite3.connect(path, isolation_level=None)
+    start = time.perf_counter()
+    apply_migrations(conn)
+    migrate_s = time.perf_counter() - start
+    stored = dict(conn.execute("SELECT event_id, starts_at FROM events"))
+    wrong = sum(stored[event_id] != ts for event_id, ts in truth.items())
+    assert wrong == 0, f"{wrong} events got a wrong year"
+    plan = ' '.join(row[-1] for row in conn.execute(
+        "EXPLAIN QUERY PLAN SELECT event_id FROM events WHERE chat_id = 0 AND status = 'open' "
+        "AND starts_at >= 0 ORDER BY starts_at, event_id LIMIT 5"))
+    assert 'idx_events_chat_status_starts' in plan, plan
+    conn.close()
+
+    db = Database(path, readers=1)
+    await db.open()
+    loop = asyncio.get_running_loop()
+
+    async def timed(coro_fn):
+        start = loop.time()
+        for _ in range(repeat):
+            await coro_fn()
+        return (loop.time() - start) / repeat * 1e6
+
+    # Старые события после миграции принадлежат чату LEGACY_CHAT_ID
+    upcoming_us = await timed(lambda: upcoming(db, LEGACY_CHAT_ID, limit=5))
+    past_us = await timed(lambda: past(db, LEGACY_CHAT_ID, limit=5))
+    now = datetime.now(EVENT_TZ)
+    month_us = await timed(lambda: between(db, LEGACY_CHAT_ID, now - timedelta(days=30), now))
+    legacy_us = await timed(lambda: db.fetchall(LEGACY_SQL))
+    await db.close()
+    return migrate_s, upcoming_us, past_us, month_us, legacy_us
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--seasons', type=int, nargs='+', default=[1, 10, 50])
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    check_parsing()
+    print(f"{'events':>7} | {'migrate, s':>10} | {'upcoming, µs':>12} {'past, µs':>9} "
+          f"{'30 days, µs':>11} | {'old list, µs':>12}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for seasons in args.seasons:
+            path = os.path.join(tmp, f"events_{seasons}.db")
+            truth = build_legacy(path, seasons)
+            migrate_s, upcoming_us, past_us, month_us, legacy_us = await run(path, args.repeat, truth)
+            print(f"{len(truth):>7} | {migrate_s:>10.3f} | {upcoming_us:>12.1f} {past_us:>9.1f} "
+                  f"{month_us:>11.1f} | {legacy_us:>12.1f}")
+    print("Проверки пройдены: разбор дат, годы после миграции, план запроса по индексу")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
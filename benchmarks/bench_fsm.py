@@ -0,0 +1,203 @@
+# Хранилище диалогов (FSM): накладные расходы шага диалога и сохранность.
+# Шаг диалога как в aiogram: get_state (его делает каждое обновление),
+# update_data, set_state. Сравниваются MemoryStorage, SQLiteStorage с
+# отложенной записью и та же SQLiteStorage с записью на каждом шаге.
+# Проверяется также создание события через меню (дата → тип → подтверждение)
+# с перезапуском хранилища посреди диалога, свой тип события с символами
+# разметки HTML и истечение брошенных диалогов.
+#
+# Запуск: python benchmarks/bench_fsm.py --dialogs 2000
+import os
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('TOKEN', '0:bench')
+
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.methods import TelegramMethod
+from aiogram.types import Update
+import scenarios
+from fake_bot_api import BOT_ID, FakeBotAPI
+
+STEPS = ('date', 'type', 'confirm')
+
+
+async def run_dialogs(storage, dialogs, write_through=False):
+    start = time.perf_counter()
+    for user_id in range(dialogs):
+        state = FSMContext(storage, StorageKey(BOT_ID, scenarios.GROUP_ID, user_id))
+        for step in STEPS:
+            await state.get_state()
+            await state.update_data({step: user_id})
+            await state.set_state(f"EventForm:{step}")
+            if write_through:
+                await storage.flush()
+    elapsed = time.perf_counter() - start
+    # Отложенная запись тоже входит в стоимость
+    close_start = time.perf_counter()
+    await storage.close()
+    elapsed += time.perf_counter() - close_start
+    return elapsed / (dialogs * len(STEPS)) * 1e6
+
+
+# Обновление мимо диалога: только поиск состояния
+async def idle_lookup(storage, lookups):
+    key = StorageKey(BOT_ID, scenarios.GROUP_ID, -1)
+    start = time.perf_counter()
+    for _ in range(lookups):
+        await storage.get_state(key)
+    return (time.perf_counter() - start) / lookups * 1e6
+
+
+async def feed(dp, bot, update):
+    update = Update.model_validate({'update_id': 0, **update}, context={'bot': bot})
+    result = await dp.feed_update(bot, update)
+    if isinstance(result, TelegramMethod):
+        await dp.silent_call_request(bot=bot, result=result)
+
+
+def last_markup(api, text):
+    for (chat_id, message_id), markup in reversed(api.markups.items()):
+        if text in api.messages[(chat_id, message_id)]:
+            return message_id, api.messages[(chat_id, message_id)], markup
+    raise RuntimeError(f"Сообщение «{text}» не найдено")
+
+
+# Тренер создаёт событие через меню; хранилище перезапускается после ввода даты
+async def check_dialog(hockey_bot, db, api):
+    from callbacks import CreateEvent, EventType, ConfirmEvent
+    from fsm_storage import SQLiteStorage
+
+    bot = api.bot()
+    menu = await bot.send_message(scenarios.GROUP_ID, "👑 Тренерское меню:")
+    storage = SQLiteStorage()
+    await storage.restore(db)
+    dp = hockey_bot.create_dispatcher(storage)
+    day = date.today() + timedelta(days=5)
+    await feed(dp, bot, scenarios.callback(scenarios.COACH_ID, scenarios.GROUP_ID, menu.message_id,
+                                           CreateEvent().pack(), "👑 Тренерское меню:"))
+    await feed(dp, bot, scenarios.message(scenarios.COACH_ID, scenarios.GROUP_ID, f"{day:%d.%m} 19:30"))
+    # Чужое сообщение в группе не продвигает диалог тренера
+    await feed(dp, bot, scenarios.message(scenarios.FIRST_PLAYER_ID, scenarios.GROUP_ID, "Тренировка"))
+    await storage.close()
+
+    storage = SQLiteStorage()
+    await storage.restore(db)
+    assert storage.stats['restored'] == 1, "dialog was not restored after restart"
+    dp = hockey_bot.create_dispatcher(storage)
+    message_id, text, _ = last_markup(api, "Выберите тип")
+    await feed(dp, bot, scenarios.callback(scenarios.COACH_ID, scenarios.GROUP_ID, message_id,
+                                           EventType(index=1).pack(), text))
+    message_id, text, _ = last_markup(api, "Создать событие")
+    await feed(dp, bot, scenarios.callback(scenarios.COACH_ID, scenarios.GROUP_ID, message_id,
+                                           ConfirmEvent().pack(), text))
+    await storage.close()
+
+    row = await db.fetchone("SELECT type, starts_at FROM events WHERE chat_id = ?", (scenarios.GROUP_ID,))
+    assert row is not None and row[0] == "Игра", f"event was not created: {row}"
+    assert hockey_bot.format_event_date(row[1]).endswith("19:30"), "time was lost"
+    last_markup(api, "Кто будет")
+    assert await db.fetchone("SELECT COUNT(*) FROM fsm_states") == (0,), "finished dialog was kept"
+
+    # Свой тип события с символами разметки HTML: подтверждение и публикация проходят
+    storage = SQLiteStorage()
+    await storage.restore(db)
+    dp = hockey_bot.create_dispatcher(storage)
+    custom = "Кубок <Лиги> & финал"
+    menu = await bot.send_message(scenarios.GROUP_ID, "👑 Тренерское меню:")
+    await feed(dp, bot, scenarios.callback(scenarios.COACH_ID, scenarios.GROUP_ID, menu.message_id,
+                                           CreateEvent().pack(), "👑 Тренерское меню:"))
+    await feed(dp, bot, scenarios.message(scenarios.COACH_ID, scenarios.GROUP_ID, f"{day:%d.%m} 20:00"))
+    await feed(dp, bot, scenarios.message(scenarios.COACH_ID, scenarios.GROUP_ID, custom))
+    message_id, text, _ = last_markup(api, "Создать событие")
+    await feed(dp, bot, scenarios.callback(scenarios.COACH_ID, scenarios.GROUP_ID, message_id,
+                                           ConfirmEvent().pack(), text))
+    await storage.close()
+    row = await db.fetchone("SELECT COUNT(*) FROM events WHERE chat_id = ? AND type = ?", (scenarios.GROUP_ID, custom))
+    assert row == (1,), "event with a custom type was not created"
+    assert "Кубок &lt;Лиги&gt; &amp; финал" in last_markup(api, "Кто будет")[1], "custom type was not escaped"
+
+
+# Брошенный диалог истекает в памяти и удаляется из базы, в том числе при запуске
+async def check_expiry(db):
+    from fsm_storage import SQLiteStorage
+
+    storage = SQLiteStorage(ttl=0.2)
+    await storage.restore(db)
+    key = StorageKey(BOT_ID, scenarios.GROUP_ID, 7)
+    await storage.set_state(key, "EventForm:date")
+    await storage.flush()
+    assert await db.fetchone("SELECT COUNT(*) FROM fsm_states") == (1,)
+    await asyncio.sleep(0.3)
+    assert await storage.get_state(key) is None, "abandoned dialog did not expire"
+    await storage.flush()
+    assert await db.fetchone("SELECT COUNT(*) FROM fsm_states") == (0,), "expired dialog stayed in the database"
+
+    await storage.set_state(key, "EventForm:date")
+    await storage.close()
+    await asyncio.sleep(0.3)
+    storage = SQLiteStorage(ttl=0.2)
+    await storage.restore(db)
+    assert storage.stats['restored'] == 0 and storage.stats['expired'] == 1, "stale dialog was restored"
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--dialogs', type=int, default=2000)
+    parser.add_argument('--lookups', type=int, default=100000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ['DB_PATH'] = os.path.join(tmp, 'fsm.db')
+        import hockey_bot
+        from fsm_storage import SQLiteStorage
+        from migrations import migrate
+
+        db = hockey_bot.db
+        api = FakeBotAPI()
+        await api.start()
+        await db.open()
+        try:
+            await migrate(db)
+            await db.execute("INSERT INTO users (user_id, name, last_chat_id) VALUES (?, 'Тренер', ?)",
+                             (scenarios.COACH_ID, scenarios.GROUP_ID))
+            await db.execute("INSERT INTO members (chat_id, user_id, name, is_coach) VALUES (?, ?, 'Тренер', 1)",
+                             (scenarios.GROUP_ID, scenarios.COACH_ID))
+            await hockey_bot.roles.load(db)
+
+            rows = [('MemoryStorage', MemoryStorage(), False)]
+            for name, write_through in (('SQLite, отложенная', False), ('SQLite, на каждом шаге', True)):
+                await db.execute("DELETE FROM fsm_states")
+                storage = SQLiteStorage()
+                await storage.restore(db)
+                storage.start()
+                rows.append((name, storage, write_through))
+            print(f"{args.dialogs} диалогов × {len(STEPS)} шага")
+            print(f"{'storage':>24} | {'мкс/шаг':>8} | {'get_state, мкс':>14} | {'транзакций':>10}")
+            for name, storage, write_through in rows:
+                idle = await idle_lookup(storage, args.lookups)
+                per_step = await run_dialogs(storage, args.dialogs, write_through)
+                flushes = storage.stats['flushes'] if isinstance(storage, SQLiteStorage) else 0
+                print(f"{name:>24} | {per_step:>8.1f} | {idle:>14.2f} | {flushes:>10}")
+            saved = await db.fetchone("SELECT COUNT(*) FROM fsm_states")
+            assert saved == (args.dialogs,), f"not every dialog was saved: {saved}"
+
+            await db.execute("DELETE FROM fsm_states")
+            await check_dialog(hockey_bot, db, api)
+            await check_expiry(db)
+        finally:
+            await db.close()
+            await api.stop()
+    print("Проверки пройдены: диалог создания события пережил перезапуск, свой тип экранируется, "
+          "брошенные диалоги истекают")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
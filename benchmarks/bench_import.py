@@ -0,0 +1,255 @@
+# Импорт игроков и расписания из файлов и выгрузка посещаемости.
+# Файлы по N строк: игроки (CSV «;», как сохраняет Excel), расписание (CSV)
+# и календарь (.ics с переносами строк, TZID, UTC и событиями на целый день);
+# в каждом есть испорченные строки. «По строке» — транзакция на строку,
+# «пачками» — import_export.import_file. Пока идёт импорт, другой чат пишет
+# отметки: их задержка показывает, не блокирует ли импорт остальных.
+# Проверяется: в базе ровно разобранные строки, повторный импорт ничего не
+# добавляет, прошедшие события закрыты и не попадают в статистику, у
+# предстоящих есть таймеры; выгрузка содержит все ответы и читается обратно.
+#
+# Запуск: python benchmarks/bench_import.py --rows 10000
+import os
+import sys
+import csv
+import time
+import random
+import asyncio
+import sqlite3
+import argparse
+import tempfile
+from datetime import datetime, timedelta, timezone
+from contextlib import redirect_stdout
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import Database
+from event_time import EVENT_TZ, to_timestamp
+from import_export import export_attendance, import_file, open_text, read_records, write_players
+from load_test import percentile
+from migrations import apply_migrations
+
+CHAT_ID = -1000000
+OTHER_CHAT_ID = -1000001
+FIRST_USER_ID = 100000
+BAD_EVERY = 97
+
+
+def write_players_csv(path, rows):
+    with open(path, 'w', encoding='utf-8-sig', newline='') as file:
+        writer = csv.writer(file, delimiter=';')
+        writer.writerow(['Имя', 'user_id', 'Рейтинг', 'Амплуа'])
+        for i in range(rows):
+            if i % BAD_EVERY == BAD_EVERY - 1:
+                writer.writerow([f"Игрок {i}", FIRST_USER_ID + i, "одиннадцать", "Н"])
+                continue
+            writer.writerow([f"Игрок {i}", FIRST_USER_ID + i, f"{1 + i % 90 / 10:.1f}".replace('.', ','),
+                             "НЗВ"[i % 3]])
+    return rows - rows // BAD_EVERY
+
+
+# Расписание: половина событий в прошлом, половина впереди; каждое десятое — повтор
+def write_events_csv(path, rows, now):
+    start = now - timedelta(days=rows // 2)
+    events = set()
+    with open(path, 'w', encoding='utf-8', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(['date', 'time', 'type'])
+        for i in range(rows):
+            if i % BAD_EVERY == BAD_EVERY - 1:
+                writer.writerow(['31.02.2025', '19:00', 'Игра'])
+                continue
+            day = start + timedelta(days=i - (i % 10 == 9))
+            event_type = "Игра" if i % 2 else "Тренировка"
+            if i % 10 == 9:
+                event_type = "Игра" if (i - 1) % 2 else "Тренировка"
+            writer.writerow([f"{day:%Y-%m-%d}", "19:30", event_type])
+            events.add((to_timestamp(day.replace(hour=19, minute=30, second=0, microsecond=0)), event_type))
+    return events
+
+
+# Календарь: время в TZID, в UTC и события на целый день; длинные строки перенесены
+def write_ical(path, rows, now):
+    with open(path, 'w', encoding='utf-8', newline='') as file:
+        file.write("BEGIN:VCALENDAR\r\nVERSION:2.0\r\n")
+        for i in range(rows):
+            day = now + timedelta(days=400 + i)
+            file.write("BEGIN:VEVENT\r\n")
+            if i % BAD_EVERY == BAD_EVERY - 1:
+                file.write("DTSTART:не дата\r\n")
+            elif i % 3 == 0:
+                file.write(f"DTSTART;TZID=Europe/Moscow:{day:%Y%m%d}T200000\r\n")
+            elif i % 3 == 1:
+                file.write(f"DTSTART:{day:%Y%m%d}T170000Z\r\n")
+            else:
+                file.write(f"DTSTART;VALUE=DATE:{day:%Y%m%d}\r\n")
+            file.write(f"SUMMARY:Игра с командой\\, которая\r\n  в лиге {i}\r\n")
+            file.write("END:VEVENT\r\n")
+        file.write("END:VCALENDAR\r\n")
+    return rows - rows // BAD_EVERY
+
+
+def prepare(path):
+    conn = sqlite3.connect(path, isolation_level=None)
+    with redirect_stdout(None):
+        apply_migrations(conn)
+    conn.execute("INSERT INTO users (user_id, name) VALUES (1, 'Игрок другого чата')")
+    conn.execute("INSERT INTO members (chat_id, user_id, name) VALUES (?, 1, 'Игрок другого чата')", (OTHER_CHAT_ID,))
+    event_id = conn.execute("INSERT INTO events (chat_id, date, type) VALUES (?, '', 'Игра')",
+                            (OTHER_CHAT_ID,)).lastrowid
+    conn.close()
+    return event_id
+
+
+# Отметки другого чата, пока выполняется work: задержка каждой транзакции
+async def with_other_chat(db, event_id, work):
+    latencies = []
+    running = True
+
+    async def taps():
+        going = True
+        while running:
+            start = time.perf_counter()
+            if going:
+                await db.execute("INSERT OR IGNORE INTO participants (event_id, user_id) VALUES (?, 1)", (event_id,))
+            else:
+                await db.execute("DELETE FROM participants WHERE event_id = ? AND user_id = 1", (event_id,))
+            latencies.append((time.perf_counter() - start) * 1000)
+            going = not going
+            await asyncio.sleep(0.005)
+
+    task = asyncio.create_task(taps())
+    start = time.perf_counter()
+    try:
+        result = await work()
+    finally:
+        elapsed = time.perf_counter() - start
+        running = False
+        await task
+    return result, elapsed, latencies
+
+
+# Прежний путь: транзакция на каждую строку
+async def row_by_row(db, path, limit):
+    file = open_text(path)
+    _, records = read_records(file)
+    rows = 0
+    for _, record in records:
+        if record is not None:
+            await db.transaction(lambda conn: write_players(conn, OTHER_CHAT_ID, [record]))
+        rows += 1
+        if rows == limit:
+            break
+    file.close()
+    return rows
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--ical', type=int, default=2000)
+    args = parser.parse_args()
+
+    now = datetime.now(EVENT_TZ).replace(hour=0, minute=0, second=0, microsecond=0)
+    with tempfile.TemporaryDirectory() as tmp:
+        players_csv = os.path.join(tmp, 'players.csv')
+        events_csv = os.path.join(tmp, 'events.csv')
+        calendar = os.path.join(tmp, 'calendar.ics')
+        valid_players = write_players_csv(players_csv, args.rows)
+        events = write_events_csv(events_csv, args.rows, now)
+        valid_ical = write_ical(calendar, args.ical, now)
+
+        path = os.path.join(tmp, 'import.db')
+        other_event = prepare(path)
+        db = Database(path)
+        await db.open()
+        try:
+            _, _, idle = await with_other_chat(db, other_event, lambda: asyncio.sleep(1))
+            print(f"отметки другого чата без импорта: p95 {percentile(idle, 0.95):.2f} мс")
+            print(f"{'':>22} | {'строк':>6} | {'время, с':>8} | {'строк/с':>8} | {'отметки другого чата p95, мс':>28}")
+
+            limit = min(args.rows, 1000)
+            rows, elapsed, latencies = await with_other_chat(
+                db, other_event, lambda: row_by_row(db, players_csv, limit))
+            print(f"{'игроки по строке':>22} | {rows:>6} | {elapsed:>8.2f} | {rows / elapsed:>8.0f} | "
+                  f"{percentile(latencies, 0.95):>28.2f}")
+
+            for name, file in (('игроки пачками', players_csv), ('расписание CSV', events_csv),
+                               ('календарь .ics', calendar)):
+                updates = []
+                report, elapsed, latencies = await with_other_chat(
+                    db, other_event, lambda: import_file(db, CHAT_ID, file, updates.append))
+                print(f"{name:>22} | {report['rows']:>6} | {elapsed:>8.2f} | {report['rows'] / elapsed:>8.0f} | "
+                      f"{percentile(latencies, 0.95):>28.2f}")
+                assert len(updates) >= report['rows'] // 1000, "progress was not reported per chunk"
+                if file == players_csv:
+                    assert report['added'] == valid_players, report
+                    assert len(report['bad_lines']) == args.rows // BAD_EVERY, report
+                elif file == events_csv:
+                    assert report['added'] == len(events), report
+                    assert report['duplicates'] == args.rows - args.rows // BAD_EVERY - len(events), report
+                else:
+                    assert report['added'] == valid_ical, report
+                    assert report['rows'] == args.ical, report
+            assert percentile(latencies, 0.95) < 200, "import blocks other chats"
+
+            # Повторный импорт ничего не добавляет
+            again = await import_file(db, CHAT_ID, players_csv)
+            assert again['added'] == 0 and again['updated'] == valid_players, again
+            again = await import_file(db, CHAT_ID, events_csv)
+            assert again['added'] == 0, again
+
+            conn = sqlite3.connect(path)
+            members = conn.execute("SELECT COUNT(*) FROM members WHERE chat_id = ?", (CHAT_ID,)).fetchone()[0]
+            goalies = conn.execute("SELECT COUNT(*) FROM members WHERE chat_id = ? AND position = 'G'",
+                                   (CHAT_ID,)).fetchone()[0]
+            stored = set(conn.execute("SELECT starts_at, type FROM events WHERE chat_id = ? AND type IN "
+                                      "('Игра', 'Тренировка')", (CHAT_ID,)))
+            wrong_past = conn.execute('''SELECT COUNT(*) FROM events WHERE chat_id = ? AND starts_at < ?
+                                         AND (status = 'open' OR counted = 0)''',
+                                      (CHAT_ID, to_timestamp(now - timedelta(days=1)))).fetchone()[0]
+            open_events = conn.execute("SELECT COUNT(*) FROM events WHERE chat_id = ? AND status = 'open'",
+                                       (CHAT_ID,)).fetchone()[0]
+            closes = conn.execute("SELECT COUNT(*) FROM timers WHERE kind = 'close'").fetchone()[0]
+            utc = to_timestamp(datetime.combine((now + timedelta(days=401)).date(), datetime.min.time(),
+                                                tzinfo=timezone.utc).replace(hour=17))
+            summary = conn.execute("SELECT type FROM events WHERE starts_at = ?", (utc,)).fetchone()
+            conn.close()
+            assert members == valid_players and goalies == sum(
+                1 for i in range(args.rows) if i % 3 == 2 and i % BAD_EVERY != BAD_EVERY - 1)
+            assert stored == events, "schedule in the database differs from the file"
+            assert wrong_past == 0, "past events were imported open or counted as held"
+            assert closes == open_events, "upcoming events have no timers"
+            assert summary == ("Игра с командой, которая в лиге 1",), summary
+
+            # Выгрузка: ответы игроков по событиям чата
+            rng = random.Random(1)
+            event_ids = [row[0] for row in await db.fetchall(
+                "SELECT event_id FROM events WHERE chat_id = ? LIMIT 200", (CHAT_ID,))]
+            answers = {(event_id, FIRST_USER_ID + i): rng.random() < 0.7
+                       for event_id in event_ids for i in range(0, 40) if i % BAD_EVERY != BAD_EVERY - 1}
+
+            def mark_all(conn):
+                conn.executemany("INSERT INTO participants (event_id, user_id) VALUES (?, ?)",
+                                 [key for key, going in answers.items() if going])
+                conn.executemany("INSERT INTO declined (event_id, user_id) VALUES (?, ?)",
+                                 [key for key, going in answers.items() if not going])
+
+            await db.transaction(mark_all)
+            export = os.path.join(tmp, 'attendance.csv')
+            start = time.perf_counter()
+            rows = await db.read(lambda conn: export_attendance(conn, CHAT_ID, export))
+            elapsed = time.perf_counter() - start
+            with open(export, encoding='utf-8-sig', newline='') as file:
+                exported = {(int(row['event_id']), int(row['user_id'])): row['ответ'] == 'Буду'
+                            for row in csv.DictReader(file, delimiter=';')}
+            assert rows == len(answers) and exported == answers, "export differs from attendance"
+            print(f"выгрузка: {rows} ответов за {elapsed * 1000:.0f} мс")
+        finally:
+            await db.close()
+    print("Проверки пройдены: импортированы ровно разобранные строки, повтор ничего не добавляет, "
+          "прошедшие события в архиве, выгрузка совпадает с отметками")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
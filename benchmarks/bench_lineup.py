@@ -0,0 +1,67 @@
+# Бенчмарк составов: время form_lines и качество деления на команды.
+# Для каждого размера состава генерируются игроки со случайными рейтингами
+# и амплуа; сравнивается разброс средних рейтингов команд (max - min)
+# у прежнего случайного перемешивания, «змейки» по рейтингу и локального поиска.
+#
+# Запуск: python benchmarks/bench_lineup.py --sizes 10 20 40 60 100 --trials 20
+import os
+import sys
+import time
+import random
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from lineup import (TIME_BUDGET, DEFENSE, FORWARD, GOALIE, Player, form_lines, random_lines,
+                    snake_assignment, spread, team_count)
+
+
+def make_roster(size, rng):
+    players = [Player(i, f"Игрок {i}", round(rng.uniform(1, 10), 1), rng.choice((FORWARD,) * 3 + (DEFENSE,) * 2))
+               for i in range(size)]
+    goalies = [Player(size + g, f"Вратарь {g}", round(rng.uniform(1, 10), 1), GOALIE)
+               for g in range(max(1, team_count(size)))]
+    return players + goalies
+
+
+def check(lineup, roster):
+    placed = [p for line in lineup.teams for p in line] + [p for keepers in lineup.goalies for p in keepers]
+    assert sorted(p.user_id for p in placed) == sorted(p.user_id for p in roster), "players lost or duplicated"
+    sizes = [len(line) for line in lineup.teams]
+    assert max(sizes) - min(sizes) <= 1, f"unbalanced team sizes {sizes}"
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 20, 40, 60, 100])
+    parser.add_argument('--trials', type=int, default=20)
+    parser.add_argument('--budget', type=float, default=TIME_BUDGET)
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    print(f"{'players':>7} {'teams':>5} | {'random':>7} {'snake':>7} {'search':>7} | "
+          f"{'p50, ms':>7} {'max, ms':>7}")
+    for size in args.sizes:
+        random_spread, snake_spread, search_spread, times = [], [], [], []
+        for trial in range(args.trials):
+            roster = make_roster(size, rng)
+            skaters = [p for p in roster if p.position != GOALIE]
+            ratings = np.array([p.rating for p in skaters])
+            teams = team_count(len(skaters))
+            random_spread.append(random_lines(roster, seed=trial))
+            snake_spread.append(spread(ratings, snake_assignment(ratings, teams), teams))
+            start = time.perf_counter()
+            lineup = form_lines(roster, time_budget=args.budget, seed=trial)
+            times.append((time.perf_counter() - start) * 1000)
+            check(lineup, roster)
+            search_spread.append(lineup.spread)
+        print(f"{size:>7} {teams:>5} | {statistics.mean(random_spread):>7.3f} "
+              f"{statistics.mean(snake_spread):>7.3f} {statistics.mean(search_spread):>7.3f} | "
+              f"{statistics.median(times):>7.1f} {max(times):>7.1f}")
+    print("Разброс — среднее по прогонам (max - min) средних рейтингов команд, меньше — лучше")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+# Метрики: накладные расходы и содержимое /metrics.
+# 1) Сколько стоит наблюдение гистограммы и middleware вокруг пустого обработчика.
+# 2) Сценарий load_test (/start, «✅ Буду», /form_teams) с включёнными метриками:
+#    ответ /metrics проверяется на нужные серии, печатаются самые медленные
+#    обработчики и SQL-запросы по среднему времени.
+#
+# Запуск: python benchmarks/bench_metrics.py --players 100
+import os
+import re
+import sys
+import time
+import socket
+import asyncio
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('TOKEN', '0:bench')
+
+from aiohttp import ClientSession
+from fake_bot_api import FakeBotAPI
+from load_test import UNLIMITED, LoadTest, UpdateTimer
+import scenarios
+
+
+def micro(repeat=200000):
+    import metrics
+    from metrics import Histogram, HandlerMetricsMiddleware, handler_seconds
+    json_log, metrics.METRICS_JSON_LOG = metrics.METRICS_JSON_LOG, False
+    histogram = Histogram('bench', 'bench', ('handler',))
+    start = time.perf_counter()
+    for _ in range(repeat):
+        histogram.observe(0.003, 'mark_callback')
+    observe_ns = (time.perf_counter() - start) / repeat * 1e9
+
+    async def handler(event, data):
+        return None
+
+    middleware = HandlerMetricsMiddleware('message')
+
+    async def run():
+        data = {}
+        start = time.perf_counter()
+        for _ in range(repeat // 10):
+            await handler(None, data)
+        plain = time.perf_counter() - start
+        start = time.perf_counter()
+        for _ in range(repeat // 10):
+            await middleware(handler, None, data)
+        return (time.perf_counter() - start - plain) / (repeat // 10) * 1e9
+
+    middleware_ns = asyncio.run(run())
+    # Замеры не должны попасть в отчёт сценария
+    handler_seconds.values.clear()
+    metrics.METRICS_JSON_LOG = json_log
+    return observe_ns, middleware_ns
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+# Средние по сериям гистограммы: {метки: (count, mean)}
+def means(text, name):
+    sums, counts = {}, {}
+    for labels, value in re.findall(rf'^{name}_sum\{{(.*)\}} (\S+)$', text, re.M):
+        sums[labels] = float(value)
+    for labels, value in re.findall(rf'^{name}_count\{{(.*)\}} (\S+)$', text, re.M):
+        counts[labels] = int(value)
+    return {labels: (counts[labels], sums[labels] / counts[labels]) for labels in counts if counts[labels]}
+
+
+async def scenario(players, latency):
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ['DB_PATH'] = os.path.join(tmp, 'metrics.db')
+        import hockey_bot
+        from metrics import ApiMetricsMiddleware, observe_sql, start_metrics_server, watch_loop_lag
+        from migrations import migrate
+        from outbox import Outbox, OutboxMiddleware
+
+        api = FakeBotAPI(latency=latency)
+        await api.start()
+        api.admins[scenarios.GROUP_ID] = {scenarios.COACH_ID}
+        bot = api.bot()
+        outbox = Outbox(UNLIMITED, UNLIMITED, UNLIMITED)
+        bot.session.middleware(OutboxMiddleware(outbox))
+        bot.session.middleware(ApiMetricsMiddleware())
+        db = hockey_bot.db
+        await db.open()
+        db.observer = observe_sql
+        port = free_port()
+        runner = await start_metrics_server('127.0.0.1', port)
+        lag = asyncio.create_task(watch_loop_lag(0.05))
+        try:
+            await migrate(db)
+            await db.execute("INSERT INTO users (user_id, name, last_chat_id) VALUES (?, 'Тренер', ?)",
+                             (scenarios.COACH_ID, scenarios.GROUP_ID))
+            await db.execute("INSERT INTO members (chat_id, user_id, name, is_coach) VALUES (?, ?, 'Тренер', 1)",
+                             (scenarios.GROUP_ID, scenarios.COACH_ID))
+            await hockey_bot.roles.load(db)
+            timer = UpdateTimer()
+            dp = hockey_bot.create_dispatcher()
+            dp.update.outer_middleware(timer)
+            polling = asyncio.create_task(dp.start_polling(bot, handle_signals=False, polling_timeout=10))
+            await asyncio.sleep(0.2)
+            try:
+                await LoadTest(hockey_bot, api, timer, rate=0).run(players, None)
+            finally:
+                await dp.stop_polling()
+                await polling
+            await outbox.close()
+            async with ClientSession() as session:
+                async with session.get(f"http://127.0.0.1:{port}/metrics") as response:
+                    assert response.status == 200
+                    text = await response.text()
+        finally:
+            lag.cancel()
+            await runner.cleanup()
+            await db.close()
+            await api.stop()
+    return text
+
+
+async def main_async(args):
+    text = await scenario(args.players, args.latency)
+    for series in ('handler="mark_callback",route="Mark"', 'handler="start_command"',
+                   'handler="form_teams_start"', 'hockey_sql_rows_bucket', 'method="SendMessage"',
+                   'hockey_loop_lag_seconds_count'):
+        assert series in text, f"{series} missing from /metrics"
+
+    print("Обработчики (среднее время):")
+    for labels, (count, mean) in sorted(means(text, 'hockey_handler_seconds').items(), key=lambda x: -x[1][1]):
+        print(f"  {mean * 1000:8.2f} мс × {count:<5} {labels}")
+    print("SQL (самые медленные):")
+    for labels, (count, mean) in sorted(means(text, 'hockey_sql_seconds').items(), key=lambda x: -x[1][1])[:8]:
+        print(f"  {mean * 1e6:8.1f} мкс × {count:<5} {labels}")
+    print("Bot API:")
+    for labels, (count, mean) in sorted(means(text, 'hockey_api_seconds').items()):
+        print(f"  {mean * 1000:8.2f} мс × {count:<5} {labels}")
+    print(f"Размер ответа /metrics: {len(text.encode())} байт")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--players', type=int, default=100)
+    parser.add_argument('--latency', type=float, default=0.02)
+    args = parser.parse_args()
+
+    observe_ns, middleware_ns = micro()
+    print(f"Histogram.observe: {observe_ns:.0f} нс, middleware обработчика: {middleware_ns:.0f} нс на обновление")
+    asyncio.run(main_async(args))
+    print("Проверки пройдены: серии обработчиков, SQL, Bot API и цикла событий есть в /metrics")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+# Бенчмарк очереди исходящих сообщений (outbox.py) на локальном фейковом Bot API.
+# Рассылаем пачки сообщений по многим личным чатам и серию коротких текстов
+# в одну группу, считаем реальные запросы к API, склейки, повторы после 429
+# и время ожидания в очереди.
+#
+# Запуск: python benchmarks/bench_outbox.py --chats 50 --per-chat 4 --group-texts 30 --flood-rate 0.05
+import os
+import sys
+import time
+import asyncio
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_bot_api import FakeBotAPI
+from outbox import Outbox, OutboxMiddleware
+
+GROUP_ID = -1001
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--chats', type=int, default=50)
+    parser.add_argument('--per-chat', type=int, default=4)
+    parser.add_argument('--group-texts', type=int, default=30)
+    parser.add_argument('--global-rate', type=float, default=30)
+    parser.add_argument('--latency', type=float, default=0.02)
+    parser.add_argument('--flood-rate', type=float, default=0.05)
+    args = parser.parse_args()
+
+    api = FakeBotAPI(latency=args.latency, flood_rate=args.flood_rate, retry_after=1)
+    await api.start()
+    bot = api.bot()
+    outbox = Outbox(global_rate=args.global_rate)
+    bot.session.middleware(OutboxMiddleware(outbox))
+
+    jobs = [bot.send_message(chat, f"Сообщение {i} в чат {chat}")
+            for i in range(args.per_chat) for chat in range(1, args.chats + 1)]
+    jobs += [bot.send_message(GROUP_ID, f"- колонка {i}") for i in range(args.group_texts)]
+
+    start = time.perf_counter()
+    await asyncio.gather(*jobs)
+    elapsed = time.perf_counter() - start
+    await outbox.close()
+    await api.stop()
+
+    # Максимум сообщений за любую секунду в одном чате (по данным фейкового API)
+    def peak_per_second(times):
+        return max((sum(1 for t in times if s <= t < s + 1) for s in times), default=0)
+
+    requested = args.chats * args.per_chat + args.group_texts
+    metrics = outbox.metrics()
+    print(f"requested sends: {requested}, sendMessage calls: {api.calls['sendMessage']}, "
+          f"429 responses: {sum(api.floods.values())}")
+    print(f"elapsed: {elapsed:.2f} s, delivered/s: {metrics['sent'] / elapsed:.1f} "
+          f"(global limit {args.global_rate:g}/s)")
+    print(f"peak messages per private chat in 1 s: "
+          f"{max(peak_per_second(api.sent_at[c]) for c in range(1, args.chats + 1))}, "
+          f"group: {args.group_texts} texts -> {len(api.sent_at[GROUP_ID])} messages")
+    print(f"queue metrics: {metrics}")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,125 @@
+# Бенчмарк постраничных клавиатур.
+# Строит базу с N игроками в чате команды (и теми же игроками под другими
+# именами в соседнем чате), листает список целиком вперёд и назад через
+# KeysetPaginator (проверяя, что каждый игрок встречается ровно один раз),
+# сравнивает стоимость последней страницы с выборкой через OFFSET и
+# размер клавиатуры со старой «все пользователи в одной клавиатуре».
+#
+# Запуск: python benchmarks/bench_pagination.py --sizes 300 3000 30000
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiogram.types import InlineKeyboardButton
+from callbacks import SelectCoach
+from database import Database
+from migrations import migrate
+from pagination import KeysetPaginator, PageNav, PAGE_SIZE
+
+CHAT_ID = -1001
+OTHER_CHAT_ID = -1002
+FIRST = ['Иван', 'Пётр', 'Сергей', 'Алексей', 'Дмитрий', 'Павел', 'Олег', 'Игорь']
+LAST = ['Иванов', 'Петров', 'Сидоров', 'Смирнов', 'Кузнецов', 'Попов', 'Волков', 'Зайцев']
+
+
+def render(user):
+    return InlineKeyboardButton(text=user[1], callback_data=SelectCoach(user_id=user[0]).pack())
+
+
+def user_ids(markup):
+    return [SelectCoach.unpack(row[0].callback_data).user_id for row in markup.inline_keyboard
+            if row[0].callback_data.startswith('c:')]
+
+
+async def walk(pager, db, query=''):
+    seen = []
+    markup = await pager.keyboard(db, query=query, tenant=CHAT_ID)
+    pages = 0
+    while markup is not None:
+        pages += 1
+        seen += user_ids(markup)
+        nav = {b.text: b for b in markup.inline_keyboard[-1] if b.text in ('◀️', '▶️')}
+        if '▶️' not in nav:
+            break
+        data = PageNav.unpack(nav['▶️'].callback_data)
+        markup = await pager.keyboard(db, data.cursor, data.forward, data.query, CHAT_ID)
+    return seen, pages, markup
+
+
+async def run(size, repeat, tmp):
+    db = Database(os.path.join(tmp, f"users_{size}.db"), readers=2)
+    await db.open()
+    await migrate(db)
+    await db.executemany("INSERT INTO users (user_id, name) VALUES (?, ?)",
+                         [(100000 + i, f"{random.choice(FIRST)} {random.choice(LAST)}") for i in range(size)])
+    await db.execute("INSERT INTO members (chat_id, user_id, name) SELECT ?, user_id, name FROM users", (CHAT_ID,))
+    # В соседнем чате те же игроки с другим порядком имён: курсор и страницы не должны его задевать
+    await db.execute("INSERT INTO members (chat_id, user_id, name) SELECT ?, user_id, 'Я' || name FROM users",
+                     (OTHER_CHAT_ID,))
+    pager = KeysetPaginator(f"b{size}", 'members', 'user_id', 'name', keys=['name', 'user_id'],
+                            render=render, search='name', tenant='chat_id')
+
+    # Полный проход вперёд, затем назад с последней страницы
+    seen, pages, last = await walk(pager, db)
+    assert sorted(seen) == list(range(100000, 100000 + size)), "forward walk lost or duplicated rows"
+    back = []
+    markup = last
+    while markup is not None:
+        nav = {b.text: b for b in markup.inline_keyboard[-1] if b.text in ('◀️', '▶️')}
+        back = user_ids(markup) + back
+        if '◀️' not in nav:
+            break
+        data = PageNav.unpack(nav['◀️'].callback_data)
+        markup = await pager.keyboard(db, data.cursor, data.forward, data.query, CHAT_ID)
+    assert back == seen, "backward walk differs from forward walk"
+
+    # Последняя страница: keyset по курсору против OFFSET
+    cursor = seen[-PAGE_SIZE - 1] if size > PAGE_SIZE else None
+    start = time.perf_counter()
+    for _ in range(repeat):
+        await pager.fetch(db, cursor, True, tenant=CHAT_ID)
+    keyset_us = (time.perf_counter() - start) / repeat * 1e6
+    offset = max(0, size - PAGE_SIZE)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        await db.fetchall("SELECT user_id, name FROM members WHERE chat_id = ? "
+                          "ORDER BY name, user_id LIMIT ? OFFSET ?", (CHAT_ID, PAGE_SIZE + 1, offset))
+    offset_us = (time.perf_counter() - start) / repeat * 1e6
+
+    # Поиск по префиксу
+    found, _, _ = await walk(pager, db, query='Олег')
+    expected = await db.fetchone("SELECT COUNT(*) FROM users WHERE name LIKE 'Олег%'")
+    assert len(found) == expected[0], "prefix search mismatch"
+
+    # Размер старой клавиатуры со всеми пользователями
+    users = await db.fetchall("SELECT user_id, name FROM users")
+    full = json.dumps([[{'text': u[1], 'callback_data': SelectCoach(user_id=u[0]).pack()}] for u in users])
+    page = (await pager.keyboard(db, tenant=CHAT_ID)).model_dump_json(exclude_none=True)
+    await db.close()
+    return pages, keyset_us, offset_us, len(full.encode()), len(page.encode())
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[300, 3000, 30000])
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    print(f"{'users':>7} | {'pages':>6} | {'last page keyset, µs':>20} {'OFFSET, µs':>11} | "
+          f"{'old markup, B':>13} {'page markup, B':>14}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in args.sizes:
+            pages, keyset_us, offset_us, full, page = await run(size, args.repeat, tmp)
+            print(f"{size:>7} | {pages:>6} | {keyset_us:>20.1f} {offset_us:>11.1f} | {full:>13} {page:>14}")
+    print("Проверки пройдены: проход вперёд/назад без потерь и повторов, поиск по префиксу")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
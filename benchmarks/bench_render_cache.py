@@ -0,0 +1,157 @@
+# Кэш готовых списков событий и меню.
+# «Без кэша» — каждое нажатие строит список заново (запрос к базе, текст,
+# клавиатура), «с кэшем» — render_cache отдаёт готовое, пока версия событий
+# чата не изменилась. Считаются запросы к базе на показ и доля попаданий.
+# Точность сброса: случайная смесь показов и создания событий в разных чатах;
+# каждый показ сравнивается с построенным заново, а число построений — с
+# ожидаемым (ровно одно после каждого изменения, в других чатах — ни одного).
+#
+# Запуск: python benchmarks/bench_render_cache.py --chats 20 --events 8 --views 20000
+import os
+import sys
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+import itertools
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('TOKEN', '0:bench')
+
+FIRST_CHAT_ID = -1000000
+COACH_ID = 1
+VIEWS = ('events', 'events_to_mark')
+
+
+# Сообщение, на которое бот отвечает: ответы запоминаются
+class FakeMessage:
+    _ids = itertools.count(1)
+
+    def __init__(self, chat_id, user_id=COACH_ID):
+        self.chat = SimpleNamespace(id=chat_id, type='supergroup')
+        self.from_user = SimpleNamespace(id=user_id, full_name="Тренер")
+        self.answers = []
+
+    async def answer(self, text, reply_markup=None, **kwargs):
+        self.answers.append((text, reply_markup))
+        return SimpleNamespace(message_id=next(self._ids))
+
+
+async def show(hockey_bot, view, chat_id):
+    message = FakeMessage(chat_id)
+    if view == 'events':
+        await hockey_bot.show_events(message, chat_id)
+        return message.answers[-1][0]
+    await hockey_bot.show_events_to_mark(message, chat_id)
+    return message.answers[-1][1]
+
+
+async def build(hockey_bot, view, chat_id):
+    if view == 'events':
+        return await hockey_bot.events_text(chat_id)
+    return await hockey_bot.events_pager.keyboard(hockey_bot.db, tenant=chat_id)
+
+
+async def timed_views(fn, views, chats, queries):
+    rng = random.Random(1)
+    before = queries[0]
+    start = time.perf_counter()
+    for _ in range(views):
+        await fn(rng.choice(VIEWS), FIRST_CHAT_ID - rng.randrange(chats))
+    elapsed = time.perf_counter() - start
+    return elapsed / views * 1e6, (queries[0] - before) / views
+
+
+# Случайная смесь показов и новых событий: показ всегда совпадает с построенным
+# заново, а строится ровно тогда, когда вид чата не строился после изменения
+async def check_exact(hockey_bot, chats, steps):
+    cache = hockey_bot.render_cache
+    rng = random.Random(2)
+    # Виды, уже построенные на текущей версии своего чата
+    fresh = {(view, chat_id) for (view, chat_id, _), (version, _) in cache._entries.items()
+             if view in VIEWS and version == cache.version(chat_id)}
+    expected_misses = 0
+    misses_before = cache.stats['misses']
+    starts_at = int(time.time()) + 86400
+    for step in range(steps):
+        chat_id = FIRST_CHAT_ID - rng.randrange(chats)
+        if rng.random() < 0.1:
+            await hockey_bot.publish_event(FakeMessage(chat_id), chat_id, starts_at + step * 60, "Игра")
+            fresh = {key for key in fresh if key[1] != chat_id}
+            continue
+        view = rng.choice(VIEWS)
+        if (view, chat_id) not in fresh:
+            expected_misses += 1
+            fresh.add((view, chat_id))
+        shown = await show(hockey_bot, view, chat_id)
+        assert shown == await build(hockey_bot, view, chat_id), f"stale {view} for chat {chat_id}"
+    misses = cache.stats['misses'] - misses_before
+    assert misses == expected_misses, f"rebuilt {misses} times, expected {expected_misses}"
+    return misses, steps
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--chats', type=int, default=20)
+    parser.add_argument('--events', type=int, default=8)
+    parser.add_argument('--views', type=int, default=20000)
+    parser.add_argument('--steps', type=int, default=3000, help='шагов проверки точности сброса')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ['DB_PATH'] = os.path.join(tmp, 'render.db')
+        import hockey_bot
+        from migrations import migrate
+
+        db = hockey_bot.db
+        queries = [0]
+
+        def observe(label, seconds, rows):
+            queries[0] += 1
+
+        await db.open()
+        try:
+            await migrate(db)
+            db.observer = observe
+            starts_at = int(time.time()) + 86400
+            await db.execute("INSERT INTO users (user_id, name) VALUES (?, 'Тренер')", (COACH_ID,))
+            for n in range(args.chats):
+                chat_id = FIRST_CHAT_ID - n
+                await db.execute("INSERT INTO members (chat_id, user_id, name, is_coach) VALUES (?, ?, 'Тренер', 1)",
+                                 (chat_id, COACH_ID))
+                await db.executemany("INSERT INTO events (chat_id, date, type, starts_at) VALUES (?, '', 'Игра', ?)",
+                                     [(chat_id, starts_at + i * 86400) for i in range(args.events)])
+            await hockey_bot.roles.load(db)
+
+            print(f"{args.chats} чатов × {args.events} событий, {args.views} показов списков")
+            print(f"{'':>10} | {'мкс/показ':>10} | {'запросов/показ':>14}")
+            per_view, sql = await timed_views(lambda view, chat_id: build(hockey_bot, view, chat_id),
+                                              args.views, args.chats, queries)
+            print(f"{'без кэша':>10} | {per_view:>10.1f} | {sql:>14.3f}")
+            per_view, sql = await timed_views(lambda view, chat_id: show(hockey_bot, view, chat_id),
+                                              args.views, args.chats, queries)
+            print(f"{'с кэшем':>10} | {per_view:>10.1f} | {sql:>14.3f}")
+            assert sql <= 2 * args.chats / args.views, "cached views still query the database"
+            print(f"доля попаданий: {hockey_bot.render_cache.metrics()['hit_rate']:.3f}")
+
+            misses, steps = await check_exact(hockey_bot, args.chats, args.steps)
+            print(f"точность сброса: {steps} шагов, построений {misses} — ровно после изменений")
+
+            # Главное меню: одно сообщение, клавиатура строится один раз на роль
+            for user_id in (COACH_ID, 2) * 50:
+                message = FakeMessage(FIRST_CHAT_ID, user_id)
+                await hockey_bot.show_main_menu(message, FIRST_CHAT_ID)
+                assert len(message.answers) == 1, "main menu is sent more than once"
+                keyboard = [row[0].text for row in message.answers[0][1].keyboard]
+                assert keyboard.count("👑 Тренерское меню") == (user_id == COACH_ID)
+            menus = sum(1 for key in hockey_bot.render_cache._entries if key[0] == 'menu')
+            assert menus == 2, f"{menus} menu keyboards built for 2 roles"
+        finally:
+            await db.close()
+    print("Проверки пройдены: показы совпадают с построенными заново, сброс точный, меню — одно сообщение")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
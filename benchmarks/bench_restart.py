@@ -0,0 +1,413 @@
+# Быстрый перезапуск: продолжение с последнего обработанного обновления,
+# снимок кэшей и резервная копия работающей базы.
+# Бот запускается отдельным процессом (python hockey_bot.py) против локального
+# фейкового Bot API, как в bench_workers; лимиты очереди исходящих сняты.
+# 1. Перезапуск под нагрузкой: игроки C чатов непрерывно нажимают «Буду» и
+#    «Не буду», посреди потока бот получает SIGINT и сразу запускается снова.
+#    Проверяется: на каждое нажатие ровно один ответ, отметки в базе совпадают
+#    с последними нажатиями, getUpdates не подтверждает обновления, которых
+#    процесс не получал. Отдельно — что после новой нумерации Telegram
+#    обновления не отбрасываются.
+# 2. Холодный и тёплый старт: пока бот остановлен, копятся обновления (список
+#    событий из личного чата и отметки в группах). Запуск без снимка кэшей и со
+#    снимком: время до готовности, до первого ответа и до ответа на всю очередь,
+#    сколько раз кэши обращались к базе.
+# 3. Резервная копия базы на M МБ, пока бот пишет отметки: задержка записей при
+#    копировании шагами по BACKUP_PAGES страниц и одним шагом; копия проходит
+#    integrity_check и содержит всё записанное до её завершения; шаг копирует
+#    не больше BACKUP_PAGES страниц и держит базу меньше 50 мс. С копией одним
+#    шагом задержки сравниваются, только если шагов не меньше MIN_STEPS. Для сравнения —
+#    копирование с отдельного соединения, которое начинается заново после
+#    каждой записи.
+#
+# Запуск: python benchmarks/bench_restart.py --chats 20 --players 10 --mb 40
+import os
+import re
+import sys
+import time
+import random
+import shutil
+import signal
+import asyncio
+import sqlite3
+import argparse
+import tempfile
+import subprocess
+from collections import Counter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from aiohttp import ClientSession
+from backup import Backups
+from bench_workers import EVENT_MESSAGE_ID, build, free_port, metric, player_id
+from callbacks import Mark
+from database import Database
+from fake_bot_api import BOT_ID, FakeBotAPI
+from load_test import percentile
+from warm_start import UpdateOffset
+import scenarios
+
+UNLIMITED = '1000000'
+EVENTS_BUTTON = "📅 Просмотреть события"
+# С копией одним шагом сравниваем, только если шагов не меньше
+MIN_STEPS = 16
+
+
+# Фейковый API, считающий ответы на каждое нажатие
+class CountingAPI(FakeBotAPI):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.answers = Counter()
+        # Наибольший номер, полученный текущим процессом бота, и подтверждения
+        # (offset) обновлений, которых он не получал
+        self.delivered = 0
+        self.early_acks = 0
+
+    def api_answerCallbackQuery(self, params):
+        self.answers[params['callback_query_id']] += 1
+        return super().api_answerCallbackQuery(params)
+
+    async def api_getUpdates(self, params):
+        if int(params.get('offset') or 0) > self.delivered + 1:
+            self.early_acks += 1
+        batch = await super().api_getUpdates(params)
+        self.delivered = max([self.delivered] + [update['update_id'] for update in batch])
+        return batch
+
+    # Ответы на «Просмотреть события» в личных чатах
+    def event_lists(self):
+        return sum(1 for (chat_id, _), text in self.messages.items()
+                   if chat_id > 0 and "Активные события" in text)
+
+
+class BotProcess:
+    def __init__(self, api, path, log, port=0):
+        self.port = port
+        env = dict(os.environ, TOKEN=f"{BOT_ID}:fake", BOT_API_URL=api.url, DB_PATH=path,
+                   WORKERS='0', METRICS_PORT=str(port), BACKUP_INTERVAL='0', PYTHONUNBUFFERED='1',
+                   OUTBOX_GLOBAL_RATE=UNLIMITED, OUTBOX_PRIVATE_RATE=UNLIMITED, OUTBOX_GROUP_RATE=UNLIMITED)
+        api.delivered = 0
+        self.log = log
+        self._log = open(log, 'a')
+        self.started = time.monotonic()
+        self.process = subprocess.Popen([sys.executable, os.path.join(ROOT, 'hockey_bot.py')], env=env,
+                                        stdout=self._log, stderr=subprocess.STDOUT)
+
+    def check(self):
+        if self.process.poll() is not None:
+            raise RuntimeError(f"бот завершился, см. {self.log}")
+
+    async def metrics(self):
+        async with ClientSession() as session:
+            async with session.get(f"http://127.0.0.1:{self.port}/metrics") as response:
+                return await response.text()
+
+    # Остановка как при деплое; возвращает, сколько секунд она заняла
+    async def stop(self):
+        start = time.monotonic()
+        self.process.send_signal(signal.SIGINT)
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(None, self.process.wait, 60)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            raise RuntimeError(f"бот не остановился за 60 с, см. {self.log}")
+        finally:
+            self._log.close()
+        assert self.process.returncode == 0, f"бот завершился с кодом {self.process.returncode}"
+        return time.monotonic() - start
+
+
+async def wait_for(condition, timeout, bot=None, what=''):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if bot is not None:
+            bot.check()
+        if time.monotonic() > deadline:
+            raise RuntimeError(f"не дождались: {what}")
+        await asyncio.sleep(0.005)
+    return time.monotonic()
+
+
+def tap(api, events, n, i, going):
+    chat_id = list(events)[n]
+    data = Mark(event_id=events[chat_id], going=going).pack()
+    update = scenarios.callback(player_id(n, i), chat_id, EVENT_MESSAGE_ID, data, "Кто будет?")
+    api.push_update(update)
+    return update['callback_query']['id']
+
+
+# 1. Нажатия идут потоком, бот перезапускается посреди него
+async def restart_under_load(api, path, tmp, events, players, rate, seconds):
+    rng = random.Random(1)
+    pressed = []
+    last = {}
+    pushing = True
+
+    async def press():
+        while pushing:
+            n, i, going = rng.randrange(len(events)), rng.randrange(players), rng.random() < 0.6
+            pressed.append(tap(api, events, n, i, going))
+            last[(list(events.values())[n], player_id(n, i))] = going
+            await asyncio.sleep(1 / rate)
+
+    log = os.path.join(tmp, 'restart.log')
+    bot = BotProcess(api, path, log)
+    await wait_for(lambda: api.calls['getUpdates'], 30, bot, "запуск бота")
+    pusher = asyncio.create_task(press())
+    await asyncio.sleep(seconds)
+    stopping = len(pressed)
+    shutdown = await bot.stop()
+    # Новый экземпляр запускается сразу, нажатия тем временем копятся
+    bot = BotProcess(api, path, log)
+    waiting = len(pressed)
+    gap = await wait_for(lambda: all(api.answers[cb] for cb in pressed[stopping:waiting]), 60, bot,
+                         "ответы на нажатия, накопившиеся за перезапуск") - bot.started
+    await asyncio.sleep(seconds)
+    pushing = False
+    await pusher
+    await wait_for(lambda: all(api.answers[cb] for cb in pressed), 60, bot, "ответы на все нажатия")
+    await bot.stop()
+
+    conn = sqlite3.connect(path)
+    going = set(conn.execute("SELECT event_id, user_id FROM participants"))
+    declined = set(conn.execute("SELECT event_id, user_id FROM declined"))
+    conn.close()
+    assert set(api.answers) >= set(pressed), "some taps were lost over the restart"
+    assert all(api.answers[cb] == 1 for cb in pressed), \
+        f"taps answered twice: {sum(api.answers[cb] > 1 for cb in pressed)}"
+    assert not api.early_acks, f"getUpdates confirmed updates the bot never received: {api.early_acks}"
+    assert {key for key, value in last.items() if value} == going, "marks differ from the last taps"
+    assert {key for key, value in last.items() if not value} == declined, "declines differ from the last taps"
+    return len(pressed), shutdown, gap
+
+
+# Повторы после перезапуска отбрасываются только рядом с сохранённым номером;
+# номер намного меньше — новая нумерация Telegram, такие обновления обрабатываются
+def check_offset():
+    offsets = UpdateOffset(window=100)
+    offsets.resumed = offsets._last = 5000
+    assert not offsets.begin(5000) and not offsets.begin(4901), "redelivered update was handled again"
+    assert offsets.begin(3), "update after the numbering reset was dropped"
+    offsets.done(3)
+    assert offsets.begin(4) and offsets.resumed is None, "reset did not forget the saved offset"
+    offsets.done(4)
+    assert offsets.offset() == 4, f"offset after the reset: {offsets.offset()}"
+    return offsets.stats
+
+
+# Очередь, которая ждёт запуска: список событий из личного чата и отметка в группе
+def backlog(api, events, players):
+    taps = []
+    for n in range(len(events)):
+        for i in range(players):
+            api.push_update(scenarios.message(player_id(n, i), player_id(n, i), EVENTS_BUTTON))
+            taps.append(tap(api, events, n, i, True))
+    return taps
+
+
+# 2. Запуск с очередью обновлений: без снимка кэшей и со снимком
+async def cold_and_warm(api, template, tmp, events, players):
+    base = os.path.join(tmp, 'base.db')
+    shutil.copy(template, base)
+    bot = BotProcess(api, base, os.path.join(tmp, 'warmup.log'))
+    lists = api.event_lists()
+    taps = backlog(api, events, players)
+    await wait_for(lambda: all(api.answers[cb] for cb in taps) and
+                   api.event_lists() == lists + len(taps), 60, bot, "прогрев кэшей")
+    await bot.stop()
+
+    results = {}
+    for name in ('без снимка', 'со снимком'):
+        path = os.path.join(tmp, f"start{len(results)}.db")
+        shutil.copy(base, path)
+        if name == 'со снимком':
+            shutil.copy(base + '.snapshot', path + '.snapshot')
+        lists = api.event_lists()
+        taps = backlog(api, events, players)
+        log = os.path.join(tmp, f"start{len(results)}.log")
+        bot = BotProcess(api, path, log, port=free_port())
+        first = await wait_for(lambda: any(api.answers[cb] for cb in taps) or api.event_lists() > lists,
+                               60, bot, "первый ответ")
+        done = await wait_for(lambda: all(api.answers[cb] for cb in taps) and
+                              api.event_lists() == lists + len(taps), 60, bot, "ответы на очередь")
+        text = await bot.metrics()
+        await bot.stop()
+        with open(log) as file:
+            ready = float(re.search(r"готов принимать обновления через (\S+) с", file.read()).group(1))
+        queries = sum(int(n) for n in re.findall(r'^hockey_sql_seconds_count\{.*\} (\d+)$', text, re.M))
+        results[name] = {
+            'ready': ready,
+            'first': first - bot.started,
+            'done': done - bot.started,
+            'loaded': metric(text, 'hockey_snapshot_loaded'),
+            'roster_loads': metric(text, 'hockey_attendance_loads'),
+            'render_misses': metric(text, 'hockey_render_cache_misses'),
+            'tenant_reads': metric(text, 'hockey_tenants_reads'),
+            'queries': queries,
+            'updates': len(taps) * 2,
+        }
+    assert results['со снимком']['loaded'] == 1 and results['без снимка']['loaded'] == 0
+    assert results['со снимком']['roster_loads'] == 0 and results['со снимком']['tenant_reads'] == 0, \
+        "warm caches still read the database"
+    return results
+
+
+def fill(path, mb):
+    conn = sqlite3.connect(path, isolation_level=None)
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("CREATE TABLE filler (id INTEGER PRIMARY KEY, data BLOB)")
+    conn.execute("CREATE TABLE taps (id INTEGER PRIMARY KEY)")
+    conn.execute("BEGIN")
+    conn.executemany("INSERT INTO filler (data) VALUES (?)", ((os.urandom(1000),) for _ in range(mb * 1000)))
+    conn.execute("COMMIT")
+    conn.close()
+
+
+# Запись отметок каждые 5 мс, пока выполняется work: задержка, номера
+# записанных и сколько из них записано до начала work
+async def with_taps(db, work):
+    latencies, committed = [], []
+    running = True
+
+    async def taps():
+        while running:
+            start = time.perf_counter()
+            committed.append(await db.execute("INSERT INTO taps DEFAULT VALUES"))
+            latencies.append((time.perf_counter() - start) * 1000)
+            await asyncio.sleep(0.005)
+
+    task = asyncio.create_task(taps())
+    await asyncio.sleep(0.1)
+    before = len(committed)
+    start = time.perf_counter()
+    result = await work()
+    elapsed = time.perf_counter() - start
+    running = False
+    await task
+    return result, elapsed, latencies, (committed, before)
+
+
+# Копирование с отдельного соединения: после каждой записи начинается заново
+def separate_connection(path, target, pages, timeout):
+    restarts, remaining = 0, None
+    deadline = time.monotonic() + timeout
+
+    def progress(status, left, total):
+        nonlocal restarts, remaining
+        if remaining is not None and left > remaining:
+            restarts += 1
+        remaining = left
+        if time.monotonic() > deadline:
+            raise TimeoutError()
+
+    source, copy = sqlite3.connect(path), sqlite3.connect(target)
+    try:
+        source.backup(copy, pages=pages, sleep=0.005, progress=progress)
+        finished = True
+    except TimeoutError:
+        finished = False
+    source.close()
+    copy.close()
+    return restarts, finished
+
+
+# 3. Резервная копия, пока идёт запись
+async def backup_under_writes(tmp, mb, pages):
+    path = os.path.join(tmp, 'backup.db')
+    fill(path, mb)
+    db = Database(path)
+    await db.open()
+    rows = []
+    try:
+        _, _, idle, _ = await with_taps(db, lambda: asyncio.sleep(1))
+        rows.append(('без копирования', 0, 1, idle, 0, 0.0))
+        for name, step in ((f"по {pages} страниц", pages), ('одним шагом', -1)):
+            backups = Backups(db, directory=os.path.join(tmp, f"backups{step}"), pages=step, pause=0.005)
+            copy, elapsed, latencies, (committed, before) = await with_taps(db, backups.backup)
+            rows.append((name, backups.stats['steps'], elapsed, latencies, backups.stats['last_step_pages'],
+                         backups.stats['last_step_ms']))
+            conn = sqlite3.connect(copy)
+            pages_total = conn.execute("PRAGMA page_count").fetchone()[0]
+            # Ни один шаг не копирует больше заданного; одним шагом — вся база сразу
+            assert backups.stats['last_step_pages'] == (min(step, pages_total) if step > 0 else pages_total), \
+                f"backup step copied {backups.stats['last_step_pages']} of {pages_total} pages"
+            assert conn.execute("PRAGMA integrity_check").fetchone()[0] == 'ok', "backup is corrupt"
+            saved = {row[0] for row in conn.execute("SELECT id FROM taps WHERE id >= ?", (committed[0],))}
+            conn.close()
+            # Копия — состояние базы на момент окончания: записанное до него целиком, после — ничего
+            assert saved == set(committed[:len(saved)]), "backup is not a consistent state of the database"
+            # Одним шагом копия не пускает записи, пока не закончится
+            assert len(saved) > before or step < 0, "writes made during the backup are missing from it"
+        (restarts, finished), _, _, _ = await with_taps(db, lambda: asyncio.get_running_loop().run_in_executor(
+            None, separate_connection, path, os.path.join(tmp, 'separate.db'), pages, 10))
+    finally:
+        await db.close()
+    return os.path.getsize(path), rows, restarts, finished
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--chats', type=int, default=20)
+    parser.add_argument('--players', type=int, default=10)
+    parser.add_argument('--rate', type=float, default=100, help='нажатий в секунду во время перезапуска')
+    parser.add_argument('--seconds', type=float, default=2, help='секунд нагрузки до и после перезапуска')
+    parser.add_argument('--mb', type=int, default=40, help='размер базы для резервной копии, МБ')
+    parser.add_argument('--pages', type=int, default=256, help='BACKUP_PAGES')
+    args = parser.parse_args()
+
+    api = CountingAPI(latency=0.005)
+    await api.start()
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            template = os.path.join(tmp, 'template.db')
+            events = build(template, args.chats, args.players)
+
+            stats = check_offset()
+            print(f"повторы после перезапуска: отброшено {stats['skipped']}, "
+                  f"новая нумерация Telegram распознана {stats['resets']} раз")
+            path = os.path.join(tmp, 'restart.db')
+            shutil.copy(template, path)
+            taps, shutdown, gap = await restart_under_load(api, path, tmp, events, args.players,
+                                                           args.rate, args.seconds)
+            print(f"перезапуск под нагрузкой: {taps} нажатий, остановка {shutdown:.1f} с, "
+                  f"ответы на накопившиеся через {gap:.1f} с после запуска; потеряно 0, повторно 0")
+
+            results = await cold_and_warm(api, template, tmp, events, args.players)
+            print(f"{'запуск':>11} | {'готов, с':>8} | {'1-й ответ, с':>12} | {'очередь, с':>10} | "
+                  f"{'после готовности, мс':>20} | "
+                  f"{'загрузок составов':>17} | {'промахов кэша':>13} | {'чтений групп':>12} | {'запросов к базе':>15}")
+            for name, row in results.items():
+                print(f"{name:>11} | {row['ready']:>8.2f} | {row['first']:>12.2f} | {row['done']:>10.2f} | "
+                      f"{(row['done'] - row['ready']) * 1000:>20.0f} | "
+                      f"{row['roster_loads']:>17.0f} | {row['render_misses']:>13.0f} | {row['tenant_reads']:>12.0f} | "
+                      f"{row['queries']:>15}")
+            print(f"(очередь: {results['со снимком']['updates']} обновлений)")
+
+            size, rows, restarts, finished = await backup_under_writes(tmp, args.mb, args.pages)
+            print(f"резервная копия базы {size / 2 ** 20:.0f} МБ, запись отметок каждые 5 мс:")
+            print(f"{'':>16} | {'шагов':>6} | {'время, с':>8} | {'запись p50, мс':>14} | {'p95, мс':>8} | "
+                  f"{'max, мс':>8} | {'шаг, страниц':>12} | {'шаг, мс':>8}")
+            for name, steps, elapsed, latencies, step_pages, step_ms in rows:
+                print(f"{name:>16} | {steps:>6} | {elapsed:>8.2f} | {percentile(latencies, 0.5):>14.2f} | "
+                      f"{percentile(latencies, 0.95):>8.2f} | {max(latencies):>8.2f} | {step_pages:>12} | "
+                      f"{step_ms:>8.2f}")
+            print(f"копия с отдельного соединения: начиналась заново {restarts} раз, "
+                  f"{'завершилась' if finished else 'не завершилась за 10 с'}")
+            (_, steps, _, stepped, _, step_ms), whole = rows[1], rows[2]
+            assert percentile(stepped, 0.95) < 50, "writes stalled during the stepped backup"
+            assert step_ms < 50, f"a backup step held the database for {step_ms:.1f} ms"
+            # Сравнение с копией одним шагом имеет смысл, только когда она держит
+            # базу во много раз дольше шага; на маленькой базе оба — доли миллисекунды
+            if steps >= MIN_STEPS:
+                assert step_ms < whole[5], "a backup step held the database as long as the whole copy"
+                assert max(stepped) < max(whole[3]), "stepped backup blocked writes as long as a single step"
+    finally:
+        await api.stop()
+    print("Проверки пройдены: перезапуск без потерь и повторов, тёплые кэши не читают базу, "
+          "копия целая и не останавливает запись")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
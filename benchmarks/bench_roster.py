@@ -0,0 +1,106 @@
+# Бенчмарк запросов состава события при росте истории отметок.
+# Для каждого размера строится база со старой схемой (без индексов), затем её
+# копия обновляется миграциями на месте, и на обеих измеряются запрос состава
+# (как в mark_callback / form_teams_start) и сама отметка.
+#
+# Запуск: python benchmarks/bench_roster.py --sizes 1000 10000 100000 200000
+import os
+import sys
+import time
+import random
+import shutil
+import sqlite3
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from migrations import MIGRATIONS, apply_migrations
+from tenants import LEGACY_CHAT_ID
+
+ROSTER_SQL = '''SELECT u.name FROM participants p
+                JOIN users u ON p.user_id = u.user_id
+                WHERE p.event_id = ?'''
+# После разделения по чатам имена берутся из участников команды события
+MEMBERS_ROSTER_SQL = '''SELECT m.name FROM participants p
+                        JOIN members m ON m.chat_id = ? AND m.user_id = p.user_id
+                        WHERE p.event_id = ?'''
+PLAYERS_PER_EVENT = 25
+
+
+def build_legacy(path, marks, players):
+    conn = sqlite3.connect(path)
+    conn.executescript(MIGRATIONS[0][2])
+    conn.executemany("INSERT INTO users (user_id, name) VALUES (?, ?)",
+                     [(i, f"Игрок {i}") for i in range(players)])
+    events = max(1, marks // PLAYERS_PER_EVENT)
+    conn.executemany("INSERT INTO events (event_id, date, type, status) VALUES (?, '25.10', 'Игра', 'closed')",
+                     [(e,) for e in range(1, events + 1)])
+    conn.executemany("INSERT INTO participants (event_id, user_id) VALUES (?, ?)",
+                     [(1 + i // PLAYERS_PER_EVENT, random.randrange(players)) for i in range(marks)])
+    conn.commit()
+    conn.close()
+    return events
+
+
+def time_per_op(fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1e6
+
+
+def measure(path, events, players, repeat, legacy):
+    conn = sqlite3.connect(path, isolation_level=None)
+
+    def roster():
+        if legacy:
+            conn.execute(ROSTER_SQL, (random.randint(1, events),)).fetchall()
+        else:
+            conn.execute(MEMBERS_ROSTER_SQL, (LEGACY_CHAT_ID, random.randint(1, events))).fetchall()
+
+    def mark():
+        event_id, user_id = random.randint(1, events), random.randrange(players)
+        conn.execute("BEGIN")
+        if legacy:
+            conn.execute("DELETE FROM participants WHERE event_id = ? AND user_id = ?", (event_id, user_id))
+            conn.execute("INSERT INTO participants (event_id, user_id) VALUES (?, ?)", (event_id, user_id))
+        else:
+            conn.execute("INSERT OR IGNORE INTO participants (event_id, user_id) VALUES (?, ?)", (event_id, user_id))
+        conn.execute("COMMIT")
+
+    result = time_per_op(roster, repeat), time_per_op(mark, repeat)
+    conn.close()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000, 200000])
+    parser.add_argument('--players', type=int, default=300)
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    print(f"{'marks':>8} | {'roster old, µs':>14} {'roster new, µs':>14} | "
+          f"{'mark old, µs':>12} {'mark new, µs':>12} | {'migrate, s':>10}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in args.sizes:
+            legacy_path = os.path.join(tmp, f"legacy_{size}.db")
+            events = build_legacy(legacy_path, size, args.players)
+            migrated_path = os.path.join(tmp, f"migrated_{size}.db")
+            shutil.copy(legacy_path, migrated_path)
+
+            conn = sqlite3.connect(migrated_path, isolation_level=None)
+            start = time.perf_counter()
+            apply_migrations(conn)
+            migrate_s = time.perf_counter() - start
+            conn.close()
+
+            roster_old, mark_old = measure(legacy_path, events, args.players, args.repeat, legacy=True)
+            roster_new, mark_new = measure(migrated_path, events, args.players, args.repeat, legacy=False)
+            print(f"{size:>8} | {roster_old:>14.1f} {roster_new:>14.1f} | "
+                  f"{mark_old:>12.1f} {mark_new:>12.1f} | {migrate_s:>10.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+# Нагрузочный тест правок сообщения события: серия одновременных нажатий
+# «✅ Буду» проходит через настоящий mark_callback и локальный фейковый Bot API.
+# Старый обработчик делал одну правку на каждое нажатие. Отметка из личного
+# чата (напоминание) обновляет и сообщение события в группе.
+#
+# Запуск: python benchmarks/bench_roster_edits.py --taps 40 --burst 1.0 --flood-rate 0.1
+import os
+import sys
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('TOKEN', '0:bench')
+
+from fake_bot_api import FakeBotAPI
+from callbacks import Mark
+
+GROUP_ID = -1001
+
+
+def make_callback(bot, user_id, event_id, message_id, reply_markup, chat=None):
+    from aiogram import types
+    return types.CallbackQuery.model_validate({
+        'id': f"cb{user_id}",
+        'from': {'id': user_id, 'is_bot': False, 'first_name': f"Игрок {user_id}"},
+        'chat_instance': 'bench',
+        'data': Mark(event_id=event_id, going=True).pack(),
+        'message': {
+            'message_id': message_id,
+            'date': int(time.time()),
+            'chat': chat or {'id': GROUP_ID, 'type': 'group'},
+            'text': 'poll',
+            'reply_markup': reply_markup.model_dump(),
+        },
+    }, context={'bot': bot})
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--taps', type=int, default=40)
+    parser.add_argument('--burst', type=float, default=1.0, help='за сколько секунд приходят нажатия')
+    parser.add_argument('--interval', type=float, default=1.0, help='окно объединения правок, с')
+    parser.add_argument('--latency', type=float, default=0.03, help='задержка фейкового API, с')
+    parser.add_argument('--flood-rate', type=float, default=0.0, help='доля ответов 429')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ['DB_PATH'] = os.path.join(tmp, 'bench.db')
+        import hockey_bot
+        from migrations import migrate
+
+        api = FakeBotAPI(latency=args.latency, flood_rate=args.flood_rate)
+        await api.start()
+        bot = api.bot()
+        hockey_bot.roster_updater.interval = args.interval
+        await hockey_bot.db.open()
+        try:
+            await migrate(hockey_bot.db)
+            event_id = await hockey_bot.db.execute("INSERT INTO events (chat_id, date, type) VALUES (?, '25.10', 'Игра')",
+                                                   (GROUP_ID,))
+            keyboard = hockey_bot.InlineKeyboardMarkup(inline_keyboard=[[
+                hockey_bot.InlineKeyboardButton(text="✅ Буду", callback_data=Mark(event_id=event_id, going=True).pack()),
+                hockey_bot.InlineKeyboardButton(text="❌ Не буду", callback_data=Mark(event_id=event_id, going=False).pack()),
+            ]])
+            api.flood_rate = 0
+            poll = await bot.send_message(GROUP_ID, "🏒 Игра 25.10\nКто будет?", reply_markup=keyboard)
+            await hockey_bot.db.execute("UPDATE events SET group_msg_id = ? WHERE event_id = ?",
+                                        (poll.message_id, event_id))
+            api.flood_rate = args.flood_rate
+            api.reset()
+
+            failed = 0
+
+            async def tap(user_id):
+                nonlocal failed
+                await asyncio.sleep(random.uniform(0, args.burst))
+                callback = make_callback(bot, user_id, event_id, poll.message_id, keyboard)
+                try:
+                    answer = await hockey_bot.mark_callback(callback, Mark.unpack(callback.data))
+                    await answer
+                except Exception:
+                    failed += 1
+
+            start = time.perf_counter()
+            await asyncio.gather(*(tap(i) for i in range(1, args.taps + 1)))
+            await hockey_bot.roster_updater.flush_all()
+            elapsed = time.perf_counter() - start
+
+            # Игрок команды отмечается из личного чата (напоминание) — сообщение
+            # события в группе тоже показывает его
+            api.flood_rate = 0
+            private_id = args.taps + 1
+
+            def join(conn):
+                conn.execute("INSERT INTO users (user_id, name) VALUES (?, ?)", (private_id, f"Игрок {private_id}"))
+                conn.execute("INSERT INTO members (chat_id, user_id, name) VALUES (?, ?, ?)",
+                             (GROUP_ID, private_id, f"Игрок {private_id}"))
+
+            await hockey_bot.db.transaction(join)
+            reminder = await bot.send_message(private_id, "⏰ Игра 25.10", reply_markup=keyboard)
+            callback = make_callback(bot, private_id, event_id, reminder.message_id, keyboard,
+                                     chat={'id': private_id, 'type': 'private', 'first_name': "Игрок"})
+            await (await hockey_bot.mark_callback(callback, Mark.unpack(callback.data)))
+            await hockey_bot.roster_updater.flush_all()
+        finally:
+            await hockey_bot.db.close()
+            await api.stop()
+
+    final_text = api.messages[(GROUP_ID, poll.message_id)]
+    complete = all(f"Игрок {i}" in final_text for i in range(1, args.taps + 1))
+    private_shown = f"Игрок {args.taps + 1}" in final_text
+    print(f"taps: {args.taps} in {args.burst:.1f} s, settled after {elapsed:.2f} s")
+    print(f"editMessageText calls: {api.calls['editMessageText']} (before: {args.taps}), "
+          f"429 responses: {sum(api.floods.values())}")
+    print(f"answerCallbackQuery calls: {api.calls['answerCallbackQuery']}, failed handlers: {failed}")
+    print(f"updater stats: {hockey_bot.roster_updater.stats}")
+    print(f"final message lists every player: {complete}")
+    print(f"private mark shown in the group message: {private_shown}")
+    assert private_shown, "a mark from a private chat did not update the group message"
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
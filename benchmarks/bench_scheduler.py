@@ -0,0 +1,282 @@
+# Планировщик закрытия событий и напоминаний.
+# Простой: тысячи будущих таймеров в куче и несколько наступающих за время
+# замера — сколько запросов к базе делает планировщик, кроме самих
+# срабатываний (опрос базы раз в POLL секунд дал бы 1/POLL запросов в секунду),
+# и с какой задержкой после срока срабатывают таймеры.
+# Рассылка: C чатов по P игроков, часть ответила «Буду», часть «Не буду»,
+# остальным должно прийти ровно одно напоминание — через фейковый Bot API
+# и очередь исходящих с её лимитами. Посреди рассылки планировщик
+# останавливается и запускается заново, а второй экземпляр («другой процесс»)
+# загружает те же таймеры — повторов быть не должно. Пока идёт рассылка,
+# в группы уходят обычные сообщения: их задержка не должна расти вместе с очередью.
+# Давно прошедшие события закрываются при запуске.
+# Событие без времени («/create_event 25.10 Тренировка») закрывается в конце
+# своего дня, а не в 06:00 дня игры, напоминание о нём — в REMIND_HOUR;
+# миграция переносит таймеры таких событий, созданных раньше.
+#
+# Запуск: python benchmarks/bench_scheduler.py --chats 10 --players 30
+import os
+import sys
+import time
+import asyncio
+import sqlite3
+import argparse
+import tempfile
+from collections import Counter
+from datetime import datetime, time as day_start, timedelta
+from contextlib import redirect_stdout
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import Database
+from fake_bot_api import FakeBotAPI
+from load_test import percentile
+from callbacks import Mark
+from event_time import EVENT_TZ, current_event, to_timestamp
+from migrations import MIGRATIONS, apply_migrations
+from outbox import Outbox, OutboxMiddleware
+from scheduler import CLOSE, EVENT_CLOSE_AFTER, REMIND, REMIND_HOUR, Scheduler, schedule_event
+
+FIRST_CHAT_ID = -1000000
+REMIND_BEFORE = 3600
+CLOSE_AFTER = 3600
+POLL = 5
+
+
+def player(n, i):
+    return 100000 + n * 1000 + i
+
+
+# Чаты с игроками; в каждом — событие «завтра» (напоминание через lead секунд)
+# и давно прошедшее открытое событие. Возвращает, кому положено напоминание
+def prepare(path, chats, players, lead):
+    conn = sqlite3.connect(path, isolation_level=None)
+    with redirect_stdout(None):
+        apply_migrations(conn)
+    now = time.time()
+    expected = set()
+    conn.execute("BEGIN")
+    for n in range(chats):
+        chat_id = FIRST_CHAT_ID - n
+        users = [(player(n, i), f"Игрок {player(n, i)}") for i in range(players)]
+        conn.executemany("INSERT INTO users (user_id, name) VALUES (?, ?)", users)
+        conn.executemany("INSERT INTO members (chat_id, user_id, name) VALUES (?, ?, ?)",
+                         [(chat_id, *user) for user in users])
+        starts_at = int(now + REMIND_BEFORE + lead)
+        event_id = conn.execute("INSERT INTO events (chat_id, date, type, starts_at) VALUES (?, '', 'Игра', ?)",
+                                (chat_id, starts_at)).lastrowid
+        schedule_event(conn, event_id, chat_id, starts_at, close_after=CLOSE_AFTER, remind_before=REMIND_BEFORE)
+        for i, (user_id, _) in enumerate(users):
+            if i % 4 == 0:
+                conn.execute("INSERT INTO participants (event_id, user_id) VALUES (?, ?)", (event_id, user_id))
+            elif i % 4 == 1:
+                conn.execute("INSERT INTO declined (event_id, user_id) VALUES (?, ?)", (event_id, user_id))
+            else:
+                expected.add((user_id, event_id))
+        stale = conn.execute("INSERT INTO events (chat_id, date, type, starts_at) VALUES (?, '', 'Тренировка', ?)",
+                             (chat_id, int(now - 30 * 86400))).lastrowid
+        schedule_event(conn, stale, chat_id, int(now - 30 * 86400), close_after=CLOSE_AFTER,
+                       remind_before=REMIND_BEFORE)
+    conn.execute("COMMIT")
+    conn.close()
+    return expected
+
+
+# Планировщик, запоминающий задержку срабатывания таймеров
+class TimedScheduler(Scheduler):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.lags = []
+
+    async def _fire(self, due):
+        now = time.time()
+        self.lags.extend((now - due_at) * 1000 for due_at, _, _, _ in due)
+        await super()._fire(due)
+
+
+async def open_scheduler(path, bot, queries=None):
+    db = Database(path)
+    if queries is not None:
+        db.observer = lambda label, seconds, rows: queries.update([label])
+    await db.open()
+    scheduler = TimedScheduler(db, close_after=CLOSE_AFTER, remind_before=REMIND_BEFORE, batch_size=30)
+    with redirect_stdout(None):
+        await scheduler.restore()
+    scheduler.start(bot)
+    return db, scheduler
+
+
+async def stop_scheduler(db, scheduler):
+    await scheduler.close()
+    await db.close()
+
+
+# Простой: будущие таймеры в куче; к базе планировщик обращается только
+# при срабатывании. Таймеры закрытия событий отдельного чата наступают раз в
+# секунду (время в базе — целые секунды, поэтому задержка — от начала секунды)
+async def idle(path, bot, timers, seconds):
+    conn = sqlite3.connect(path, isolation_level=None)
+    with redirect_stdout(None):
+        apply_migrations(conn)
+    conn.execute("BEGIN")
+    now = int(time.time())
+    far = now + 30 * 86400
+    starts = [far + i * 60 for i in range(timers)] + [now + 1 + i - CLOSE_AFTER for i in range(int(seconds))]
+    for starts_at in starts:
+        event_id = conn.execute("INSERT INTO events (chat_id, date, type, starts_at) VALUES (?, '', 'Игра', ?)",
+                                (FIRST_CHAT_ID - 999, starts_at)).lastrowid
+        schedule_event(conn, event_id, FIRST_CHAT_ID - 999, starts_at, now=far,
+                       close_after=CLOSE_AFTER, remind_before=REMIND_BEFORE)
+    conn.execute("COMMIT")
+    conn.close()
+    queries = Counter()
+    db, scheduler = await open_scheduler(path, bot, queries)
+    loaded = scheduler.stats['timers']
+    queries.clear()
+    await asyncio.sleep(seconds)
+    await stop_scheduler(db, scheduler)
+    fires = queries.pop('tx:fire_timers', 0)
+    assert scheduler.stats['fired'] == len(scheduler.lags) == int(seconds), "timers fired more than once"
+    return loaded, fires, dict(queries), scheduler.lags
+
+
+def local(day, hour=0, minute=0):
+    return to_timestamp(datetime.combine(day, day_start(hour, minute), tzinfo=EVENT_TZ))
+
+
+def timers_of(conn, event_id):
+    return dict(conn.execute("SELECT kind, due_at FROM timers WHERE event_id = ?", (event_id,)))
+
+
+# События без времени: таймеры новых событий и перенос таймеров миграцией
+async def check_all_day(path):
+    today = datetime.now(EVENT_TZ).date()
+    game_day = today + timedelta(days=3)
+    conn = sqlite3.connect(path, isolation_level=None)
+    with redirect_stdout(None):
+        apply_migrations(conn, [m for m in MIGRATIONS if m[0] <= 10])
+    # Созданные до миграции: полночь сегодня (уже закрыто в 06:00), полночь
+    # через три дня и событие со временем — таймеры по прежнему правилу
+    events = {}
+    for name, starts_at, status in (('today', local(today), 'closed'), ('later', local(game_day), 'open'),
+                                    ('timed', local(game_day, 19, 30), 'open')):
+        events[name] = conn.execute("INSERT INTO events (chat_id, date, type, starts_at, status) "
+                                    "VALUES (?, '', 'Тренировка', ?, ?)", (FIRST_CHAT_ID, starts_at, status)).lastrowid
+        schedule_event(conn, events[name], FIRST_CHAT_ID, starts_at, now=0)
+    conn.execute("DELETE FROM timers WHERE event_id = ?", (events['today'],))
+    with redirect_stdout(None):
+        apply_migrations(conn)
+    today_timers, later, timed = (timers_of(conn, events[name]) for name in ('today', 'later', 'timed'))
+    reopened = conn.execute("SELECT status, all_day FROM events WHERE event_id = ?", (events['today'],)).fetchone()
+    flags = [row[0] for row in conn.execute("SELECT all_day FROM events ORDER BY event_id")]
+
+    # Новое событие без времени
+    fresh = conn.execute("INSERT INTO events (chat_id, date, type, starts_at, all_day) VALUES (?, '', 'Игра', ?, 1)",
+                         (FIRST_CHAT_ID - 1, local(game_day))).lastrowid
+    schedule_event(conn, fresh, FIRST_CHAT_ID - 1, local(game_day), all_day=True)
+    fresh_timers = timers_of(conn, fresh)
+    conn.close()
+
+    end_of_game_day = local(game_day + timedelta(days=1))
+    assert fresh_timers[CLOSE] == end_of_game_day, "a date-only event closes before its day is over"
+    assert fresh_timers[REMIND] == local(game_day - timedelta(days=1), REMIND_HOUR), "reminder is not at REMIND_HOUR"
+    assert later == fresh_timers and reopened == ('open', 1) and flags == [1, 1, 0], "migration missed date-only events"
+    assert today_timers == {CLOSE: local(today + timedelta(days=1))}, "today's event was not reopened until midnight"
+    assert timed[CLOSE] == int(local(game_day, 19, 30) + EVENT_CLOSE_AFTER), "migration moved a timed event"
+    # В 07:00 дня игры событие ещё текущее (раньше к этому времени оно закрывалось)
+    db = Database(path)
+    await db.open()
+    event = await current_event(db, FIRST_CHAT_ID - 1, now=datetime.combine(game_day, day_start(7), tzinfo=EVENT_TZ))
+    await db.close()
+    assert event is not None and event[0] == fresh and fresh_timers[CLOSE] > local(game_day, 7)
+    print(f"событие без времени: закрытие в 00:00 следующего дня, напоминание накануне в {REMIND_HOUR}:00; "
+          f"миграция перенесла таймеры 2 событий, сегодняшнее открыто снова")
+
+
+def reminders_sent(api):
+    sent = Counter()
+    for (chat_id, message_id), text in api.messages.items():
+        if chat_id > 0 and "Вы ещё не отметились" in text:
+            event_id = api.markups[(chat_id, message_id)]['inline_keyboard'][0][0]['callback_data']
+            sent[(chat_id, event_id)] += 1
+    return sent
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--chats', type=int, default=10)
+    parser.add_argument('--players', type=int, default=30)
+    parser.add_argument('--timers', type=int, default=10000, help='будущих таймеров в простое')
+    parser.add_argument('--idle', type=float, default=3, help='секунд простоя')
+    args = parser.parse_args()
+
+    api = FakeBotAPI(latency=0.01)
+    await api.start()
+    outbox = Outbox()
+    bot = api.bot()
+    bot.session.middleware(OutboxMiddleware(outbox))
+    outbox.start()
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'scheduler.db')
+            loaded, fires, queries, lags = await idle(os.path.join(tmp, 'idle.db'), bot, args.timers, args.idle)
+            print(f"простой: {loaded} таймеров в куче, за {args.idle:.0f} с срабатываний {fires}, "
+                  f"других запросов к базе: {sum(queries.values())} (опрос раз в {POLL} с: {args.idle / POLL:.1f})")
+            print(f"срабатывание после срока: p50 {percentile(lags, 0.5):.1f} мс, "
+                  f"p95 {percentile(lags, 0.95):.1f} мс")
+            assert not queries, f"scheduler queried the database while idle: {queries}"
+            assert max(lags) < 100, "timers fired late"
+
+            await check_all_day(os.path.join(tmp, 'all_day.db'))
+
+            expected = prepare(path, args.chats, args.players, lead=1)
+
+            # Рассылка с перезапуском посреди неё и вторым экземпляром
+            db, first = await open_scheduler(path, bot)
+            start = time.monotonic()
+            while first.stats['sent'] + first.stats['unreachable'] < 30:
+                await asyncio.sleep(0.01)
+            await stop_scheduler(db, first)
+            restarted = await open_scheduler(path, bot)
+            other = await open_scheduler(path, bot)
+
+            # Обычные сообщения в группы, пока идёт рассылка
+            waits = []
+            while sum(s.stats['sent'] for s in (first, restarted[1], other[1])) < len(expected):
+                sent = time.monotonic()
+                await bot.send_message(FIRST_CHAT_ID - len(waits) % args.chats, "Составы")
+                waits.append((time.monotonic() - sent) * 1000)
+                await asyncio.sleep(0.5)
+            elapsed = time.monotonic() - start
+            for db, scheduler in (restarted, other):
+                await stop_scheduler(db, scheduler)
+
+            sent = reminders_sent(api)
+            print(f"напоминаний: {sum(sent.values())} из {len(expected)} за {elapsed:.1f} с "
+                  f"({sum(sent.values()) / elapsed:.1f}/с), повторов: {sum(n - 1 for n in sent.values())}")
+            print(f"обычные сообщения во время рассылки: p50 {percentile(waits, 0.5):.0f} мс, "
+                  f"p95 {percentile(waits, 0.95):.0f} мс")
+            assert set(sent) == {(user_id, Mark(event_id=event_id, going=True).pack())
+                                 for user_id, event_id in expected}, "reminders went to the wrong players"
+            assert all(n == 1 for n in sent.values()), "a player got the same reminder twice"
+            assert percentile(waits, 0.95) < elapsed * 1000 / 4, "bulk reminders delayed ordinary messages"
+
+            conn = sqlite3.connect(path)
+            left = conn.execute("SELECT COUNT(*) FROM timers WHERE due_at <= ?", (int(time.time()),)).fetchone()[0]
+            stale = conn.execute("SELECT COUNT(*) FROM events WHERE type = 'Тренировка' AND status = 'open'").fetchone()[0]
+            queued = conn.execute("SELECT COUNT(*) FROM reminders").fetchone()[0]
+            closes = conn.execute("SELECT COUNT(*) FROM timers WHERE kind = ?", (CLOSE,)).fetchone()[0]
+            conn.close()
+            assert left == 0 and queued == 0, "due timers or reminders left behind"
+            assert stale == 0, "stale events were not closed"
+            print(f"закрыто прошедших событий: {args.chats}, таймеров закрытия впереди: {closes}")
+    finally:
+        await outbox.close()
+        await api.stop()
+    print("Проверки пройдены: простой без запросов к базе, каждому ровно одно напоминание "
+          "после перезапуска и при двух экземплярах, прошедшие события закрыты, "
+          "события без времени открыты весь свой день")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
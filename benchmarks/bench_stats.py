@@ -0,0 +1,194 @@
+# Статистика игрока (/stats) по агрегатам против прохода по всей истории.
+# Сезон из E событий в чате с P игроками: у каждого своя вероятность прийти,
+# на части событий составляются команды (иногда — по два раза). «Полный проход»
+# считает посещаемость, серии и партнёров по пятёрке запросами по participants
+# и team_players за весь сезон; «агрегаты» — stats.player_stats по готовым
+# счётчикам. Время — на один ответ /stats при росте истории.
+# Проверяется совпадение с полным проходом: посещаемость и знаменатель,
+# текущая и лучшая серии, партнёры; после поздних отметок на прошедшие
+# события — посещаемость. Открытые события (/stats в разгар игры) не
+# учитываются.
+#
+# Запуск: python benchmarks/bench_stats.py --players 40 --sizes 100,1000,5000
+import os
+import sys
+import time
+import random
+import sqlite3
+import argparse
+import tempfile
+from collections import Counter
+from contextlib import redirect_stdout
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from migrations import apply_migrations
+from stats import player_stats, roll_up, save_lineup
+
+CHAT_ID = -1000000
+OTHER_CHAT_ID = -1000001
+SEASON_START = 1700000000
+
+
+def prepare(path, players):
+    conn = sqlite3.connect(path, isolation_level=None)
+    with redirect_stdout(None):
+        apply_migrations(conn)
+    conn.execute("BEGIN")
+    for chat_id in (CHAT_ID, OTHER_CHAT_ID):
+        conn.executemany("INSERT OR IGNORE INTO users (user_id, name) VALUES (?, ?)",
+                         [(user_id, f"Игрок {user_id}") for user_id in range(1, players + 1)])
+        conn.executemany("INSERT INTO members (chat_id, user_id, name) VALUES (?, ?, ?)",
+                         [(chat_id, user_id, f"Игрок {user_id}") for user_id in range(1, players + 1)])
+    conn.execute("COMMIT")
+    return conn
+
+
+# Сезон: события по одному в день. Отметки приходят до и после начала
+# события, /stats вызывают в разгар игры — учёт идёт только при закрытии
+# (как в транзакции таймера закрытия), поэтому серии не зависят от того,
+# когда спросили. Иногда событие закрывается позже следующего — оно всё
+# равно учитывается первым. Второй чат получает свои события — они не
+# должны попасть в статистику первого
+def play_season(conn, rng, events, players):
+    chance = {user_id: rng.uniform(0.3, 0.95) for user_id in range(1, players + 1)}
+    delayed = []
+    for n in range(events):
+        starts_at = SEASON_START + n * 86400
+        conn.execute("BEGIN")
+        for chat_id in (CHAT_ID, OTHER_CHAT_ID):
+            event_id = conn.execute("INSERT INTO events (chat_id, date, type, starts_at) VALUES (?, '', 'Игра', ?)",
+                                    (chat_id, starts_at)).lastrowid
+            going = [user_id for user_id in chance if rng.random() < chance[user_id]]
+            early, late = going[:len(going) // 2], going[len(going) // 2:]
+            conn.executemany("INSERT INTO participants (event_id, user_id) VALUES (?, ?)",
+                             [(event_id, user_id) for user_id in early])
+            if chat_id == CHAT_ID and rng.random() < 0.2:
+                held = conn.execute("SELECT COALESCE(SUM(held), 0) FROM chat_stats").fetchone()[0]
+                assert roll_up(conn, CHAT_ID) == 0 and conn.execute(
+                    "SELECT COALESCE(SUM(held), 0) FROM chat_stats").fetchone()[0] == held, \
+                    "open event was counted"
+            conn.executemany("INSERT INTO participants (event_id, user_id) VALUES (?, ?)",
+                             [(event_id, user_id) for user_id in late])
+            for _ in range(rng.choice((0, 1, 1, 2))):
+                rng.shuffle(going)
+                teams = [going[0::2], going[1::2]]
+                save_lineup(conn, event_id, chat_id, ("🔴", "🔵"), teams)
+            if rng.random() < 0.1:
+                delayed.append((chat_id, event_id))
+                continue
+            close(conn, chat_id, event_id)
+        conn.execute("COMMIT")
+        # Отложенные закрываются после следующего события
+        if rng.random() < 0.5:
+            conn.execute("BEGIN")
+            for chat_id, event_id in delayed:
+                close(conn, chat_id, event_id)
+            conn.execute("COMMIT")
+            delayed = []
+    conn.execute("BEGIN")
+    for chat_id, event_id in delayed:
+        close(conn, chat_id, event_id)
+    conn.execute("COMMIT")
+    return SEASON_START + events * 86400
+
+
+# Таймер закрытия: событие закрыто и учтено в той же транзакции
+def close(conn, chat_id, event_id):
+    conn.execute("UPDATE events SET status = 'closed' WHERE event_id = ?", (event_id,))
+    roll_up(conn, chat_id)
+
+
+# Полный проход по истории — как /stats считался бы без агрегатов
+def naive_stats(conn, chat_id, user_id, now, top=3):
+    history = conn.execute('''SELECT e.event_id, p.user_id IS NOT NULL FROM events e
+                              LEFT JOIN participants p ON p.event_id = e.event_id AND p.user_id = ?
+                              WHERE e.chat_id = ? AND e.starts_at <= ?
+                              ORDER BY e.starts_at, e.event_id''', (user_id, chat_id, now)).fetchall()
+    attended = [went for _, went in history]
+    if not any(attended):
+        return None
+    first = attended.index(1)
+    streak = best_streak = 0
+    for went in attended:
+        streak = streak + 1 if went else 0
+        best_streak = max(best_streak, streak)
+    mates = conn.execute('''SELECT m.name, COUNT(*) AS games FROM team_players a
+                            JOIN team_players b ON b.team_id = a.team_id AND b.user_id != a.user_id
+                            JOIN teams t ON t.team_id = a.team_id
+                            JOIN events e ON e.event_id = t.event_id
+                            JOIN members m ON m.chat_id = e.chat_id AND m.user_id = b.user_id
+                            WHERE e.chat_id = ? AND a.user_id = ?
+                            GROUP BY b.user_id ORDER BY games DESC, m.name LIMIT ?''',
+                         (chat_id, user_id, top)).fetchall()
+    return {'attended': sum(attended), 'held': len(attended) - first, 'streak': streak,
+            'best_streak': best_streak, 'linemates': mates}
+
+
+def timed(fn, players, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for user_id in range(1, players + 1):
+            fn(user_id)
+    return (time.perf_counter() - start) / (repeat * players) * 1e6
+
+
+# Поздние отметки на прошедшие события: посещаемость сходится с полным проходом
+def check_corrections(conn, rng, players, now):
+    events = [row[0] for row in conn.execute("SELECT event_id FROM events WHERE chat_id = ?", (CHAT_ID,))]
+    conn.execute("BEGIN")
+    for _ in range(200):
+        event_id, user_id = rng.choice(events), rng.randint(1, players)
+        if rng.random() < 0.5:
+            conn.execute("INSERT OR IGNORE INTO participants (event_id, user_id) VALUES (?, ?)", (event_id, user_id))
+        else:
+            conn.execute("DELETE FROM participants WHERE event_id = ? AND user_id = ?", (event_id, user_id))
+    conn.execute("COMMIT")
+    for user_id in range(1, players + 1):
+        fast = player_stats(conn, CHAT_ID, user_id)
+        slow = naive_stats(conn, CHAT_ID, user_id, now)
+        assert (fast or {}).get('attended', 0) == (slow or {}).get('attended', 0), \
+            f"attended of {user_id} after late marks: {fast} != {slow}"
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--players', type=int, default=40)
+    parser.add_argument('--sizes', default='100,1000,5000', help='событий за сезон, через запятую')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{args.players} игроков, время одного /stats")
+    print(f"{'событий':>8} | {'отметок':>8} | {'полный проход, мкс':>18} | {'агрегаты, мкс':>13}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for events in map(int, args.sizes.split(',')):
+            rng = random.Random(events)
+            conn = prepare(os.path.join(tmp, f"stats{events}.db"), args.players)
+            now = play_season(conn, rng, events, args.players)
+            marks = conn.execute("SELECT COUNT(*) FROM participants").fetchone()[0]
+
+            for user_id in range(1, args.players + 1):
+                fast = player_stats(conn, CHAT_ID, user_id)
+                slow = naive_stats(conn, CHAT_ID, user_id, now)
+                assert fast == slow, f"stats of {user_id}: {fast} != {slow}"
+            pairs = Counter()
+            for team_id, user_id in conn.execute('''SELECT tp.team_id, tp.user_id FROM team_players tp
+                                                    JOIN teams t ON t.team_id = tp.team_id
+                                                    JOIN events e ON e.event_id = t.event_id
+                                                    WHERE e.chat_id = ?''', (CHAT_ID,)):
+                pairs[team_id] += 1
+            assert sum(n * (n - 1) for n in pairs.values()) == conn.execute(
+                "SELECT SUM(games) FROM linemates WHERE chat_id = ?", (CHAT_ID,)).fetchone()[0], \
+                "line-mate counters differ from saved lineups"
+
+            naive = timed(lambda user_id: naive_stats(conn, CHAT_ID, user_id, now), args.players, args.repeat)
+            fast = timed(lambda user_id: player_stats(conn, CHAT_ID, user_id), args.players, args.repeat)
+            print(f"{events:>8} | {marks:>8} | {naive:>18.1f} | {fast:>13.1f}")
+
+            check_corrections(conn, rng, args.players, now)
+            conn.close()
+    print("Проверки пройдены: агрегаты совпадают с полным проходом, включая пересоставления и поздние отметки, открытые события не учитываются")
+
+
+if __name__ == '__main__':
+    main()
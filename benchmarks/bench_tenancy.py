@@ -0,0 +1,295 @@
+# Бенчмарк разделения данных по чатам: 500 команд в одной базе против
+# отдельного файла SQLite на чат.
+#   shared       — одна база, схема из migrations: индексы начинаются с chat_id
+#   shared-noidx — одна база, chat_id есть, но индексы прежние: (status, starts_at),
+#                  (starts_at), (name, user_id) — так выглядела бы схема без перестройки индексов
+#   per-chat/K   — файл на чат с той же схемой; открытые соединения держатся в LRU
+#                  на K штук, вытесненные закрываются
+# Нагрузка — запросы бота к случайному чату: ближайшие события, первая
+# страница игроков, состав события и отметка (отдельная транзакция).
+# Чаты выбираются равномерно или «горячими» (20% чатов получают 80% запросов).
+# Проверяется, что все варианты отвечают одинаково и чужие строки не попадают в ответ.
+#
+# Запуск: python benchmarks/bench_tenancy.py --chats 500 --ops 20000
+import os
+import sys
+import time
+import math
+import random
+import shutil
+import sqlite3
+import argparse
+import tempfile
+from collections import OrderedDict, defaultdict
+from contextlib import redirect_stdout
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from event_time import EVENT_TZ, start_of_today, to_timestamp
+from migrations import apply_migrations
+
+MEMBERS = 25
+PAST_EVENTS = 100
+UPCOMING_EVENTS = 10
+PLAYERS_PER_EVENT = 15
+USERS = 5000
+NAMES = ['Иван', 'Пётр', 'Сергей', 'Алексей', 'Дмитрий', 'Павел', 'Олег', 'Игорь']
+
+UPCOMING_SQL = ("SELECT event_id, starts_at, type, status FROM events "
+                "WHERE chat_id = ? AND status = 'open' AND starts_at >= ? "
+                "ORDER BY starts_at, event_id LIMIT 10")
+MEMBERS_SQL = "SELECT user_id, name FROM members WHERE chat_id = ? ORDER BY name, user_id LIMIT 9"
+ROSTER_SQL = '''SELECT m.name FROM participants p
+                JOIN members m ON m.chat_id = ? AND m.user_id = p.user_id
+                WHERE p.event_id = ? ORDER BY m.name'''
+NOIDX_SQL = '''
+    DROP INDEX idx_events_chat_status_starts;
+    DROP INDEX idx_events_chat_starts;
+    DROP INDEX idx_members_name;
+    CREATE INDEX idx_events_status_starts ON events(status, starts_at);
+    CREATE INDEX idx_events_starts ON events(starts_at);
+    CREATE INDEX idx_members_name ON members(name, user_id);
+'''
+
+
+def chat_ids(chats):
+    return [-1000000 - n for n in range(chats)]
+
+
+# Данные одного чата: игроки, прошедшие закрытые события с отметками и предстоящие открытые
+def chat_data(chat_id, rng, today):
+    users = rng.sample(range(1, USERS + 1), MEMBERS)
+    members = [(chat_id, user_id, f"{rng.choice(NAMES)} {user_id}") for user_id in users]
+    events = []
+    for n in range(PAST_EVENTS + UPCOMING_EVENTS):
+        day = today + timedelta(days=2 * (n - PAST_EVENTS))
+        status = 'closed' if n < PAST_EVENTS else 'open'
+        players = rng.sample(users, PLAYERS_PER_EVENT) if n < PAST_EVENTS else []
+        events.append((to_timestamp(day), status, players))
+    return members, events
+
+
+def connect(path):
+    conn = sqlite3.connect(path, isolation_level=None)
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute("PRAGMA foreign_keys = ON")
+    return conn
+
+
+# Заполняет базу данными перечисленных чатов; возвращает {chat_id: [event_id, ...]}
+def fill(conn, chats, seed):
+    today = datetime.now(EVENT_TZ).replace(hour=19, minute=0, second=0, microsecond=0)
+    event_ids = {}
+    conn.execute("BEGIN")
+    for chat_id in chats:
+        # Данные чата не зависят от варианта хранения
+        members, events = chat_data(chat_id, random.Random(seed * 100003 + chat_id), today)
+        conn.executemany("INSERT OR IGNORE INTO users (user_id, name) VALUES (?, ?)",
+                         [(user_id, f"Игрок {user_id}") for _, user_id, _ in members])
+        conn.executemany("INSERT INTO members (chat_id, user_id, name) VALUES (?, ?, ?)", members)
+        ids = event_ids[chat_id] = []
+        for starts_at, status, players in events:
+            event_id = conn.execute(
+                "INSERT INTO events (chat_id, date, type, status, starts_at) VALUES (?, '', 'Игра', ?, ?)",
+                (chat_id, status, starts_at)).lastrowid
+            ids.append(event_id)
+            conn.executemany("INSERT INTO participants (event_id, user_id) VALUES (?, ?)",
+                             [(event_id, user_id) for user_id in players])
+    conn.execute("COMMIT")
+    return event_ids
+
+
+def template(tmp):
+    path = os.path.join(tmp, 'template.db')
+    conn = sqlite3.connect(path, isolation_level=None)
+    with redirect_stdout(None):
+        apply_migrations(conn)
+    conn.close()
+    return path
+
+
+def size_of(paths):
+    return sum(os.path.getsize(p) for path in paths for p in (path, path + '-wal') if os.path.exists(p))
+
+
+# Одна база на все чаты
+class SharedStore:
+    def __init__(self, tmp, schema, chats, seed, indexes=True):
+        self.path = os.path.join(tmp, f"shared_{'idx' if indexes else 'noidx'}.db")
+        shutil.copy(schema, self.path)
+        self.conn = connect(self.path)
+        if not indexes:
+            self.conn.executescript(NOIDX_SQL)
+        self.event_ids = fill(self.conn, chats, seed)
+        self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        self.stats = {'opens': 0, 'open_s': 0.0}
+
+    def get(self, chat_id):
+        return self.conn
+
+    def size(self):
+        return size_of([self.path])
+
+    def close(self):
+        self.conn.close()
+
+
+# Файл на чат; не больше capacity открытых соединений одновременно
+class FileStore:
+    def __init__(self, tmp, schema, chats, seed, capacity):
+        self.dir = os.path.join(tmp, f"per_chat_{capacity}")
+        os.makedirs(self.dir)
+        self.capacity = capacity
+        self.event_ids = {}
+        for chat_id in chats:
+            path = self._path(chat_id)
+            shutil.copy(schema, path)
+            conn = connect(path)
+            self.event_ids.update(fill(conn, [chat_id], seed))
+            conn.close()
+        self._open = OrderedDict()
+        self.stats = {'opens': 0, 'open_s': 0.0}
+
+    def _path(self, chat_id):
+        return os.path.join(self.dir, f"{chat_id}.db")
+
+    def get(self, chat_id):
+        conn = self._open.get(chat_id)
+        if conn is not None:
+            self._open.move_to_end(chat_id)
+            return conn
+        # Открытие и закрытие вытесненного (с контрольной точкой WAL) — цена промаха
+        start = time.perf_counter()
+        if len(self._open) >= self.capacity:
+            self._open.popitem(last=False)[1].close()
+        conn = self._open[chat_id] = connect(self._path(chat_id))
+        self.stats['opens'] += 1
+        self.stats['open_s'] += time.perf_counter() - start
+        return conn
+
+    def size(self):
+        return size_of([self._path(chat_id) for chat_id in self.event_ids])
+
+    def close(self):
+        for conn in self._open.values():
+            conn.close()
+        self._open.clear()
+
+
+def pick_chats(chats, ops, pattern, rng):
+    if pattern == 'uniform':
+        return [rng.choice(chats) for _ in range(ops)]
+    hot = chats[:max(1, len(chats) // 5)]
+    return [rng.choice(hot) if rng.random() < 0.8 else rng.choice(chats) for _ in range(ops)]
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[max(0, math.ceil(p * len(values)) - 1)] if values else 0.0
+
+
+def run(store, sequence, seed):
+    rng = random.Random(seed)
+    since = start_of_today()
+    timings = defaultdict(list)
+    start_all = time.perf_counter()
+    for chat_id in sequence:
+        op = rng.choice(('upcoming', 'members', 'roster', 'mark'))
+        event_id = rng.choice(store.event_ids[chat_id][:PAST_EVENTS])
+        start = time.perf_counter()
+        conn = store.get(chat_id)
+        if op == 'upcoming':
+            conn.execute(UPCOMING_SQL, (chat_id, since)).fetchall()
+        elif op == 'members':
+            conn.execute(MEMBERS_SQL, (chat_id,)).fetchall()
+        elif op == 'roster':
+            conn.execute(ROSTER_SQL, (chat_id, event_id)).fetchall()
+        else:
+            user_id = conn.execute("SELECT user_id FROM members WHERE chat_id = ? LIMIT 1",
+                                   (chat_id,)).fetchone()[0]
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("INSERT OR IGNORE INTO participants (event_id, user_id) VALUES (?, ?)",
+                         (event_id, user_id))
+            conn.execute("COMMIT")
+        timings[op].append(time.perf_counter() - start)
+    wall = time.perf_counter() - start_all
+    return len(sequence) / wall, {op: percentile(values, 0.95) * 1e6 for op, values in timings.items()}
+
+
+# Ответы вариантов совпадают, и в ответе нет строк чужих чатов
+def check(stores, chats):
+    since = start_of_today()
+    reference = None
+    for store in stores:
+        answers = []
+        for chat_id in chats[:20]:
+            conn = store.get(chat_id)
+            upcoming = conn.execute(UPCOMING_SQL, (chat_id, since)).fetchall()
+            owners = {conn.execute("SELECT chat_id FROM events WHERE event_id = ?", (row[0],)).fetchone()[0]
+                      for row in upcoming}
+            assert owners == {chat_id}, f"{chat_id}: foreign events {owners}"
+            members = conn.execute(MEMBERS_SQL, (chat_id,)).fetchall()
+            roster = conn.execute(ROSTER_SQL, (chat_id, store.event_ids[chat_id][0])).fetchall()
+            answers.append(([row[1] for row in upcoming], members, roster))
+        if reference is None:
+            reference = answers
+        assert answers == reference, f"{type(store).__name__} answers differ"
+
+
+def plan(conn):
+    return ' | '.join(row[-1] for row in conn.execute(
+        "EXPLAIN QUERY PLAN " + UPCOMING_SQL, (0, 0)))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--chats', type=int, default=500)
+    parser.add_argument('--ops', type=int, default=20000)
+    parser.add_argument('--lru', type=int, nargs='+', default=[64, 512],
+                        help='сколько файлов держать открытыми в варианте per-chat')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    chats = chat_ids(args.chats)
+    rows = args.chats * (PAST_EVENTS * PLAYERS_PER_EVENT)
+    print(f"{args.chats} чатов: {MEMBERS} игроков и {PAST_EVENTS + UPCOMING_EVENTS} событий в каждом, "
+          f"{rows} отметок, {args.ops} операций на прогон")
+    with tempfile.TemporaryDirectory() as tmp:
+        schema = template(tmp)
+        stores = []
+        for name, make in [
+            ('shared', lambda: SharedStore(tmp, schema, chats, args.seed)),
+            ('shared-noidx', lambda: SharedStore(tmp, schema, chats, args.seed, indexes=False)),
+            *[(f"per-chat/{k}", lambda k=k: FileStore(tmp, schema, chats, args.seed, k)) for k in args.lru],
+        ]:
+            start = time.perf_counter()
+            store = make()
+            stores.append((name, store, time.perf_counter() - start))
+        check([store for _, store, _ in stores], chats)
+        print(f"план ближайших событий, shared:       {plan(stores[0][1].conn)}")
+        print(f"план ближайших событий, shared-noidx: {plan(stores[1][1].conn)}")
+
+        print(f"{'layout':>13} | {'fill, s':>7} | {'disk, MB':>8} | {'pattern':>7} | {'ops/s':>7} | "
+              f"{'p95 upcoming':>12} {'members':>8} {'roster':>8} {'mark':>8} µs | {'opens':>6} {'open, µs':>8}")
+        for pattern in ('uniform', 'hot'):
+            sequence = pick_chats(chats, args.ops, pattern, random.Random(args.seed))
+            for name, store, fill_s in stores:
+                store.close()
+                if isinstance(store, SharedStore):
+                    store.conn = connect(store.path)
+                store.stats = {'opens': 0, 'open_s': 0.0}
+                ops, p95 = run(store, sequence, args.seed)
+                opens = store.stats['opens']
+                open_us = store.stats['open_s'] / opens * 1e6 if opens else 0.0
+                print(f"{name:>13} | {fill_s:>7.1f} | {store.size() / 2**20:>8.1f} | {pattern:>7} | {ops:>7.0f} | "
+                      f"{p95['upcoming']:>12.1f} {p95['members']:>8.1f} {p95['roster']:>8.1f} "
+                      f"{p95['mark']:>8.1f}    | {opens:>6} {open_us:>8.1f}")
+        for _, store, _ in stores:
+            store.close()
+    print("Проверки пройдены: ответы всех вариантов совпадают, чужие события в ответ не попадают")
+
+
+if __name__ == '__main__':
+    main()
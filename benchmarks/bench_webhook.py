@@ -0,0 +1,146 @@
+# Сквозная задержка обработки обновлений в режимах polling и webhook.
+# Один и тот же Dispatcher из hockey_bot.create_dispatcher() получает нажатия
+# «✅ Буду»: в polling — через getUpdates локального фейкового Bot API, в webhook —
+# POST-запросами на aiohttp-сервер бота. Задержка считается от появления
+# обновления до ответа на callback (в webhook ответ приходит прямо в HTTP-ответе).
+#
+# Запуск: python benchmarks/bench_webhook.py --updates 200 --rate 100 --latency 0.03
+import os
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('TOKEN', '0:bench')
+
+from aiohttp import ClientSession, web
+from fake_bot_api import FakeBotAPI
+from callbacks import Mark
+
+GROUP_ID = -1001
+SECRET = 'bench-secret'
+
+
+def make_update(user_id, event_id, message_id):
+    return {
+        'update_id': user_id,
+        'callback_query': {
+            'id': f"cb{user_id}",
+            'from': {'id': user_id, 'is_bot': False, 'first_name': f"Игрок {user_id}"},
+            'chat_instance': 'bench',
+            'data': Mark(event_id=event_id, going=True).pack(),
+            'message': {
+                'message_id': message_id,
+                'date': int(time.time()),
+                'chat': {'id': GROUP_ID, 'type': 'group'},
+                'text': 'poll',
+            },
+        },
+    }
+
+
+async def run_polling(hockey_bot, api, bot, updates, rate, event_id):
+    dp = hockey_bot.create_dispatcher()
+    polling = asyncio.create_task(dp.start_polling(bot, handle_signals=False, polling_timeout=10))
+    await asyncio.sleep(0.2)
+    pushed = {}
+    for user_id in range(1, updates + 1):
+        api.push_update(make_update(user_id, event_id, 1))
+        pushed[f"cb{user_id}"] = time.monotonic()
+        await asyncio.sleep(1 / rate)
+    while len(api.answered_at) < updates:
+        await asyncio.sleep(0.01)
+    await dp.stop_polling()
+    await polling
+    return [api.answered_at[cb] - t for cb, t in pushed.items()]
+
+
+async def run_webhook(hockey_bot, api, bot, updates, rate, event_id):
+    from webhook import create_app
+    runner = web.AppRunner(create_app(bot, hockey_bot.create_dispatcher(), secret=SECRET))
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    url = f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}/webhook"
+    latencies = []
+    inline = 0
+
+    async with ClientSession() as session:
+        # Запрос без секрета должен быть отклонён
+        async with session.post(url, json=make_update(0, event_id, 1)) as response:
+            assert response.status == 401, response.status
+
+        async def post(user_id):
+            nonlocal inline
+            start = time.monotonic()
+            async with session.post(url, json=make_update(user_id, event_id, 1),
+                                    headers={'X-Telegram-Bot-Api-Secret-Token': SECRET}) as response:
+                body = await response.read()
+            if b'answerCallbackQuery' in body:
+                inline += 1
+                latencies.append(time.monotonic() - start)
+            else:
+                # Ответ ушёл отдельным запросом к API
+                while f"cb{user_id}" not in api.answered_at:
+                    await asyncio.sleep(0.005)
+                latencies.append(api.answered_at[f"cb{user_id}"] - start)
+
+        tasks = []
+        for user_id in range(1, updates + 1):
+            tasks.append(asyncio.create_task(post(user_id)))
+            await asyncio.sleep(1 / rate)
+        await asyncio.gather(*tasks)
+    await runner.cleanup()
+    return latencies, inline
+
+
+def report(name, latencies):
+    latencies = sorted(latencies)
+    ms = [x * 1000 for x in latencies]
+    print(f"{name:>8}: p50 {statistics.median(ms):6.1f} ms, "
+          f"p95 {ms[int(len(ms) * 0.95) - 1]:6.1f} ms, max {ms[-1]:6.1f} ms")
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--updates', type=int, default=200)
+    parser.add_argument('--rate', type=float, default=100, help='обновлений в секунду')
+    parser.add_argument('--latency', type=float, default=0.03, help='задержка фейкового API, с')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ['DB_PATH'] = os.path.join(tmp, 'bench.db')
+        import hockey_bot
+        from migrations import migrate
+        from outbox import Outbox, OutboxMiddleware
+
+        api = FakeBotAPI(latency=args.latency)
+        await api.start()
+        bot = api.bot()
+        bot.session.middleware(OutboxMiddleware(Outbox()))
+        await hockey_bot.db.open()
+        try:
+            await migrate(hockey_bot.db)
+            await hockey_bot.roles.load(hockey_bot.db)
+            event_id = await hockey_bot.db.execute("INSERT INTO events (chat_id, date, type) VALUES (?, '25.10', 'Игра')",
+                                                   (GROUP_ID,))
+
+            polling = await run_polling(hockey_bot, api, bot, args.updates, args.rate, event_id)
+            api.reset()
+            webhook, inline = await run_webhook(hockey_bot, api, bot, args.updates, args.rate, event_id)
+            await hockey_bot.roster_updater.flush_all()
+        finally:
+            await hockey_bot.db.close()
+            await api.stop()
+
+    print(f"{args.updates} callback updates at {args.rate:g}/s, API latency {args.latency * 1000:.0f} ms")
+    report('polling', polling)
+    report('webhook', webhook)
+    print(f"webhook answers sent inline in the HTTP response: {inline}/{args.updates}")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
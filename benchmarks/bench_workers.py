@@ -0,0 +1,201 @@
+# Рабочие процессы: пропускная способность и порядок обновлений внутри чата.
+# Бот запускается отдельным процессом (python hockey_bot.py) с WORKERS=0, 1, 2, 4
+# против локального фейкового Bot API (BOT_API_URL). В каждом из C чатов
+# игроки нажимают «✅ Буду», «❌ Не буду», «✅ Буду», затем тренер вызывает
+# /form_teams (оптимизация составов нагружает процессор). Часть обновлений
+# getUpdates отдаёт повторно.
+# Проверяется:
+#   * порядок: у каждого события в итоге отмечены все игроки, /form_teams видит всех;
+#   * повторы: на каждое нажатие ровно один answerCallbackQuery;
+#   * обратное давление: в рабочем процессе не больше WORKER_QUEUE обновлений.
+#
+# Запуск: python benchmarks/bench_workers.py --chats 64 --players 20 --workers 0 1 2 4
+import os
+import re
+import sys
+import time
+import shutil
+import socket
+import signal
+import sqlite3
+import asyncio
+import argparse
+import tempfile
+import subprocess
+from contextlib import redirect_stdout
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from aiohttp import ClientSession
+from callbacks import Mark
+from event_time import EVENT_TZ, to_timestamp
+from fake_bot_api import BOT_ID, FakeBotAPI
+from load_test import percentile
+from migrations import apply_migrations
+import scenarios
+
+FIRST_CHAT_ID = -1000000
+# Сообщение события в каждом чате; номер вне выдаваемых фейковым API, чтобы
+# правки состава не затирали отправленные ботом сообщения
+EVENT_MESSAGE_ID = 1000000
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def coach_id(n):
+    return 10 + n
+
+
+def player_id(n, i):
+    return 100000 + n * 1000 + i
+
+
+# База с чатами, тренерами, игроками и одним предстоящим событием в каждом чате
+def build(path, chats, players):
+    conn = sqlite3.connect(path, isolation_level=None)
+    with redirect_stdout(None):
+        apply_migrations(conn)
+    starts_at = to_timestamp(datetime.now(EVENT_TZ).replace(second=0, microsecond=0) + timedelta(days=3))
+    events = {}
+    conn.execute("BEGIN")
+    for n in range(chats):
+        chat_id = FIRST_CHAT_ID - n
+        users = [(coach_id(n), f"Тренер {n}", 1)] + [(player_id(n, i), f"Игрок {player_id(n, i)}", 0)
+                                                    for i in range(players)]
+        conn.executemany("INSERT INTO users (user_id, name, last_chat_id) VALUES (?, ?, ?)",
+                         [(user_id, name, chat_id) for user_id, name, _ in users])
+        conn.executemany("INSERT INTO members (chat_id, user_id, name, is_coach) VALUES (?, ?, ?, ?)",
+                         [(chat_id, user_id, name, coach) for user_id, name, coach in users])
+        events[chat_id] = conn.execute(
+            "INSERT INTO events (chat_id, date, type, starts_at) VALUES (?, '', 'Игра', ?)",
+            (chat_id, starts_at)).lastrowid
+    conn.execute("COMMIT")
+    conn.close()
+    return events
+
+
+# Обновления в порядке поступления: чаты перемешаны, внутри чата порядок важен
+def workload(events, players):
+    updates = []
+    for step in ('yes', 'no', 'yes'):
+        for i in range(players):
+            for n, (chat_id, event_id) in enumerate(events.items()):
+                data = Mark(event_id=event_id, going=step == 'yes').pack()
+                updates.append(scenarios.callback(player_id(n, i), chat_id, EVENT_MESSAGE_ID, data, "Кто будет?"))
+    for n, chat_id in enumerate(events):
+        updates.append(scenarios.message(coach_id(n), chat_id, '/form_teams'))
+    return updates
+
+
+def metric(text, name):
+    match = re.search(rf'^{name} (\S+)$', text, re.M)
+    return float(match.group(1)) if match else 0.0
+
+
+async def run(workers, args, template, events, tmp):
+    path = os.path.join(tmp, f"workers_{workers}.db")
+    shutil.copy(template, path)
+
+    api = FakeBotAPI(latency=args.latency, duplicate_rate=args.duplicates)
+    await api.start()
+    port = free_port()
+    env = dict(os.environ, TOKEN=f"{BOT_ID}:fake", BOT_API_URL=api.url, DB_PATH=path,
+               WORKERS=str(workers), WORKER_QUEUE=str(args.queue), METRICS_PORT=str(port),
+               PYTHONUNBUFFERED='1')
+    log = open(os.path.join(tmp, f"bot_{workers}.log"), 'w')
+    bot = subprocess.Popen([sys.executable, os.path.join(ROOT, 'hockey_bot.py')], env=env,
+                           stdout=log, stderr=subprocess.STDOUT)
+    try:
+        while not api.calls['getUpdates']:
+            if bot.poll() is not None:
+                raise RuntimeError(f"бот завершился, см. {log.name}")
+            await asyncio.sleep(0.05)
+
+        updates = workload(events, args.players)
+        taps = len(updates) - len(events)
+        pushed = {}
+        start = time.monotonic()
+        for update in updates:
+            update_id = api.push_update(update)
+            if 'callback_query' in update:
+                pushed[update['callback_query']['id']] = time.monotonic()
+        deadline = start + args.timeout
+        while len(api.answered_at) < taps or \
+                sum('Составы' in text for text in api.messages.values()) < len(events):
+            if time.monotonic() > deadline or bot.poll() is not None:
+                raise RuntimeError(f"не дождались обработки ({len(api.answered_at)}/{taps} нажатий), "
+                                   f"см. {log.name}")
+            await asyncio.sleep(0.01)
+        wall = time.monotonic() - start
+        latencies = [(api.answered_at[cb] - t) * 1000 for cb, t in pushed.items()]
+
+        async with ClientSession() as session:
+            async with session.get(f"http://127.0.0.1:{port}/metrics") as response:
+                text = await response.text()
+    finally:
+        bot.send_signal(signal.SIGINT)
+        try:
+            bot.wait(60)
+        except subprocess.TimeoutExpired:
+            bot.kill()
+        log.close()
+        await api.stop()
+
+    # Порядок внутри чата сохранён: последнее нажатие каждого игрока — «Буду»
+    conn = sqlite3.connect(path)
+    counts = dict(conn.execute("SELECT event_id, COUNT(*) FROM participants GROUP BY event_id"))
+    teams = conn.execute("SELECT COUNT(DISTINCT event_id) FROM teams").fetchone()[0]
+    conn.close()
+    assert all(counts.get(event_id) == args.players for event_id in events.values()), \
+        "order within a chat was broken: some players ended up not going"
+    assert teams == len(events), "/form_teams did not see every chat"
+    assert api.calls['answerCallbackQuery'] == taps, \
+        f"duplicates were processed: {api.calls['answerCallbackQuery']} answers for {taps} taps"
+    duplicates = metric(text, 'hockey_dedup_duplicates')
+    assert duplicates > 0 or not args.duplicates, "no duplicates were dropped"
+    max_in_flight = metric(text, 'hockey_ingress_max_in_flight')
+    assert max_in_flight <= args.queue, f"backpressure failed: {max_in_flight} > {args.queue}"
+    return {
+        'updates_per_s': len(updates) / wall,
+        'p50_ms': percentile(latencies, 0.5),
+        'p95_ms': percentile(latencies, 0.95),
+        'duplicates': int(duplicates),
+        'waits': int(metric(text, 'hockey_ingress_waits')),
+        'max_in_flight': int(max_in_flight),
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--chats', type=int, default=64)
+    parser.add_argument('--players', type=int, default=20)
+    parser.add_argument('--workers', type=int, nargs='+', default=[0, 1, 2, 4])
+    parser.add_argument('--queue', type=int, default=50, help='WORKER_QUEUE')
+    parser.add_argument('--latency', type=float, default=0.02, help='задержка фейкового API, с')
+    parser.add_argument('--duplicates', type=float, default=0.02, help='доля повторных обновлений')
+    parser.add_argument('--timeout', type=float, default=300)
+    args = parser.parse_args()
+
+    updates = args.chats * (args.players * 3 + 1)
+    print(f"{args.chats} чатов × {args.players} игроков: {updates} обновлений, "
+          f"задержка API {args.latency * 1000:.0f} мс, ядер: {os.cpu_count()}")
+    print(f"{'WORKERS':>7} | {'upd/s':>7} | {'tap p50, ms':>11} {'p95, ms':>8} | "
+          f"{'duplicates':>10} | {'waits':>6} {'max queue':>9}")
+    with tempfile.TemporaryDirectory() as tmp:
+        template = os.path.join(tmp, 'template.db')
+        events = build(template, args.chats, args.players)
+        for workers in args.workers:
+            row = await run(workers, args, template, events, tmp)
+            print(f"{workers:>7} | {row['updates_per_s']:>7.0f} | {row['p50_ms']:>11.1f} {row['p95_ms']:>8.1f} | "
+                  f"{row['duplicates']:>10} | {row['waits']:>6} {row['max_in_flight'] if workers else '-':>9}")
+    print("Проверки пройдены: порядок внутри чата, повторы отброшены, очередь процесса ограничена")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
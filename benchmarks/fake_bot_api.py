@@ -0,0 +1,204 @@
+# Локальная замена Telegram Bot API для бенчмарков.
+# aiohttp-сервер отвечает на POST /bot<token>/<method> так же, как настоящий API,
+# считает вызовы по методам, умеет добавлять задержку и отвечать 429.
+#
+# Использование:
+#     api = FakeBotAPI(latency=0.02)
+#     await api.start()
+#     bot = api.bot()
+#     ...
+#     await api.stop()
+import re
+import json
+import time
+import random
+import asyncio
+import itertools
+from collections import Counter, defaultdict
+from aiohttp import web
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+
+BOT_ID = 42
+# Разметка parse_mode=HTML, которую принимает Telegram
+HTML_TAG = re.compile(r'<(/?)(b|strong|i|em|u|ins|s|strike|del|code|pre|a|tg-spoiler)(?:\s[^<>]*)?>')
+HTML_ENTITY = re.compile(r'&(?:lt|gt|amp|quot|#\d+|#x[0-9a-fA-F]+);')
+
+
+# Как Telegram: «<», «>» и «&» вне тегов и сущностей и незакрытые теги — ошибка 400
+def check_html(text):
+    stack = []
+    for match in HTML_TAG.finditer(text):
+        closing, tag = match.groups()
+        if not closing:
+            stack.append(tag)
+        elif not stack or stack.pop() != tag:
+            raise ValueError(f"can't parse entities: unexpected end tag \"{tag}\"")
+    rest = HTML_ENTITY.sub('', HTML_TAG.sub('', text))
+    if stack or re.search(r'[<>&]', rest):
+        raise ValueError("can't parse entities: unsupported start tag or unescaped character")
+
+
+class FakeBotAPI:
+    def __init__(self, latency=0.0, flood_rate=0.0, retry_after=1, host='127.0.0.1', port=0,
+                 duplicate_rate=0.0):
+        self.latency = latency
+        # Доля запросов, на которые отвечаем 429 Too Many Requests
+        self.flood_rate = flood_rate
+        # Доля обновлений, которые getUpdates отдаёт повторно (как при повторной доставке)
+        self.duplicate_rate = duplicate_rate
+        self.retry_after = retry_after
+        self.host = host
+        self.port = port
+        self.calls = Counter()
+        self.floods = Counter()
+        self.messages = {}
+        # Клавиатуры отправленных сообщений (chat_id, message_id) -> reply_markup
+        self.markups = {}
+        # Время успешных отправок по чатам — для проверки лимитов
+        self.sent_at = defaultdict(list)
+        self._message_ids = itertools.count(1)
+        # Очередь входящих обновлений для getUpdates
+        self._updates = []
+        self._update_ids = itertools.count(1)
+        self._has_updates = None
+        # Когда бот ответил на callback (id -> время)
+        self.answered_at = {}
+        # Администраторы чатов для getChatAdministrators (chat_id -> user_id)
+        self.admins = defaultdict(set)
+        self._runner = None
+        self._sessions = []
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}"
+
+    async def start(self):
+        self._has_updates = asyncio.Event()
+        app = web.Application()
+        app.router.add_post('/bot{token}/{method}', self._handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        for session in self._sessions:
+            await session.close()
+        await self._runner.cleanup()
+
+    # Bot, который ходит в этот сервер вместо api.telegram.org
+    def bot(self, token=f"{BOT_ID}:fake"):
+        session = AiohttpSession(api=TelegramAPIServer.from_base(self.url))
+        self._sessions.append(session)
+        return Bot(token=token, session=session)
+
+    def reset(self):
+        self.calls.clear()
+        self.floods.clear()
+        self.sent_at.clear()
+        self.answered_at.clear()
+
+    # Обновление, которое бот получит через getUpdates
+    def push_update(self, update):
+        update = dict(update, update_id=next(self._update_ids))
+        self._updates.append(update)
+        self._has_updates.set()
+        return update['update_id']
+
+    async def _handle(self, request):
+        method = request.match_info['method']
+        if request.content_type == 'application/json':
+            params = await request.json()
+        else:
+            params = dict(await request.post())
+        self.calls[method] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.flood_rate and random.random() < self.flood_rate:
+            self.floods[method] += 1
+            return web.json_response({
+                'ok': False,
+                'error_code': 429,
+                'description': f"Too Many Requests: retry after {self.retry_after}",
+                'parameters': {'retry_after': self.retry_after},
+            }, status=429)
+        handler = getattr(self, f"api_{method}", None)
+        if handler is None:
+            return web.json_response({'ok': True, 'result': True})
+        try:
+            result = handler(params)
+            if asyncio.iscoroutine(result):
+                result = await result
+        except ValueError as e:
+            return web.json_response({'ok': False, 'error_code': 400, 'description': f"Bad Request: {e}"},
+                                     status=400)
+        return web.json_response({'ok': True, 'result': result})
+
+    def _message(self, chat_id, message_id, text):
+        return {
+            'message_id': message_id,
+            'date': int(time.time()),
+            'chat': {'id': int(chat_id), 'type': 'group' if int(chat_id) < 0 else 'private'},
+            'from': {'id': BOT_ID, 'is_bot': True, 'first_name': 'HockeyBot'},
+            'text': text,
+        }
+
+    def api_getMe(self, params):
+        return {'id': BOT_ID, 'is_bot': True, 'first_name': 'HockeyBot', 'username': 'hockey_bot'}
+
+    def api_sendMessage(self, params):
+        if params.get('parse_mode') == 'HTML':
+            check_html(params['text'])
+        message_id = next(self._message_ids)
+        self.sent_at[int(params['chat_id'])].append(time.monotonic())
+        self.messages[(int(params['chat_id']), message_id)] = params['text']
+        if params.get('reply_markup'):
+            markup = params['reply_markup']
+            self.markups[(int(params['chat_id']), message_id)] = \
+                json.loads(markup) if isinstance(markup, str) else markup
+        return self._message(params['chat_id'], message_id, params['text'])
+
+    def api_editMessageText(self, params):
+        key = (int(params['chat_id']), int(params['message_id']))
+        if params.get('parse_mode') == 'HTML':
+            check_html(params['text'])
+        if self.messages.get(key) == params['text']:
+            raise ValueError("message is not modified: specified new message content "
+                             "and reply markup are exactly the same as a current content")
+        self.messages[key] = params['text']
+        return self._message(*key, params['text'])
+
+    def api_answerCallbackQuery(self, params):
+        self.answered_at[params['callback_query_id']] = time.monotonic()
+        return True
+
+    def api_getChatAdministrators(self, params):
+        chat_id = int(params['chat_id'])
+        if chat_id > 0:
+            raise ValueError("there are no administrators in the private chat")
+        rights = dict.fromkeys((
+            'can_be_edited', 'is_anonymous', 'can_manage_chat', 'can_delete_messages',
+            'can_manage_video_chats', 'can_restrict_members', 'can_promote_members',
+            'can_change_info', 'can_invite_users', 'can_post_stories', 'can_edit_stories',
+            'can_delete_stories'), False)
+        return [{'status': 'administrator', 'user': {'id': user_id, 'is_bot': False, 'first_name': f"Admin {user_id}"},
+                 **rights} for user_id in sorted(self.admins[chat_id])]
+
+    # Long polling: ждём новые обновления не дольше timeout
+    async def api_getUpdates(self, params):
+        offset = int(params.get('offset') or 0)
+        self._updates = [u for u in self._updates if u['update_id'] >= offset]
+        if not self._updates:
+            self._has_updates.clear()
+            try:
+                await asyncio.wait_for(self._has_updates.wait(), float(params.get('timeout') or 0))
+            except asyncio.TimeoutError:
+                pass
+        batch = self._updates[:int(params.get('limit') or 100)]
+        if self.duplicate_rate:
+            batch = [copy for update in batch
+                     for copy in ([update, update] if random.random() < self.duplicate_rate else [update])]
+        return batch
@@ -0,0 +1,213 @@
+# Нагрузочный тест бота без сети.
+# Dispatcher из hockey_bot.create_dispatcher() получает обновления через
+# getUpdates локального фейкового Bot API (задержка и ответы 429 настраиваются).
+# Сценарий: N игроков пишут /start, тренер создаёт событие, все нажимают
+# «✅ Буду», тренер запускает /form_teams. По каждому этапу — p50/p95/p99
+# времени обработки обновления, сквозная задержка, обновлений в секунду и
+# запросов к API на обновление.
+#
+# Запуск: python benchmarks/load_test.py --players 200 --latency 0.02
+# Сохранить отчёт и сравнить с ним следующий прогон:
+#     python benchmarks/load_test.py --save baseline.json
+#     python benchmarks/load_test.py --baseline baseline.json
+# При регрессии (p95 хуже в --tolerance раз или больше запросов к API)
+# скрипт завершается с кодом 1.
+import os
+import sys
+import json
+import math
+import time
+import asyncio
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('TOKEN', '0:bench')
+
+import scenarios
+from fake_bot_api import FakeBotAPI
+
+# Служебные методы polling не относятся к обработке обновлений
+SERVICE_METHODS = ('getUpdates', 'getMe', 'deleteWebhook')
+UNLIMITED = 1e9
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[max(0, math.ceil(p * len(values)) - 1)] if values else 0.0
+
+
+# Outer-middleware Dispatcher: когда обновление начали и закончили обрабатывать
+class UpdateTimer:
+    def __init__(self):
+        self.done = {}
+        self.errors = 0
+
+    async def __call__(self, handler, event, data):
+        start = time.monotonic()
+        try:
+            return await handler(event, data)
+        except Exception:
+            self.errors += 1
+            raise
+        finally:
+            self.done[event.update_id] = (start, time.monotonic())
+
+
+class LoadTest:
+    def __init__(self, hockey_bot, api, timer, rate):
+        self.hockey_bot = hockey_bot
+        self.api = api
+        self.timer = timer
+        self.rate = rate
+        self.report = {}
+
+    def api_calls(self):
+        return sum(count for method, count in self.api.calls.items() if method not in SERVICE_METHODS)
+
+    async def phase(self, name, updates, after=None):
+        calls_before, errors_before = self.api_calls(), self.timer.errors
+        pushed = {}
+        for update in updates:
+            pushed[self.api.push_update(update)] = time.monotonic()
+            if self.rate:
+                await asyncio.sleep(1 / self.rate)
+        while not all(update_id in self.timer.done for update_id in pushed):
+            await asyncio.sleep(0.002)
+        if after is not None:
+            await after()
+        handler = [(self.timer.done[u][1] - self.timer.done[u][0]) * 1000 for u in pushed]
+        e2e = [(self.timer.done[u][1] - t) * 1000 for u, t in pushed.items()]
+        wall = max(self.timer.done[u][1] for u in pushed) - min(pushed.values())
+        self.report[name] = {
+            'updates': len(pushed),
+            'p50_ms': percentile(handler, 0.5),
+            'p95_ms': percentile(handler, 0.95),
+            'p99_ms': percentile(handler, 0.99),
+            'e2e_p95_ms': percentile(e2e, 0.95),
+            'updates_per_s': len(pushed) / wall if wall > 0 else float('inf'),
+            'api_calls_per_update': (self.api_calls() - calls_before) / len(pushed),
+            'errors': self.timer.errors - errors_before,
+        }
+
+    # Сообщение события в группе и callback_data кнопки «✅ Буду»
+    def find_poll(self):
+        for (chat_id, message_id), markup in reversed(self.api.markups.items()):
+            if chat_id == scenarios.GROUP_ID and 'Кто будет' in self.api.messages[(chat_id, message_id)]:
+                button = markup['inline_keyboard'][0][0]
+                return message_id, button['callback_data'], self.api.messages[(chat_id, message_id)], markup
+        raise RuntimeError("Сообщение события не найдено")
+
+    async def run(self, players, teams):
+        await self.phase('start', scenarios.players_start(players))
+        await self.phase('create_event', scenarios.coach_create_event())
+        message_id, data, text, markup = self.find_poll()
+        # Правки сообщения события откладываются — ждём их и учитываем в этапе
+        await self.phase('tap', scenarios.players_tap(players, message_id, data, text, markup),
+                         after=self.hockey_bot.roster_updater.flush_all)
+        await self.phase('form_teams', scenarios.coach_form_teams(teams))
+
+
+def print_report(report):
+    print(f"{'phase':>12} | {'updates':>7} | {'p50, ms':>8} {'p95, ms':>8} {'p99, ms':>8} | "
+          f"{'e2e p95':>8} | {'upd/s':>8} | {'API/upd':>7} | {'errors':>6}")
+    for name, row in report.items():
+        print(f"{name:>12} | {row['updates']:>7} | {row['p50_ms']:>8.2f} {row['p95_ms']:>8.2f} "
+              f"{row['p99_ms']:>8.2f} | {row['e2e_p95_ms']:>8.1f} | {row['updates_per_s']:>8.1f} | "
+              f"{row['api_calls_per_update']:>7.2f} | {row['errors']:>6}")
+
+
+# Регрессии относительно сохранённого отчёта
+def compare(report, baseline, tolerance):
+    problems = []
+    for name, row in report.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        # Медленнее в tolerance раз (и хотя бы на 1 мс — шум на микросекундах не в счёт)
+        if row['p95_ms'] > base['p95_ms'] * tolerance and row['p95_ms'] - base['p95_ms'] > 1:
+            problems.append(f"{name}: p95 {base['p95_ms']:.2f} -> {row['p95_ms']:.2f} ms")
+        if row['api_calls_per_update'] > base['api_calls_per_update'] + 0.05:
+            problems.append(f"{name}: API calls/update {base['api_calls_per_update']:.2f} "
+                            f"-> {row['api_calls_per_update']:.2f}")
+        if row['errors'] > base['errors']:
+            problems.append(f"{name}: errors {base['errors']} -> {row['errors']}")
+    return problems
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--players', type=int, default=100)
+    parser.add_argument('--teams', type=int, default=None, help='число команд для /form_teams')
+    parser.add_argument('--rate', type=float, default=0, help='обновлений в секунду, 0 — все сразу')
+    parser.add_argument('--latency', type=float, default=0.02, help='задержка фейкового API, с')
+    parser.add_argument('--flood-rate', type=float, default=0.0, help='доля ответов 429')
+    parser.add_argument('--telegram-limits', action='store_true',
+                        help='лимиты очереди исходящих как у Telegram (по умолчанию сняты)')
+    parser.add_argument('--save', help='сохранить отчёт в JSON')
+    parser.add_argument('--baseline', help='сравнить с сохранённым отчётом')
+    parser.add_argument('--tolerance', type=float, default=1.5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ['DB_PATH'] = os.path.join(tmp, 'load.db')
+        import hockey_bot
+        from migrations import migrate
+        from outbox import Outbox, OutboxMiddleware
+
+        api = FakeBotAPI(latency=args.latency, flood_rate=args.flood_rate)
+        await api.start()
+        api.admins[scenarios.GROUP_ID] = {scenarios.COACH_ID}
+        bot = api.bot()
+        outbox = Outbox() if args.telegram_limits else Outbox(UNLIMITED, UNLIMITED, UNLIMITED)
+        bot.session.middleware(OutboxMiddleware(outbox))
+        db = hockey_bot.db
+        await db.open()
+        try:
+            await migrate(db)
+            await db.execute("INSERT INTO users (user_id, name, last_chat_id) VALUES (?, 'Тренер', ?)",
+                             (scenarios.COACH_ID, scenarios.GROUP_ID))
+            await db.execute("INSERT INTO members (chat_id, user_id, name, is_coach) VALUES (?, ?, 'Тренер', 1)",
+                             (scenarios.GROUP_ID, scenarios.COACH_ID))
+            await hockey_bot.roles.load(db)
+
+            timer = UpdateTimer()
+            dp = hockey_bot.create_dispatcher()
+            dp.update.outer_middleware(timer)
+            polling = asyncio.create_task(dp.start_polling(bot, handle_signals=False, polling_timeout=10))
+            await asyncio.sleep(0.2)
+            test = LoadTest(hockey_bot, api, timer, args.rate)
+            try:
+                await test.run(args.players, args.teams)
+            finally:
+                await dp.stop_polling()
+                await polling
+            await outbox.close()
+        finally:
+            await db.close()
+            await api.stop()
+
+    print(f"{args.players} игроков, задержка API {args.latency * 1000:.0f} мс, "
+          f"доля 429: {args.flood_rate:g}, лимиты Telegram: {'да' if args.telegram_limits else 'нет'}")
+    print_report(test.report)
+    print(f"запросы к API: {dict(api.calls)}")
+    # Имена с разметкой экранированы и в составе события, и в составах команд
+    texts = [text for (chat_id, _), text in api.messages.items() if chat_id == scenarios.GROUP_ID]
+    escaped = "&lt;Капитан&gt; &amp; Co"
+    assert any("Будут" in text and escaped in text for text in texts), "roster names are not escaped"
+    assert any("Составы" in text and escaped in text for text in texts), "lineup names are not escaped"
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(test.report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            problems = compare(test.report, json.load(f), args.tolerance)
+        if problems:
+            print("Регрессии:\n" + "\n".join(f"  {p}" for p in problems))
+            sys.exit(1)
+        print("Регрессий нет")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,78 @@
+# Генератор обновлений Telegram для нагрузочных сценариев.
+# Обновления — словари в формате Bot API, их кладут в FakeBotAPI.push_update
+# (update_id проставляет фейковый API).
+import time
+import itertools
+from datetime import date, timedelta
+
+GROUP_ID = -1001
+COACH_ID = 1
+FIRST_PLAYER_ID = 1000
+
+_message_ids = itertools.count(1)
+
+
+# У каждого десятого игрока в имени разметка: имена попадают в HTML-сообщения
+def user(user_id):
+    last_name = str(user_id) if user_id % 10 else f"{user_id} <Капитан> & Co"
+    return {'id': user_id, 'is_bot': False, 'first_name': "Игрок", 'last_name': last_name}
+
+
+def chat(chat_id):
+    if chat_id > 0:
+        return {'id': chat_id, 'type': 'private', 'first_name': f"Игрок {chat_id}"}
+    return {'id': chat_id, 'type': 'supergroup', 'title': 'Хоккей'}
+
+
+def message(user_id, chat_id, text):
+    update = {
+        'message_id': next(_message_ids),
+        'date': int(time.time()),
+        'chat': chat(chat_id),
+        'from': user(user_id),
+        'text': text,
+    }
+    if text.startswith('/'):
+        update['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+    return {'message': update}
+
+
+def callback(user_id, chat_id, message_id, data, text='', reply_markup=None):
+    bot_message = {
+        'message_id': message_id,
+        'date': int(time.time()),
+        'chat': chat(chat_id),
+        'from': {'id': 42, 'is_bot': True, 'first_name': 'HockeyBot'},
+        'text': text,
+    }
+    if reply_markup:
+        bot_message['reply_markup'] = reply_markup
+    return {'callback_query': {
+        'id': f"cb{user_id}:{message_id}:{next(_message_ids)}",
+        'from': user(user_id),
+        'chat_instance': str(chat_id),
+        'data': data,
+        'message': bot_message,
+    }}
+
+
+# N игроков пишут боту /start в личку
+def players_start(players):
+    return [message(FIRST_PLAYER_ID + i, FIRST_PLAYER_ID + i, '/start') for i in range(players)]
+
+
+# Тренер создаёт событие в группе через несколько дней
+def coach_create_event(days_ahead=3, event_type='Игра'):
+    day = date.today() + timedelta(days=days_ahead)
+    return [message(COACH_ID, GROUP_ID, f"/create_event {day:%d.%m} {event_type}")]
+
+
+# Все игроки нажимают «✅ Буду» под сообщением события
+def players_tap(players, message_id, data, text, reply_markup):
+    return [callback(FIRST_PLAYER_ID + i, GROUP_ID, message_id, data, text, reply_markup)
+            for i in range(players)]
+
+
+# Тренер формирует составы
+def coach_form_teams(teams=None):
+    return [message(COACH_ID, GROUP_ID, '/form_teams' + (f" {teams}" if teams else ''))]
@@ -0,0 +1,183 @@
+import re
+import inspect
+from aiogram.filters.callback_data import MAX_CALLBACK_LENGTH, CallbackData
+
+BASE36 = '0123456789abcdefghijklmnopqrstuvwxyz'
+
+
+def to_base36(value):
+    if value < 0:
+        return '-' + to_base36(-value)
+    digits = ''
+    while True:
+        value, rest = divmod(value, 36)
+        digits = BASE36[rest] + digits
+        if not value:
+            return digits
+
+
+def decode_bool(value):
+    if value not in ('0', '1'):
+        raise ValueError(f"Bad bool {value!r}")
+    return value == '1'
+
+
+DECODERS = {
+    int: lambda value: int(value, 36),
+    bool: decode_bool,
+}
+
+
+# Компактные типизированные callback_data.
+# Целые числа кодируются в base36 (user_id до 2^52 — 11 символов), bool — 0/1,
+# поэтому даже самые длинные данные укладываются в 64 байта с большим запасом.
+class CompactCallback(CallbackData, prefix='cb'):
+    def _encode_value(self, key, value):
+        if isinstance(value, int) and not isinstance(value, bool):
+            return to_base36(value)
+        return super()._encode_value(key, value)
+
+    def pack(self):
+        parts = [self.__prefix__]
+        for name, value in self.__dict__.items():
+            parts.append(to_base36(value) if type(value) is int else self._encode_value(name, value))
+        data = self.__separator__.join(parts)
+        if len(data.encode()) > MAX_CALLBACK_LENGTH:
+            raise ValueError(f"Callback data {data!r} is longer than {MAX_CALLBACK_LENGTH} bytes")
+        return data
+
+    # Поля разбираем сами (base36, 0/1), pydantic лишь проверяет результат
+    @classmethod
+    def unpack(cls, value):
+        decoders = cls.__dict__.get('_decoders')
+        if decoders is None:
+            decoders = [(name, DECODERS.get(field.annotation, str)) for name, field in cls.model_fields.items()]
+            type.__setattr__(cls, '_decoders', decoders)
+        prefix, *parts = value.split(cls.__separator__)
+        if prefix != cls.__prefix__ or len(parts) != len(decoders):
+            raise ValueError(f"Callback data {value!r} does not match {cls.__name__}")
+        return cls(**{name: decode(part) for (name, decode), part in zip(decoders, parts)})
+
+
+class SelectEvent(CompactCallback, prefix='e'):
+    event_id: int
+
+
+class Mark(CompactCallback, prefix='m'):
+    event_id: int
+    going: bool
+
+
+class CreateEvent(CompactCallback, prefix='ce'):
+    pass
+
+
+# Шаги создания события через меню: тип (номер в EVENT_TYPES), подтверждение, отмена
+class EventType(CompactCallback, prefix='et'):
+    index: int
+
+
+class ConfirmEvent(CompactCallback, prefix='ec'):
+    pass
+
+
+class CancelEvent(CompactCallback, prefix='ex'):
+    pass
+
+
+class FormTeams(CompactCallback, prefix='ft'):
+    pass
+
+
+class SetCoach(CompactCallback, prefix='sc'):
+    pass
+
+
+class SelectCoach(CompactCallback, prefix='c'):
+    user_id: int
+
+
+class BackToCoachMenu(CompactCallback, prefix='bc'):
+    pass
+
+
+class BackToEvents(CompactCallback, prefix='be'):
+    pass
+
+
+# Кнопки, отправленные до перехода на компактный формат, продолжают работать
+LEGACY_EXACT = {
+    'create_event': CreateEvent,
+    'form_teams': FormTeams,
+    'set_coach': SetCoach,
+    'back_to_coach_menu': BackToCoachMenu,
+    'back_to_events': BackToEvents,
+}
+LEGACY_PATTERNS = [
+    (re.compile(r'select_event_(\d+)$'), lambda m: SelectEvent(event_id=int(m[1]))),
+    (re.compile(r'mark_(\d+)_([01])$'), lambda m: Mark(event_id=int(m[1]), going=m[2] == '1')),
+    (re.compile(r'select_coach_(\d+)$'), lambda m: SelectCoach(user_id=int(m[1]))),
+]
+
+
+def parse_legacy(data):
+    if data in LEGACY_EXACT:
+        return LEGACY_EXACT[data]()
+    for pattern, build in LEGACY_PATTERNS:
+        match = pattern.match(data)
+        if match:
+            return build(match)
+    return None
+
+
+# Реестр схем callback_data и маршрутизация по префиксу через словарь.
+# Обработчикам с параметром state передаётся FSMContext диалога.
+class CallbackRouter:
+    def __init__(self):
+        self._routes = {}
+        self._with_state = set()
+
+    def register(self, schema, handler):
+        prefix = schema.__prefix__
+        if prefix in self._routes:
+            raise ValueError(f"Callback prefix {prefix!r} is already registered")
+        self._routes[prefix] = (schema, handler)
+        if 'state' in inspect.signature(handler).parameters:
+            self._with_state.add(handler)
+
+    # Возвращает (данные, обработчик) или (None, None) для неизвестных данных
+    def resolve(self, data):
+        route = self._routes.get(data.split(':', 1)[0])
+        if route is not None:
+            schema, handler = route
+            try:
+                return schema.unpack(data), handler
+            except ValueError:
+                return None, None
+        payload = parse_legacy(data)
+        if payload is not None and payload.__prefix__ in self._routes:
+            return payload, self._routes[payload.__prefix__][1]
+        return None, None
+
+    # Имена обработчика и схемы для метрик, без разбора данных
+    def route_name(self, data):
+        route = self._routes.get(data.split(':', 1)[0])
+        if route is not None:
+            return route[1].__name__, route[0].__name__
+        payload = parse_legacy(data)
+        if payload is not None and payload.__prefix__ in self._routes:
+            schema, handler = self._routes[payload.__prefix__]
+            return handler.__name__, f"legacy:{schema.__name__}"
+        return 'unknown', ''
+
+    async def dispatch(self, callback, state=None):
+        payload, handler = self.resolve(callback.data or '')
+        if handler is None:
+            print(f"Unknown callback data: {callback.data!r}")
+            return callback.answer("⚠️ Кнопка устарела, откройте меню заново")
+        if handler in self._with_state:
+            result = await handler(callback, payload, state=state)
+        else:
+            result = await handler(callback, payload)
+        # Убираем «часики» на кнопке, если обработчик не ответил сам
+        return result if result is not None else callback.answer()
@@ -0,0 +1,94 @@
+import os
+import time
+import asyncio
+
+# Сколько секунд доверять списку администраторов чата без повторного запроса
+ADMIN_CACHE_TTL = float(os.getenv('ADMIN_CACHE_TTL', '300'))
+ADMIN_STATUSES = ('creator', 'administrator')
+
+
+# Кэш администраторов чатов.
+# Список хранится ADMIN_CACHE_TTL секунд; одновременные нажатия в чате без
+# свежего списка ждут один общий запрос get_chat_administrators. Обновления
+# chat_member меняют закэшированный список сразу, не дожидаясь TTL.
+class AdminCache:
+    def __init__(self, ttl=ADMIN_CACHE_TTL):
+        self.ttl = ttl
+        self._admins = {}
+        self._inflight = {}
+        self.stats = {'hits': 0, 'misses': 0, 'shared': 0, 'updates': 0, 'errors': 0}
+
+    async def get(self, bot, chat_id):
+        entry = self._admins.get(chat_id)
+        if entry is not None and entry[0] > time.monotonic():
+            self.stats['hits'] += 1
+            return entry[1]
+        task = self._inflight.get(chat_id)
+        if task is not None:
+            self.stats['shared'] += 1
+        else:
+            self.stats['misses'] += 1
+            task = self._inflight[chat_id] = asyncio.create_task(self._fetch(bot, chat_id))
+        # Отмена одного ожидающего не должна отменять общий запрос
+        return await asyncio.shield(task)
+
+    async def _fetch(self, bot, chat_id):
+        try:
+            admins = await bot.get_chat_administrators(chat_id)
+        except Exception:
+            self.stats['errors'] += 1
+            raise
+        else:
+            user_ids = {admin.user.id for admin in admins}
+            self._admins[chat_id] = (time.monotonic() + self.ttl, user_ids)
+            return user_ids
+        finally:
+            del self._inflight[chat_id]
+
+    async def is_admin(self, bot, chat_id, user_id):
+        # Личный чат — отдельная «команда» своего владельца; у таких чатов
+        # (и у чата прежних данных с id 0) нет списка администраторов
+        if chat_id >= 0:
+            return chat_id == user_id
+        return user_id in await self.get(bot, chat_id)
+
+    # Обработчик обновлений chat_member: повышение или снятие администратора
+    # сразу отражается в кэше. Незакэшированные чаты не трогаем.
+    async def on_chat_member(self, update):
+        entry = self._admins.get(update.chat.id)
+        if entry is None:
+            return
+        self.stats['updates'] += 1
+        user_id = update.new_chat_member.user.id
+        if update.new_chat_member.status in ADMIN_STATUSES:
+            entry[1].add(user_id)
+        else:
+            entry[1].discard(user_id)
+
+    def invalidate(self, chat_id=None):
+        if chat_id is None:
+            self._admins.clear()
+        else:
+            self._admins.pop(chat_id, None)
+
+    # Снимок для быстрого перезапуска (см. warm_start.CacheSnapshot): срок
+    # хранения пересчитывается в обычное время — monotonic после перезапуска другое
+    def snapshot(self):
+        shift = time.time() - time.monotonic()
+        return {chat_id: (expires + shift, user_ids) for chat_id, (expires, user_ids) in self._admins.items()}
+
+    def load_snapshot(self, state):
+        shift = time.time() - time.monotonic()
+        self._admins = {chat_id: (expires - shift, user_ids) for chat_id, (expires, user_ids) in state.items()
+                        if expires > time.time()}
+
+    def metrics(self):
+        lookups = self.stats['hits'] + self.stats['misses'] + self.stats['shared']
+        return {
+            **self.stats,
+            'chats': len(self._admins),
+            'hit_rate': self.stats['hits'] / lookups if lookups else 0.0,
+        }
+
+
+admin_cache = AdminCache()
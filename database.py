@@ -0,0 +1,198 @@
+import os
+import asyncio
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Путь к базе и размер пула читателей можно задать через переменные окружения
+DB_PATH = os.getenv('DB_PATH', 'hockey.db')
+DB_READERS = int(os.getenv('DB_READERS', '4'))
+
+
+# Асинхронный слой доступа к SQLite.
+# Один долгоживущий писатель (отдельный поток) и пул читателей (по соединению
+# на поток). Все запросы выполняются вне event loop, поэтому одновременные
+# нажатия кнопок не ждут дискового ввода-вывода друг друга.
+class Database:
+    def __init__(self, path=DB_PATH, readers=DB_READERS):
+        self.path = path
+        self.readers = readers
+        self._writer = None
+        self._write_executor = None
+        self._read_executor = None
+        self._local = threading.local()
+        self._reader_conns = []
+        self._lock = threading.Lock()
+        # observer(statement, seconds, rows) — для метрик; время меряется в потоке базы
+        self.observer = None
+
+    # Открываем соединение с настройками WAL
+    def _connect(self, readonly=False):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+        if readonly:
+            conn.execute("PRAGMA query_only = ON")
+        else:
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("PRAGMA synchronous = NORMAL")
+            conn.execute("PRAGMA foreign_keys = ON")
+        return conn
+
+    def _writer_conn(self):
+        if self._writer is None:
+            self._writer = self._connect()
+        return self._writer
+
+    def _reader_conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._connect(readonly=True)
+            self._local.conn = conn
+            with self._lock:
+                self._reader_conns.append(conn)
+        return conn
+
+    def _executors(self):
+        if self._write_executor is None:
+            self._write_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='db-writer')
+            self._read_executor = ThreadPoolExecutor(max_workers=self.readers, thread_name_prefix='db-reader')
+        return self._write_executor, self._read_executor
+
+    # Выполняется в потоке писателя: fn(conn) внутри одной транзакции
+    def _write(self, fn):
+        conn = self._writer_conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = fn(conn)
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        return result
+
+    def _read(self, fn):
+        return fn(self._reader_conn())
+
+    async def _submit(self, executor, fn, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor, fn, *args)
+
+    # Выполнение с замером: label — текст запроса или имя функции транзакции,
+    # rows(result) — число строк для метрик
+    async def _run(self, executor, fn, label, rows=None):
+        if self.observer is None:
+            return await self._submit(executor, fn)
+
+        def timed():
+            start = time.perf_counter()
+            result = fn()
+            return result, time.perf_counter() - start
+
+        result, elapsed = await self._submit(executor, timed)
+        self.observer(label, elapsed, rows(result) if rows else None)
+        return result
+
+    @staticmethod
+    def _label(fn):
+        return getattr(fn, '__name__', 'fn')
+
+    async def open(self):
+        writer, _ = self._executors()
+        await self._submit(writer, self._writer_conn)
+
+    async def close(self):
+        if self._write_executor is None:
+            return
+        writer, reader = self._write_executor, self._read_executor
+        self._write_executor = self._read_executor = None
+        writer.shutdown(wait=True)
+        reader.shutdown(wait=True)
+        with self._lock:
+            conns, self._reader_conns = self._reader_conns, []
+        for conn in conns:
+            conn.close()
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        self._local = threading.local()
+
+    # Транзакция на соединении писателя
+    async def transaction(self, fn):
+        writer, _ = self._executors()
+        return await self._run(writer, lambda: self._write(fn), f"tx:{self._label(fn)}")
+
+    # fn(conn) на соединении писателя без обёртки в транзакцию (миграции, обслуживание)
+    async def with_writer(self, fn):
+        writer, _ = self._executors()
+        return await self._run(writer, lambda: fn(self._writer_conn()), f"writer:{self._label(fn)}")
+
+    # Копия базы в файл path через backup API: pages страниц за шаг, между
+    # шагами пауза sleep секунд. Источник — соединение писателя: транзакции,
+    # выполненные во время копирования, сразу попадают в копию, и копирование
+    # не начинается заново (как при изменении базы другим соединением).
+    # Копирование идёт в отдельном потоке, писатель ждёт не дольше одного шага.
+    # progress(status, remaining, total) может прервать копирование исключением
+    async def backup(self, path, pages, sleep, progress=None):
+        writer, _ = self._executors()
+        source = await self._submit(writer, self._writer_conn)
+
+        # sleep у Connection.backup — пауза только после занятой базы (BUSY),
+        # поэтому пауза между шагами — в progress, когда шаг уже отпустил соединение
+        def step(status, remaining, total):
+            if progress is not None:
+                progress(status, remaining, total)
+            if remaining:
+                time.sleep(sleep)
+
+        # Последний шаг записывает копию на диск, держа соединение писателя:
+        # копия пишется без журнала и fsync, а на диск сбрасывается уже после
+        def copy():
+            target = sqlite3.connect(path)
+            try:
+                target.execute("PRAGMA journal_mode = OFF")
+                target.execute("PRAGMA synchronous = OFF")
+                source.backup(target, pages=pages, sleep=sleep, progress=step)
+            finally:
+                target.close()
+            fd = os.open(path, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+        return await self._run(None, copy, 'backup')
+
+    # Произвольное чтение на соединении из пула
+    async def read(self, fn):
+        _, reader = self._executors()
+        return await self._run(reader, lambda: self._read(fn), f"read:{self._label(fn)}")
+
+    async def execute(self, sql, params=()):
+        writer, _ = self._executors()
+        cursor = await self._run(writer, lambda: self._write(lambda conn: conn.execute(sql, params)),
+                                 sql, rows=lambda cursor: cursor.rowcount)
+        return cursor.lastrowid
+
+    async def executemany(self, sql, seq_of_params):
+        writer, _ = self._executors()
+        return await self._run(writer,
+                               lambda: self._write(lambda conn: conn.executemany(sql, seq_of_params).rowcount),
+                               sql, rows=lambda rowcount: rowcount)
+
+    async def executescript(self, script):
+        return await self.with_writer(lambda conn: conn.executescript(script))
+
+    async def fetchone(self, sql, params=()):
+        _, reader = self._executors()
+        return await self._run(reader,
+                               lambda: self._read(lambda conn: conn.execute(sql, params).fetchone()),
+                               sql, rows=lambda row: int(row is not None))
+
+    async def fetchall(self, sql, params=()):
+        _, reader = self._executors()
+        return await self._run(reader,
+                               lambda: self._read(lambda conn: conn.execute(sql, params).fetchall()),
+                               sql, rows=len)
+
+
+db = Database()
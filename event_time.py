@@ -0,0 +1,176 @@
+import os
+import re
+from datetime import datetime, time, timedelta
+from zoneinfo import ZoneInfo
+
+# Часовой пояс команды: в нём вводятся и показываются даты событий.
+# В базе время события хранится как UNIX-время (UTC) в events.starts_at.
+EVENT_TZ = ZoneInfo(os.getenv('EVENT_TZ', 'Europe/Moscow'))
+# Дата без года относится к ближайшему году, в котором она попадает в окно
+# [сегодня - PAST_DAYS, сегодня + 365 - PAST_DAYS): «05.01», введённое в декабре, —
+# это январь следующего года, а «28.12», введённое в январе, — прошедший декабрь
+PAST_DAYS = 60
+
+DATE_RE = re.compile(r'(\d{1,2})\.(\d{1,2})(?:\.(\d{2}|\d{4}))?$')
+TIME_RE = re.compile(r'(\d{1,2})[:.](\d{2})$')
+
+EVENT_COLUMNS = "event_id, starts_at, type, status"
+# Самый длинный допустимый тип события («Тренировка», «Игра», …)
+EVENT_TYPE_MAX_LENGTH = 64
+
+
+def now_local():
+    return datetime.now(EVENT_TZ)
+
+
+# Год для дня и месяца без года относительно момента now
+def infer_year(day, month, now, past_days=PAST_DAYS):
+    today = now.date()
+    earliest = today - timedelta(days=past_days)
+    for year in (earliest.year, earliest.year + 1):
+        try:
+            candidate = today.replace(year=year, month=month, day=day)
+        except ValueError:
+            continue
+        if earliest <= candidate < earliest + timedelta(days=365):
+            return year
+    raise ValueError(f"Нет даты {day:02d}.{month:02d} рядом с {today:%d.%m.%Y}")
+
+
+# «ДД.ММ», «ДД.ММ.ГГ» или «ДД.ММ.ГГГГ» и необязательное время «ЧЧ:ММ»
+# -> datetime в часовом поясе команды
+def parse_event_date(date_text, time_text=None, now=None, past_days=PAST_DAYS):
+    match = DATE_RE.match(date_text.strip())
+    if not match:
+        raise ValueError(f"Неверная дата {date_text!r}")
+    day, month = int(match[1]), int(match[2])
+    now = now or now_local()
+    if match[3]:
+        year = int(match[3]) + (2000 if len(match[3]) == 2 else 0)
+    else:
+        year = infer_year(day, month, now, past_days)
+    start = time()
+    if time_text:
+        time_match = TIME_RE.match(time_text.strip())
+        if not time_match:
+            raise ValueError(f"Неверное время {time_text!r}")
+        start = time(int(time_match[1]), int(time_match[2]))
+    return datetime.combine(datetime(year, month, day).date(), start, tzinfo=EVENT_TZ)
+
+
+# Разбор аргументов /create_event: «ДД.ММ [ЧЧ:ММ] Тип»
+# -> (datetime, тип, событие без времени)
+def parse_event_args(args, now=None):
+    parts = args.split(maxsplit=2)
+    if len(parts) >= 3 and TIME_RE.match(parts[1]):
+        date_text, time_text, event_type = parts
+    elif len(parts) >= 2:
+        date_text, time_text, event_type = parts[0], None, args.split(maxsplit=1)[1]
+    else:
+        raise ValueError("Не указан тип события")
+    return parse_event_date(date_text, time_text, now), event_type, time_text is None
+
+
+def to_timestamp(moment):
+    return int(moment.timestamp())
+
+
+def from_timestamp(timestamp):
+    return datetime.fromtimestamp(timestamp, EVENT_TZ)
+
+
+# Дата для показа: год — только если не текущий, время — если задано
+def format_event_date(timestamp, fallback=''):
+    if timestamp is None:
+        return fallback
+    moment = from_timestamp(timestamp)
+    text = f"{moment:%d.%m}"
+    if moment.year != now_local().year:
+        text += f".{moment.year}"
+    if moment.time() != time():
+        text += f" {moment:%H:%M}"
+    return text
+
+
+# Начало сегодняшнего дня: события сегодня ещё считаются предстоящими
+def start_of_today(now=None):
+    now = now or now_local()
+    return to_timestamp(datetime.combine(now.date(), time(), tzinfo=EVENT_TZ))
+
+
+# Запросы по времени событий одного чата. Все идут по индексам
+# (chat_id, status, starts_at) и (chat_id, starts_at) и читают только нужные
+# строки, сколько бы сезонов и чатов ни хранила база.
+# Возвращают строки (event_id, starts_at, type, status).
+
+# Ближайшие события, начиная с сегодняшнего дня
+async def upcoming(db, chat_id, limit=10, status='open', now=None):
+    since = start_of_today(now)
+    if status is None:
+        return await db.fetchall(f"SELECT {EVENT_COLUMNS} FROM events WHERE chat_id = ? AND starts_at >= ? "
+                                 "ORDER BY starts_at, event_id LIMIT ?", (chat_id, since, limit))
+    return await db.fetchall(f"SELECT {EVENT_COLUMNS} FROM events "
+                             "WHERE chat_id = ? AND status = ? AND starts_at >= ? "
+                             "ORDER BY starts_at, event_id LIMIT ?", (chat_id, status, since, limit))
+
+
+# Прошедшие события, от последнего к более ранним
+async def past(db, chat_id, limit=10, status=None, now=None):
+    until = start_of_today(now)
+    if status is None:
+        return await db.fetchall(f"SELECT {EVENT_COLUMNS} FROM events WHERE chat_id = ? AND starts_at < ? "
+                                 "ORDER BY starts_at DESC, event_id DESC LIMIT ?", (chat_id, until, limit))
+    return await db.fetchall(f"SELECT {EVENT_COLUMNS} FROM events "
+                             "WHERE chat_id = ? AND status = ? AND starts_at < ? "
+                             "ORDER BY starts_at DESC, event_id DESC LIMIT ?", (chat_id, status, until, limit))
+
+
+# События в полуинтервале [start, end); start и end — datetime или UNIX-время
+async def between(db, chat_id, start, end, status=None, limit=None):
+    start = to_timestamp(start) if isinstance(start, datetime) else start
+    end = to_timestamp(end) if isinstance(end, datetime) else end
+    conditions, params = "starts_at >= ? AND starts_at < ?", [start, end]
+    if status is not None:
+        conditions = "status = ? AND " + conditions
+        params.insert(0, status)
+    sql = f"SELECT {EVENT_COLUMNS} FROM events WHERE chat_id = ? AND {conditions} ORDER BY starts_at, event_id"
+    params.insert(0, chat_id)
+    if limit is not None:
+        sql += " LIMIT ?"
+        params.append(limit)
+    return await db.fetchall(sql, params)
+
+
+# Событие, к которому относятся «текущие» действия тренера: ближайшее
+# предстоящее открытое, а если таких нет — последнее прошедшее открытое
+async def current_event(db, chat_id, now=None):
+    rows = await upcoming(db, chat_id, limit=1, now=now)
+    if not rows:
+        rows = await past(db, chat_id, limit=1, status='open', now=now)
+    return rows[0] if rows else None
+
+
+# Перенос старых строк: events.date («ДД.ММ» без года) -> events.starts_at.
+# Год восстанавливаем по порядку создания: самое новое событие — относительно
+# текущей даты, каждое более раннее — не позже следующего за ним (с запасом
+# PAST_DAYS на события, созданные не по порядку). Нераспознанные даты
+# остаются без starts_at и в списках по времени не участвуют.
+def backfill_starts_at(conn, now=None):
+    rows = conn.execute("SELECT event_id, date FROM events WHERE starts_at IS NULL "
+                        "ORDER BY event_id DESC").fetchall()
+    reference, past_days = now or now_local(), PAST_DAYS
+    updates, skipped = [], 0
+    for event_id, date_text in rows:
+        parts = (date_text or '').split(maxsplit=1)
+        try:
+            moment = parse_event_date(parts[0], parts[1] if len(parts) > 1 else None,
+                                      now=reference, past_days=past_days)
+        except (ValueError, IndexError):
+            skipped += 1
+            continue
+        updates.append((to_timestamp(moment), event_id))
+        reference, past_days = moment, 365 - PAST_DAYS
+    conn.executemany("UPDATE events SET starts_at = ? WHERE event_id = ?", updates)
+    if skipped:
+        print(f"Событий с нераспознанной датой: {skipped}")
+    return len(updates), skipped
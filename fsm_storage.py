@@ -0,0 +1,169 @@
+import os
+import json
+import time
+import asyncio
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StorageKey
+
+# Как часто записывать изменённые состояния диалогов в базу (секунды).
+# При остановке бота несохранённое записывается сразу.
+FSM_FLUSH_INTERVAL = float(os.getenv('FSM_FLUSH_INTERVAL', '1'))
+# Диалог без изменений дольше этого срока считается брошенным и удаляется (секунды)
+FSM_TTL = float(os.getenv('FSM_TTL', '86400'))
+# Как часто искать брошенные диалоги в памяти (секунды)
+SWEEP_INTERVAL = 60
+
+
+# Хранилище состояний диалогов aiogram (FSM) в SQLite.
+# Все живые диалоги держатся в памяти: чтение состояния (его запрашивает
+# каждое обновление) — поиск в словаре. Изменения пишутся в таблицу fsm_states
+# не сразу, а пачкой раз в FSM_FLUSH_INTERVAL одной транзакцией. При запуске
+# непросроченные диалоги восстанавливаются из базы.
+class SQLiteStorage(BaseStorage):
+    def __init__(self, flush_interval=FSM_FLUSH_INTERVAL, ttl=FSM_TTL):
+        self.flush_interval = flush_interval
+        self.ttl = ttl
+        self.db = None
+        # StorageKey -> [state, data, время последнего изменения (UNIX)]
+        self._records = {}
+        # Ключи, изменённые после последней записи в базу
+        self._dirty = set()
+        self._task = None
+        self._last_sweep = time.monotonic()
+        self.stats = {'restored': 0, 'flushes': 0, 'written': 0, 'deleted': 0, 'expired': 0, 'errors': 0}
+
+    @staticmethod
+    def _row(key):
+        return (key.bot_id, key.chat_id, key.user_id, key.thread_id or 0,
+                key.business_connection_id or '', key.destiny)
+
+    # Восстановление диалогов при запуске. owns(chat_id) — какие чаты
+    # обслуживает этот процесс (в режиме рабочих процессов)
+    async def restore(self, db, owns=None):
+        self.db = db
+        cutoff = time.time() - self.ttl
+
+        def load_states(conn):
+            expired = conn.execute("DELETE FROM fsm_states WHERE updated_at < ?", (cutoff,)).rowcount
+            rows = conn.execute('''SELECT bot_id, chat_id, user_id, thread_id, business_connection_id,
+                                          destiny, state, data, updated_at FROM fsm_states''').fetchall()
+            return expired, rows
+
+        expired, rows = await db.transaction(load_states)
+        self.stats['expired'] += expired
+        for bot_id, chat_id, user_id, thread_id, connection_id, destiny, state, data, updated_at in rows:
+            if owns is not None and not owns(chat_id):
+                continue
+            key = StorageKey(bot_id, chat_id, user_id, thread_id or None, connection_id or None, destiny)
+            self._records[key] = [state, json.loads(data), updated_at]
+        self.stats['restored'] = len(self._records)
+        print(f"Диалоги восстановлены: {len(self._records)}")
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._flush_loop())
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            if time.monotonic() - self._last_sweep >= SWEEP_INTERVAL:
+                self._sweep()
+            await self.flush()
+
+    # Брошенные диалоги удаляются из памяти, а при следующей записи — из базы
+    def _sweep(self):
+        self._last_sweep = time.monotonic()
+        cutoff = time.time() - self.ttl
+        for key in [key for key, record in self._records.items() if record[2] < cutoff]:
+            del self._records[key]
+            self._dirty.add(key)
+            self.stats['expired'] += 1
+
+    def _record(self, key):
+        record = self._records.get(key)
+        if record is not None and record[2] < time.time() - self.ttl:
+            del self._records[key]
+            self._dirty.add(key)
+            self.stats['expired'] += 1
+            return None
+        return record
+
+    # field: 0 — состояние, 1 — данные
+    def _update(self, key, field, value):
+        record = self._record(key) or [None, {}, 0]
+        record[field] = value
+        record[2] = time.time()
+        # Пустой диалог (состояние сброшено, данных нет) не храним
+        if record[0] is None and not record[1]:
+            self._records.pop(key, None)
+        else:
+            self._records[key] = record
+        self._dirty.add(key)
+
+    async def set_state(self, key, state=None):
+        self._update(key, 0, state.state if isinstance(state, State) else state)
+
+    async def get_state(self, key):
+        record = self._record(key)
+        return record[0] if record is not None else None
+
+    async def set_data(self, key, data):
+        self._update(key, 1, data.copy())
+
+    async def get_data(self, key):
+        record = self._record(key)
+        return record[1].copy() if record is not None else {}
+
+    # Запись накопленных изменений одной транзакцией
+    async def flush(self):
+        if not self._dirty or self.db is None:
+            return
+        dirty, self._dirty = self._dirty, set()
+        upserts, deletes = [], []
+        for key in dirty:
+            record = self._records.get(key)
+            if record is None:
+                deletes.append(self._row(key))
+                continue
+            try:
+                data = json.dumps(record[1], ensure_ascii=False)
+            except (TypeError, ValueError) as e:
+                self.stats['errors'] += 1
+                print(f"ERROR serializing FSM data for {key}: {e}")
+                continue
+            upserts.append(self._row(key) + (record[0], data, record[2]))
+
+        def write_states(conn):
+            conn.executemany('''DELETE FROM fsm_states WHERE bot_id = ? AND chat_id = ? AND user_id = ?
+                                AND thread_id = ? AND business_connection_id = ? AND destiny = ?''', deletes)
+            conn.executemany('''INSERT INTO fsm_states (bot_id, chat_id, user_id, thread_id,
+                                    business_connection_id, destiny, state, data, updated_at)
+                                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                                ON CONFLICT DO UPDATE SET state = excluded.state, data = excluded.data,
+                                    updated_at = excluded.updated_at''', upserts)
+
+        try:
+            await self.db.transaction(write_states)
+        except Exception as e:
+            # Не записанное вернётся в следующую пачку
+            self.stats['errors'] += 1
+            self._dirty |= dirty
+            print(f"ERROR flushing FSM states: {e}")
+            return
+        self.stats['flushes'] += 1
+        self.stats['written'] += len(upserts)
+        self.stats['deleted'] += len(deletes)
+
+    # Остановка: фоновая запись прекращается, остаток пишется сразу
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+
+    def metrics(self):
+        return {**self.stats, 'dialogs': len(self._records), 'dirty': len(self._dirty)}
+
+
+fsm_storage = SQLiteStorage()
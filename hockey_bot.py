@@ -1,128 +1,166 @@
 import os
-import sqlite3
+import html
+import signal
 import asyncio
+import tempfile
 from aiogram import Bot, Dispatcher, types
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 from aiogram.filters import Command
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import State, StatesGroup
 from aiogram.types import (
     InlineKeyboardButton,
     InlineKeyboardMarkup,
     ReplyKeyboardMarkup,
     KeyboardButton,
-    ReplyKeyboardRemove
+    ReplyKeyboardRemove,
+    FSInputFile
+)
+from database import db
+from migrations import migrate
+from roles import COACH, roles
+from chat_admins import admin_cache
+from tenants import tenants
+from fsm_storage import fsm_storage
+from live_roster import roster_updater
+from attendance import attendance
+from render_cache import render_cache
+from stats import player_stats, save_lineup
+from scheduler import scheduler
+from import_export import EVENTS, IMPORT_MAX_BYTES, export_attendance, import_file
+from warm_start import CacheSnapshot, StartupTimer, UpdateOffset
+from backup import Backups
+from outbox import GLOBAL_RATE, Outbox, outbox, OutboxMiddleware
+from workers import WORKERS, Ingress, UpdateDeduplicator, publisher, serve_worker
+from webhook import WEBHOOK_URL, run_webhook
+from metrics import (
+    METRICS_PORT,
+    ApiMetricsMiddleware,
+    HandlerMetricsMiddleware,
+    observe_sql,
+    registry,
+    start_metrics_server,
+    watch_loop_lag
+)
+from callbacks import (
+    CallbackRouter,
+    SelectEvent,
+    Mark,
+    CreateEvent,
+    EventType,
+    ConfirmEvent,
+    CancelEvent,
+    FormTeams,
+    SetCoach,
+    SelectCoach,
+    BackToCoachMenu,
+    BackToEvents
+)
+from pagination import KeysetPaginator, PageNav, prefix_upper_bound
+from event_time import (
+    EVENT_TYPE_MAX_LENGTH,
+    current_event,
+    format_event_date,
+    parse_event_args,
+    parse_event_date,
+    to_timestamp
+)
+from lineup import (
+    MAX_TEAMS,
+    POSITIONS,
+    TEAM_COLORS,
+    TEAM_SIZE,
+    GOALIE,
+    Player,
+    form_lines
 )
 
 # Загружаем переменные окружения
 TOKEN = os.getenv('TOKEN')
 if not TOKEN:
     raise RuntimeError("TOKEN environment variable not set")
+BOT_API_URL = os.getenv('BOT_API_URL')
 
-# Инициализация базы данных
-def init_db():
-    conn = sqlite3.connect('hockey.db')
-    c = conn.cursor()
-    c.execute('''CREATE TABLE IF NOT EXISTS users
-                 (user_id INTEGER PRIMARY KEY, name TEXT, is_coach INTEGER DEFAULT 0)''')
-    c.execute('''CREATE TABLE IF NOT EXISTS events
-                 (event_id INTEGER PRIMARY KEY AUTOINCREMENT, date TEXT, type TEXT, status TEXT DEFAULT 'open', group_msg_id INTEGER)''')
-    c.execute('''CREATE TABLE IF NOT EXISTS participants
-                 (event_id INTEGER, user_id INTEGER,
-                 FOREIGN KEY(event_id) REFERENCES events(event_id),
-                 FOREIGN KEY(user_id) REFERENCES users(user_id))''')
-    c.execute('''CREATE TABLE IF NOT EXISTS teams
-                 (team_id INTEGER PRIMARY KEY AUTOINCREMENT,
-                  event_id INTEGER,
-                  color TEXT,
-                  players TEXT)''')
-    conn.commit()
-    conn.close()
+# Повторно доставленные обновления отбрасываются до обработки
+deduplicator = UpdateDeduplicator()
+# Последнее обработанное обновление (продолжаем с него после перезапуска),
+# время холодного старта и резервные копии базы
+update_offset = UpdateOffset()
+startup = StartupTimer()
+backups = Backups(db)
+# Кэши, которые сохраняются при остановке и загружаются при запуске
+WARM_CACHES = {
+    'roles': roles,
+    'tenants': tenants,
+    'admins': admin_cache,
+    'rosters': attendance,
+    'roster_texts': roster_updater,
+    'render': render_cache,
+}
 
 # Проверка базы 1
 async def check_db_exists(message: types.Message):
     import os
-    db_path = 'hockey.db'
+    db_path = db.path
     exists = os.path.exists(db_path)
     await message.answer(f"🔍 Проверка базы данных:\nФайл {db_path} {'существует' if exists else 'НЕ существует'}")
     
     if exists:
         size = os.path.getsize(db_path)
-        await message.answer(f"Размер файла: {size} байт")
+        latest = backups.latest()
+        text = f"Размер файла: {size} байт\n"
+        text += (f"Резервная копия: {format_event_date(latest[1])}, {latest[2]} байт" if latest
+                 else "Резервных копий пока нет")
+        if startup.stats['ready_seconds']:
+            text += f"\nЗапуск: готов через {startup.stats['ready_seconds']:.2f} с"
+        if startup.stats['first_update_seconds']:
+            text += f", первый ответ через {startup.stats['first_update_seconds']:.2f} с"
+        await message.answer(text)
     else:
         await message.answer("❗ База данных не создана. Попробуйте вызвать /start")
 # Проверка базы 2
 async def check_db_structure(message: types.Message):
     try:
-        conn = sqlite3.connect('hockey.db')
-        c = conn.cursor()
-        
         # Проверяем таблицу users
-        c.execute("PRAGMA table_info(users)")
-        columns = c.fetchall()
+        columns = await db.fetchall("PRAGMA table_info(users)")
         
         if not columns:
             await message.answer("❌ Таблица users не существует!")
         else:
-            await message.answer("✅ Таблица users существует. Колонки:")
-            for col in columns:
-                await message.answer(f"- {col[1]} ({col[2]})")
-        
-        conn.close()
+            # Одно сообщение со всеми колонками вместо сообщения на каждую
+            text = "✅ Таблица users существует. Колонки:\n"
+            text += "\n".join(f"- {col[1]} ({col[2]})" for col in columns)
+            await message.answer(text)
     except Exception as e:
         await message.answer(f"❌ Ошибка при проверке структуры БД: {str(e)}")
 
-# Проверка, является ли пользователь тренером
-def is_coach(user_id):
-    try:
-        conn = sqlite3.connect('hockey.db')
-        c = conn.cursor()
-        
-        # Проверяем существование таблицы
-        c.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='users'")
-        table_exists = c.fetchone()
-        
-        if not table_exists:
-            print(f"ERROR: Table 'users' does not exist")
-            return False
-            
-        # Проверяем существование столбца
-        c.execute("PRAGMA table_info(users)")
-        columns = [col[1] for col in c.fetchall()]
-        if 'is_coach' not in columns:
-            print(f"ERROR: Column 'is_coach' does not exist in users table. Columns: {columns}")
-            return False
-        
-        c.execute("SELECT is_coach FROM users WHERE user_id = ?", (user_id,))
-        result = c.fetchone()
-        conn.close()
-        return result[0] == 1 if result else False
-    except Exception as e:
-        print(f"ERROR in is_coach: {str(e)}")
-        return False
+# Проверка, является ли пользователь тренером команды чата (по кэшу ролей, без запросов к БД)
+def is_coach(chat_id, user_id):
+    return roles.is_coach(chat_id, user_id)
 
-async def show_main_menu(message: types.Message):
-    # Убедимся, что база данных инициализирована
-    init_db()
-    
+# Чат, к которому относится действие пользователя (см. tenants.TenantResolver)
+async def tenant_of(chat, user):
+    return await tenants.resolve(db, chat, user)
+
+async def show_main_menu(message: types.Message, chat_id):
     user_id = message.from_user.id
     
     # Безопасно проверяем статус тренера
     try:
-        is_coach_user = is_coach(user_id)
-        error_msg = "Нет ошибок"
+        is_coach_user = is_coach(chat_id, user_id)
     except Exception as e:
-        # Показываем реальную ошибку в логах
         print(f"ERROR checking coach status for user {user_id}: {str(e)}")
-        error_msg = str(e)
         is_coach_user = False
     
-    # Отправляем подробную отладочную информацию
-    await message.answer(
-        f"🔧 Отладочная информация:\n"
-        f"• user_id: {user_id}\n"
-        f"• is_coach: {is_coach_user}\n"
-        f"• Ошибка: {error_msg}"
+    # Клавиатура зависит только от роли и строится один раз
+    reply_markup = await render_cache.get(
+        'menu', None, COACH if is_coach_user else None,
+        lambda: main_menu_keyboard(is_coach_user)
     )
-    
-    # Создаем клавиатуру
+    await message.answer("🏒 Добро пожаловать в бот хоккейной команды!", reply_markup=reply_markup)
+
+async def main_menu_keyboard(is_coach_user):
     keyboard = [
         [KeyboardButton(text="📅 Просмотреть события")],
         [KeyboardButton(text="✅ Отметиться на событии")]
@@ -135,59 +173,42 @@ async def show_main_menu(message: types.Message):
     # Кнопка помощи
     keyboard.append([KeyboardButton(text="ℹ️ Помощь")])
     
-    reply_markup = ReplyKeyboardMarkup(
+    return ReplyKeyboardMarkup(
         keyboard=keyboard,
         resize_keyboard=True,
         one_time_keyboard=False
     )
-    
-    await message.answer("🏒 Добро пожаловать в бот хоккейной команды!", reply_markup=reply_markup)
-    
-    # Кнопки для тренера
-    if is_coach_user:
-        keyboard.append([KeyboardButton(text="👑 Тренерское меню")])
-    
-    # Кнопка помощи
-    keyboard.append([KeyboardButton(text="ℹ️ Помощь")])
-    
-    reply_markup = ReplyKeyboardMarkup(
-        keyboard=keyboard,
-        resize_keyboard=True,
-        one_time_keyboard=False
-    )
-    
-    await message.answer("🏒 Добро пожаловать в бот хоккейной команды!", reply_markup=reply_markup)
 
 # Обработка нажатий на кнопки главного меню
 async def handle_main_menu(message: types.Message):
     text = message.text
+    chat_id = await tenant_of(message.chat, message.from_user)
     
     if text == "📅 Просмотреть события":
-        await show_events(message)
+        await show_events(message, chat_id)
     
     elif text == "✅ Отметиться на событии":
-        await show_events_to_mark(message)
+        await show_events_to_mark(message, chat_id)
     
     elif text == "👑 Тренерское меню":
-        if is_coach(message.from_user.id):
+        if is_coach(chat_id, message.from_user.id):
             await show_coach_menu(message)
         else:
             await message.answer("❌ У вас нет прав тренера")
     
     # ОБРАБОТКА НОВОЙ КНОПКИ
     elif text == "👑 Назначить первого тренера":
-        # Проверяем права администратора
-        chat_admins = await message.bot.get_chat_administrators(message.chat.id)
-        if not any(admin.user.id == message.from_user.id for admin in chat_admins):
+        # Проверяем права администратора (список администраторов кэшируется)
+        if not await admin_cache.is_admin(message.bot, chat_id, message.from_user.id):
             await message.answer("❌ Только администраторы могут назначать тренера")
             return
         
-        await message.answer(
-            "❗ Чтобы назначить тренера, ответьте на сообщение игрока командой /set_coach\n\n"
-            "Пример:\n"
-            "1. Ответьте на сообщение игрока\n"
-            "2. Напишите: /set_coach"
-        )
+        # Выбор игрока; select_coach ещё раз проверит права администратора
+        reply_markup = await members_pager.keyboard(db, tenant=chat_id)
+        if reply_markup is None:
+            await message.answer("📭 Нет зарегистрированных игроков")
+            return
+        await message.answer("Выберите пользователя для назначения тренером:", reply_markup=reply_markup)
     
     elif text == "ℹ️ Помощь":
         await show_help(message)
@@ -195,61 +216,71 @@ async def handle_main_menu(message: types.Message):
 # Стартовая команда
 async def start_command(message: types.Message):
     user = message.from_user
-    conn = sqlite3.connect('hockey.db')
-    c = conn.cursor()
-    c.execute("INSERT OR IGNORE INTO users (user_id, name) VALUES (?, ?)", (user.id, user.full_name))
-    conn.commit()
-    conn.close()
-    
-    await show_main_menu(message)
-
-# Показываем список событий
-async def show_events(message: types.Message):
-    conn = sqlite3.connect('hockey.db')
-    c = conn.cursor()
-    c.execute("SELECT event_id, date, type FROM events WHERE status = 'open' ORDER BY date DESC")
-    events = c.fetchall()
-    conn.close()
+    chat_id = await tenant_of(message.chat, user)
+    
+    def register(conn):
+        conn.execute("INSERT OR IGNORE INTO users (user_id, name) VALUES (?, ?)", (user.id, user.full_name))
+        conn.execute("INSERT OR IGNORE INTO members (chat_id, user_id, name) VALUES (?, ?, ?)",
+                     (chat_id, user.id, user.full_name))
+    
+    await db.transaction(register)
+    await show_main_menu(message, chat_id)
+
+# Показываем список событий (готовый текст — из кэша, пока события чата не менялись)
+async def show_events(message: types.Message, chat_id):
+    text = await render_cache.get('events', chat_id, None, lambda: events_text(chat_id))
+    await message.answer(text, parse_mode="HTML")
+
+async def events_text(chat_id):
+    # Сначала ближайшие; события без распознанной даты — в конце
+    events = await db.fetchall("SELECT event_id, starts_at, type, date FROM events "
+                               "WHERE chat_id = ? AND status = 'open' "
+                               "ORDER BY starts_at IS NULL, starts_at, event_id", (chat_id,))
     
     if not events:
-        await message.answer("📭 Нет активных событий")
-        return
+        return "📭 Нет активных событий"
     
     text = "🏒 <b>Активные события:</b>\n\n"
     for event in events:
-        text += f"• <b>{event[2]}</b> {event[1]} (ID: {event[0]})\n"
-    
-    await message.answer(text, parse_mode="HTML")
+        text += f"• <b>{html.escape(event[2])}</b> {format_event_date(event[1], event[3])} (ID: {event[0]})\n"
+    return text
+
+# Постраничные списки чата: открытые события и игроки для назначения тренером
+events_pager = KeysetPaginator(
+    'e', 'events', 'event_id', 'starts_at, type', keys=['starts_at', 'event_id'],
+    where="status = 'open' AND starts_at IS NOT NULL", tenant='chat_id',
+    render=lambda event: InlineKeyboardButton(
+        text=f"{event[2]} {format_event_date(event[1])}",
+        callback_data=SelectEvent(event_id=event[0]).pack()
+    )
+)
+members_pager = KeysetPaginator(
+    'u', 'members', 'user_id', 'name', keys=['name', 'user_id'], search='name', tenant='chat_id',
+    render=lambda user: InlineKeyboardButton(
+        text=user[1],
+        callback_data=SelectCoach(user_id=user[0]).pack()
+    ),
+    extra_rows=[[InlineKeyboardButton(text="🔙 Назад", callback_data=BackToCoachMenu().pack())]]
+)
 
 # Показываем события для отметки
-async def show_events_to_mark(message: types.Message):
-    conn = sqlite3.connect('hockey.db')
-    c = conn.cursor()
-    c.execute("SELECT event_id, date, type FROM events WHERE status = 'open' ORDER BY date DESC")
-    events = c.fetchall()
-    conn.close()
+async def show_events_to_mark(message: types.Message, chat_id):
+    # Первая страница открытых событий (из кэша, пока события чата не менялись)
+    reply_markup = await render_cache.get('events_to_mark', chat_id, None,
+                                          lambda: events_pager.keyboard(db, tenant=chat_id))
     
-    if not events:
+    if reply_markup is None:
         await message.answer("📭 Нет активных событий для отметки")
         return
     
-    # Создаем inline-клавиатуру с событиями
-    keyboard = []
-    for event in events:
-        keyboard.append([InlineKeyboardButton(
-            text=f"{event[2]} {event[1]}", 
-            callback_data=f"select_event_{event[0]}"
-        )])
-    
-    reply_markup = InlineKeyboardMarkup(inline_keyboard=keyboard)
     await message.answer("Выберите событие для отметки:", reply_markup=reply_markup)
 
 # Показываем тренерское меню
 async def show_coach_menu(message: types.Message):
     keyboard = [
-        [InlineKeyboardButton(text="➕ Создать событие", callback_data="create_event")],
-        [InlineKeyboardButton(text="👥 Сформировать пятёрки", callback_data="form_teams")],
-        [InlineKeyboardButton(text="👑 Назначить тренера", callback_data="set_coach")]
+        [InlineKeyboardButton(text="➕ Создать событие", callback_data=CreateEvent().pack())],
+        [InlineKeyboardButton(text="👥 Сформировать пятёрки", callback_data=FormTeams().pack())],
+        [InlineKeyboardButton(text="👑 Назначить тренера", callback_data=SetCoach().pack())]
     ]
     reply_markup = InlineKeyboardMarkup(inline_keyboard=keyboard)
     await message.answer("👑 <b>Тренерское меню:</b>", reply_markup=reply_markup, parse_mode="HTML")
@@ -262,23 +293,26 @@ async def show_help(message: types.Message):
         "• Нажмите 'Просмотреть события' чтобы увидеть список\n"
         "• Нажмите 'Отметиться на событии' чтобы выбрать событие и отметить участие\n\n"
         "👑 <b>Для тренера</b>\n"
-        "• В тренерском меню можно создать событие, сформировать пятёрки или назначить тренера\n\n"
+        "• В тренерском меню можно создать событие, сформировать пятёрки или назначить тренера\n"
+        "• /form_teams [число команд] — разделить всех отметившихся на сбалансированные пятёрки\n"
+        "• /rate Имя рейтинг [Н|З|В] — рейтинг (1–10) и амплуа игрока\n"
+        "• /import — игроки или расписание из файла (CSV, .ics), /export — посещаемость в CSV\n\n"
+        "📊 /stats [Имя] — посещаемость, серии и партнёры по пятёрке\n\n"
         "Бот автоматически определяет ваши права на основе назначения тренера"
     )
     await message.answer(text, parse_mode="HTML")
 
 # Отметка участия в событии
-async def select_event(callback: types.CallbackQuery):
-    _, event_id = callback.data.split("_")
-    event_id = int(event_id)
+async def select_event(callback: types.CallbackQuery, data: SelectEvent):
+    event_id = data.event_id
     
     # Создаем клавиатуру с кнопками отметки
     keyboard = InlineKeyboardMarkup(inline_keyboard=[
         [
-            InlineKeyboardButton(text="✅ Буду", callback_data=f"mark_{event_id}_1"),
-            InlineKeyboardButton(text="❌ Не буду", callback_data=f"mark_{event_id}_0")
+            InlineKeyboardButton(text="✅ Буду", callback_data=Mark(event_id=event_id, going=True).pack()),
+            InlineKeyboardButton(text="❌ Не буду", callback_data=Mark(event_id=event_id, going=False).pack())
         ],
-        [InlineKeyboardButton(text="🔙 Назад", callback_data="back_to_events")]
+        [InlineKeyboardButton(text="🔙 Назад", callback_data=BackToEvents().pack())]
     ])
     
     await callback.message.edit_text(
@@ -287,265 +321,756 @@ async def select_event(callback: types.CallbackQuery):
     )
 
 # Отметка участия
-async def mark_callback(callback: types.CallbackQuery):
-    _, event_id, status = callback.data.split("_")
-    event_id, status = int(event_id), int(status)
-    user_id = callback.from_user.id
-    
-    conn = sqlite3.connect('hockey.db')
-    c = conn.cursor()
-    
-    # Удаляем старую отметку
-    c.execute("DELETE FROM participants WHERE event_id = ? AND user_id = ?", 
-             (event_id, user_id))
-    
-    # Добавляем новую при подтверждении
-    if status == 1:
-        c.execute("INSERT INTO participants (event_id, user_id) VALUES (?, ?)", 
-                 (event_id, user_id))
-    
-    # Получаем список участников
-    c.execute('''SELECT u.name FROM participants p
-                 JOIN users u ON p.user_id = u.user_id
-                 WHERE p.event_id = ?''', (event_id,))
-    players = [row[0] for row in c.fetchall()]
-    
-    # Обновляем сообщение
-    status_text = "✅ <b>Будут:</b>\n" + "\n".join(players) if players else "Пока никто не отметил участие"
-    
-    try:
-        await callback.message.edit_text(
-            f"Подтвердите ваше участие:\n\n{status_text}",
-            reply_markup=callback.message.reply_markup,
-            parse_mode="HTML"
+async def mark_callback(callback: types.CallbackQuery, data: Mark):
+    event_id = data.event_id
+    chat = callback.message.chat
+    # event_id приходит от клиента: в группе отметиться можно только на её
+    # событие, в личном чате — на событие любой группы, где состоит игрок
+    # (напоминание приходит и о событиях не последней группы)
+    private = chat.type == 'private'
+    # Отметка сразу попадает в состав в памяти, в базу — пачкой с другими
+    # (см. attendance.AttendanceJournal). Первое нажатие в группе запоминает
+    # её (из личного чата игрок увидит её события)
+    chat_id = await attendance.mark(event_id, callback.from_user, data.going, chat,
+                                    tenant=None if private else chat.id, member=private)
+    if chat_id is None:
+        return callback.answer("⚠️ Событие не найдено или уже закрыто")
+    
+    # Обновляем сообщение: правки от одновременных нажатий объединяются,
+    # в сообщение попадает состав на момент отправки
+    message = callback.message
+    roster_updater.mark_dirty(
+        callback.bot, message.chat.id, message.message_id,
+        lambda: render_roster(event_id, message.reply_markup)
+    )
+    # Отметка из напоминания или списка событий — состав в сообщении события
+    # в группе тоже обновляем
+    group_msg_id = await attendance.group_message(event_id)
+    if group_msg_id is not None and (message.chat.id, message.message_id) != (chat_id, group_msg_id):
+        roster_updater.mark_dirty(
+            callback.bot, chat_id, group_msg_id,
+            lambda: render_roster(event_id, mark_keyboard(event_id))
         )
-    except:
-        pass  # Если текст не изменился
-    
-    await callback.answer()
-    conn.commit()
-    conn.close()
+    # Ответ на callback возвращаем: в режиме webhook он уйдёт прямо в ответе на запрос
+    return callback.answer()
 
-# Обработка нажатий на inline-кнопки
-async def handle_callback(callback: types.CallbackQuery):
-    data = callback.data
-    
-    if data.startswith("select_event_"):
-        await select_event(callback)
-    
-    elif data.startswith("mark_"):
-        await mark_callback(callback)
-    
-    elif data == "create_event":
-        await create_event_start(callback)
-    
-    elif data == "back_to_coach_menu":
-        await show_coach_menu(callback.message)
-    
-    elif data == "back_to_events":
-        await show_events_to_mark(callback.message)
-    
-    elif data == "set_coach":
-        await set_coach_start(callback)
-    
-    elif data.startswith("select_coach_"):
-        await select_coach(callback)
+# Текст сообщения события с актуальным списком участников (из состава в памяти)
+async def render_roster(event_id, reply_markup):
+    # Имена — full_name из Telegram, экранируем для HTML
+    players = [html.escape(name) for name in await attendance.names(event_id) or []]
+    status_text = "✅ <b>Будут:</b>\n" + "\n".join(players) if players else "Пока никто не отметил участие"
+    return f"Подтвердите ваше участие:\n\n{status_text}", reply_markup
+
+# Возврат в тренерское меню
+async def back_to_coach_menu(callback: types.CallbackQuery, data: BackToCoachMenu):
+    await show_coach_menu(callback.message)
+
+# Возврат к списку событий
+async def back_to_events(callback: types.CallbackQuery, data: BackToEvents):
+    chat_id = await tenant_of(callback.message.chat, callback.from_user)
+    await show_events_to_mark(callback.message, chat_id)
+
+# Кнопка «Сформировать пятёрки» в тренерском меню
+async def form_teams_callback(callback: types.CallbackQuery, data: FormTeams):
+    await form_teams_start(callback.message, callback.from_user)
 
 # Начало процесса назначения тренера
-async def set_coach_start(callback: types.CallbackQuery):
-    # Получаем список всех пользователей
-    conn = sqlite3.connect('hockey.db')
-    c = conn.cursor()
-    c.execute("SELECT user_id, name FROM users")
-    users = c.fetchall()
-    conn.close()
-    
-    # Создаем клавиатуру с пользователями
-    keyboard = []
-    for user in users:
-        keyboard.append([InlineKeyboardButton(
-            text=user[1], 
-            callback_data=f"select_coach_{user[0]}"
-        )])
-    
-    keyboard.append([InlineKeyboardButton(
-        text="🔙 Назад", 
-        callback_data="back_to_coach_menu"
-    )])
+async def set_coach_start(callback: types.CallbackQuery, data: SetCoach):
+    # Первая страница игроков чата; остальные подгружаются кнопками «◀️ / ▶️»
+    chat_id = await tenant_of(callback.message.chat, callback.from_user)
+    reply_markup = await members_pager.keyboard(db, tenant=chat_id)
+    
+    if reply_markup is None:
+        return callback.answer("📭 Нет зарегистрированных игроков")
     
-    reply_markup = InlineKeyboardMarkup(inline_keyboard=keyboard)
     await callback.message.edit_text(
         "Выберите пользователя для назначения тренером:",
         reply_markup=reply_markup
     )
 
+# Поиск игрока по началу имени: /set_coach Ив
+async def set_coach_search(message: types.Message):
+    chat_id = await tenant_of(message.chat, message.from_user)
+    if not is_coach(chat_id, message.from_user.id):
+        await message.answer("❌ Только тренер может назначать тренера")
+        return
+    
+    parts = message.text.split(maxsplit=1)
+    query = parts[1] if len(parts) > 1 else ''
+    # Имена хранятся с заглавной буквы
+    query = query[:1].upper() + query[1:]
+    reply_markup = await members_pager.keyboard(db, query=query, tenant=chat_id)
+    
+    if reply_markup is None:
+        await message.answer(f"🔍 Никого не найдено по запросу «{query}»")
+        return
+    
+    await message.answer("Выберите пользователя для назначения тренером:", reply_markup=reply_markup)
+
+# Переключение страниц постраничных списков
+async def page_callback(callback: types.CallbackQuery, data: PageNav):
+    chat_id = await tenant_of(callback.message.chat, callback.from_user)
+    return await KeysetPaginator.navigate(db, callback, data, tenant=chat_id)
+
 # Выбор пользователя для назначения тренера
-async def select_coach(callback: types.CallbackQuery):
-    _, user_id = callback.data.split("_")
-    user_id = int(user_id)
+async def select_coach(callback: types.CallbackQuery, data: SelectCoach):
+    user_id = data.user_id
+    chat_id = await tenant_of(callback.message.chat, callback.from_user)
     
     # Проверяем, является ли отправитель админом группы
-    chat_admins = await callback.bot.get_chat_administrators(callback.message.chat.id)
-    if not any(admin.user.id == callback.from_user.id for admin in chat_admins):
+    if not await admin_cache.is_admin(callback.bot, chat_id, callback.from_user.id):
         await callback.message.edit_text(
             "❌ Только администраторы могут назначать тренера",
             reply_markup=InlineKeyboardMarkup(inline_keyboard=[
-                [InlineKeyboardButton(text="🔙 Назад", callback_data="set_coach")]
+                [InlineKeyboardButton(text="🔙 Назад", callback_data=SetCoach().pack())]
             ])
         )
-        await callback.answer()
-        return
+        return callback.answer()
     
     # Назначаем тренера
-    conn = sqlite3.connect('hockey.db')
-    c = conn.cursor()
-    c.execute("UPDATE users SET is_coach = 1 WHERE user_id = ?", (user_id,))
-    conn.commit()
+    def assign_coach(conn):
+        conn.execute("UPDATE members SET is_coach = 1 WHERE chat_id = ? AND user_id = ?", (chat_id, user_id))
+        
+        # Получаем имя пользователя
+        row = conn.execute("SELECT name FROM members WHERE chat_id = ? AND user_id = ?",
+                           (chat_id, user_id)).fetchone()
+        return row[0] if row else None
     
-    # Получаем имя пользователя
-    c.execute("SELECT name FROM users WHERE user_id = ?", (user_id,))
-    user_name = c.fetchone()[0]
-    conn.close()
+    user_name = await db.transaction(assign_coach)
+    if user_name is None:
+        return callback.answer("⚠️ Игрок не найден в этом чате")
+    roles.set_coach(chat_id, user_id)
     
     await callback.message.edit_text(
-        f"👑 <b>{user_name}</b> назначен тренером!",
+        f"👑 <b>{html.escape(user_name)}</b> назначен тренером!",
         reply_markup=InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="🔙 Назад", callback_data="back_to_coach_menu")]
+            [InlineKeyboardButton(text="🔙 Назад", callback_data=BackToCoachMenu().pack())]
         ]),
         parse_mode="HTML"
     )
-    await callback.answer()
-
-# Обработка нажатий на кнопки главного меню
-async def handle_main_menu(message: types.Message):
-    text = message.text
-    
-    if text == "📅 Просмотреть события":
-        await show_events(message)
-    
-    elif text == "✅ Отметиться на событии":
-        await show_events_to_mark(message)
-    
-    elif text == "👑 Тренерское меню":
-        if is_coach(message.from_user.id):
-            await show_coach_menu(message)
-        else:
-            await message.answer("❌ У вас нет прав тренера")
-    
-    elif text == "ℹ️ Помощь":
-        await show_help(message)
+    return callback.answer()
 
 # Создание события (тренер)
 async def create_event(message: types.Message):
-    if not is_coach(message.from_user.id):
+    chat_id = await tenant_of(message.chat, message.from_user)
+    if not is_coach(chat_id, message.from_user.id):
         await message.answer("❌ Только тренер может создавать события")
         return
     
+    # Год не указывают: берётся ближайший подходящий (см. event_time.infer_year)
     try:
-        _, date, event_type = message.text.split(maxsplit=2)
-    except:
+        _, args = message.text.split(maxsplit=1)
+        starts_at, event_type, all_day = parse_event_args(args)
+    except ValueError:
         await message.answer(
-            "📌 Используйте формат:\n/create_event ДД.ММ Тип\n"
-            "Пример: /create_event 25.10 Тренировка"
+            "📌 Используйте формат:\n/create_event ДД.ММ [ЧЧ:ММ] Тип\n"
+            "Пример: /create_event 25.10 Тренировка\n"
+            "Или: /create_event 25.10 19:30 Игра"
         )
         return
     
-    conn = sqlite3.connect('hockey.db')
-    c = conn.cursor()
+    await publish_event(message, chat_id, to_timestamp(starts_at), event_type, all_day)
+
+# Создаем событие и сообщение с кнопками отметки в чате message; all_day —
+# время не указано (событие на весь день, см. scheduler.closes_at)
+async def publish_event(message: types.Message, chat_id, timestamp, event_type, all_day=False):
+    date = format_event_date(timestamp)
     
-    # Создаем событие
-    c.execute("INSERT INTO events (date, type) VALUES (?, ?)", (date, event_type))
-    event_id = c.lastrowid
+    # Событие и его таймеры (закрытие, напоминание) — одной транзакцией
+    def insert_event(conn):
+        event_id = conn.execute("INSERT INTO events (chat_id, date, type, starts_at, all_day) VALUES (?, ?, ?, ?, ?)",
+                                (chat_id, date, event_type, timestamp, int(all_day))).lastrowid
+        return event_id, scheduler.schedule(conn, event_id, chat_id, timestamp, all_day)
     
-    # Создаем сообщение в чате
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="✅ Буду", callback_data=f"mark_{event_id}_1"),
-         InlineKeyboardButton(text="❌ Не буду", callback_data=f"mark_{event_id}_0")]
-    ])
+    event_id, timers = await db.transaction(insert_event)
+    scheduler.add(timers)
+    render_cache.bump(chat_id)
     
+    # Создаем сообщение в чате
     msg = await message.answer(
-        f"🏒 <b>{event_type} {date}</b>\n"
+        f"🏒 <b>{html.escape(event_type)} {date}</b>\n"
         "Кто будет? Нажмите кнопку ниже:",
-        reply_markup=keyboard,
+        reply_markup=mark_keyboard(event_id),
         parse_mode="HTML"
     )
     
-    # Сохраняем ID сообщения
-    c.execute("UPDATE events SET group_msg_id = ? WHERE event_id = ?", 
-             (msg.message_id, event_id))
-    conn.commit()
-    conn.close()
+    # Сохраняем ID сообщения, если оно в чате события (из личного диалога
+    # создания события сообщение уходит в личный чат тренера)
+    if message.chat.id == chat_id:
+        await db.execute("UPDATE events SET group_msg_id = ? WHERE event_id = ?",
+                         (msg.message_id, event_id))
+
+# Кнопки отметки под сообщением события
+def mark_keyboard(event_id):
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="✅ Буду", callback_data=Mark(event_id=event_id, going=True).pack()),
+         InlineKeyboardButton(text="❌ Не буду", callback_data=Mark(event_id=event_id, going=False).pack())]
+    ])
 
 # Формирование пятёрок (тренер)
-async def form_teams_start(message: types.Message):
-    if not is_coach(message.from_user.id):
+async def form_teams_start(message: types.Message, sender: types.User = None):
+    # Из тренерского меню сообщение принадлежит боту, поэтому тренера передают явно
+    sender = sender or message.from_user
+    chat_id = await tenant_of(message.chat, sender)
+    if not is_coach(chat_id, sender.id):
         await message.answer("❌ Только тренер может формировать команды")
         return
     
-    conn = sqlite3.connect('hockey.db')
-    c = conn.cursor()
-    c.execute("SELECT event_id, date, type FROM events WHERE status = 'open' ORDER BY event_id DESC LIMIT 1")
-    event = c.fetchone()
+    event = await current_event(db, chat_id)
     
     if not event:
         await message.answer("❗ Нет активных событий для формирования команд")
         return
     
-    # Получаем список участников
-    c.execute('''SELECT u.user_id, u.name FROM participants p
-                 JOIN users u ON p.user_id = u.user_id
-                 WHERE p.event_id = ?''', (event[0],))
-    players = c.fetchall()
-    
-    if len(players) < 5:
-        await message.answer(f"❗ Недостаточно игроков! Есть {len(players)}, нужно минимум 5")
+    # Число команд можно указать: /form_teams 3
+    teams = None
+    args = (message.text or '').split()
+    if args and args[0].startswith('/form_teams') and len(args) > 1:
+        if not args[1].isdigit() or not 1 <= int(args[1]) <= MAX_TEAMS:
+            await message.answer(f"📌 Используйте формат: /form_teams [число команд от 1 до {MAX_TEAMS}]")
+            return
+        teams = int(args[1])
+    
+    # Получаем список участников; ещё не записанные отметки сначала пишем в базу
+    await attendance.flush()
+    rows = await db.fetchall('''SELECT m.user_id, m.name, m.rating, m.position FROM participants p
+                                JOIN members m ON m.chat_id = ? AND m.user_id = p.user_id
+                                WHERE p.event_id = ?''', (chat_id, event[0]))
+    players = [Player(*row) for row in rows]
+    skaters = sum(p.position != GOALIE for p in players)
+    
+    if skaters < TEAM_SIZE:
+        await message.answer(f"❗ Недостаточно игроков! Есть {skaters}, нужно минимум {TEAM_SIZE}")
         return
     
-    # Распределяем игроков на одну пятёрку (упрощенная версия)
-    import random
-    random.shuffle(players)
-    team = [p[1] for p in players[:5]]
+    # Оптимизация занимает до ~100 мс процессора — считаем вне цикла событий
+    lineup = await asyncio.to_thread(form_lines, players, teams)
     
-    # Сохраняем в БД
-    c.execute("INSERT INTO teams (event_id, color, players) VALUES (?, ?, ?)",
-             (event[0], "Красная", ",".join(team)))
-    conn.commit()
-    conn.close()
+    # Сохраняем в БД: новый состав заменяет прежний, счётчики партнёров обновляются
+    def save_teams(conn):
+        save_lineup(conn, event[0], chat_id, TEAM_COLORS, [
+            [p.user_id for p in goalies + line] for line, goalies in zip(lineup.teams, lineup.goalies)
+        ])
+    
+    await db.transaction(save_teams)
     
     # Отправляем результат
-    result = "🏒 <b>Сформирована пятёрка:</b>\n\n"
-    result += "• <b>Красная:</b>\n" + "\n".join(f"  {i+1}. {p}" for i, p in enumerate(team))
+    result = f"🏒 <b>Составы: {html.escape(event[2])} {format_event_date(event[1])}</b>\n"
+    for color, line, goalies in zip(TEAM_COLORS, lineup.teams, lineup.goalies):
+        average = sum(p.rating for p in line) / len(line)
+        result += f"\n• <b>{color}</b> (средний рейтинг {average:.1f}):\n"
+        result += "".join(f"  🥅 {html.escape(p.name)}\n" for p in goalies)
+        result += "".join(f"  {i+1}. {html.escape(p.name)} ({POSITIONS[p.position]})\n" for i, p in enumerate(line))
     
     await message.answer(result, parse_mode="HTML")
 
-# Создание события через UI
-async def create_event_start(callback: types.CallbackQuery):
+# Игроки чата по имени: сначала точное совпадение, затем по началу имени
+async def find_members(chat_id, name):
+    users = await db.fetchall("SELECT user_id, name FROM members WHERE chat_id = ? AND name = ?",
+                              (chat_id, name))
+    if not users:
+        users = await db.fetchall("SELECT user_id, name FROM members "
+                                  "WHERE chat_id = ? AND name >= ? AND name < ? LIMIT 10",
+                                  (chat_id, name, prefix_upper_bound(name)))
+    return users
+
+# Статистика игрока: /stats — своя, /stats Имя — игрока команды
+async def show_stats(message: types.Message):
+    chat_id = await tenant_of(message.chat, message.from_user)
+    parts = (message.text or '').split(maxsplit=1)
+    if len(parts) > 1:
+        users = await find_members(chat_id, parts[1].strip())
+        if not users:
+            await message.answer(f"🔍 Никого не найдено по запросу «{parts[1].strip()}»")
+            return
+        if len(users) > 1:
+            await message.answer("❓ Уточните имя, подходят:\n" + "\n".join(u[1] for u in users))
+            return
+        user_id, name = users[0]
+    else:
+        user_id, name = message.from_user.id, message.from_user.full_name
+    
+    # Проведённые события учитываются таймером закрытия (scheduler), здесь — только чтение
+    stats = await db.read(lambda conn: player_stats(conn, chat_id, user_id))
+    if stats is None:
+        await message.answer(f"📭 {html.escape(name)} пока не был ни на одном прошедшем событии")
+        return
+    
+    rate = stats['attended'] / stats['held'] if stats['held'] else 0
+    text = (f"📊 <b>{html.escape(name)}</b>\n"
+            f"• Посещаемость: {stats['attended']} из {stats['held']} ({rate:.0%})\n"
+            f"• Серия: {stats['streak']} подряд, лучшая — {stats['best_streak']}\n")
+    if stats['linemates']:
+        text += "• Чаще всего в одной пятёрке:\n"
+        text += "".join(f"  {html.escape(mate)} — {games}\n" for mate, games in stats['linemates'])
+    await message.answer(text, parse_mode="HTML")
+
+# Рейтинг и амплуа игрока (тренер): /rate Имя 7.5 З
+async def rate_player(message: types.Message):
+    chat_id = await tenant_of(message.chat, message.from_user)
+    if not is_coach(chat_id, message.from_user.id):
+        await message.answer("❌ Только тренер может менять рейтинг")
+        return
+    
+    usage = ("📌 Используйте формат:\n/rate Имя рейтинг [Н|З|В]\n"
+             "Пример: /rate Иван Петров 7.5 З\n"
+             "Рейтинг от 1 до 10; Н — нападающий, З — защитник, В — вратарь")
+    args = (message.text or '').split()[1:]
+    codes = {label: code for code, label in POSITIONS.items()}
+    position = codes.get(args[-1].upper()) if args else None
+    if position:
+        args = args[:-1]
+    try:
+        rating = float(args[-1].replace(',', '.'))
+        name = " ".join(args[:-1])
+    except (IndexError, ValueError):
+        await message.answer(usage)
+        return
+    if not name or not 1 <= rating <= 10:
+        await message.answer(usage)
+        return
+    
+    users = await find_members(chat_id, name)
+    if not users:
+        await message.answer(f"🔍 Никого не найдено по запросу «{name}»")
+        return
+    if len(users) > 1:
+        await message.answer("❓ Уточните имя, подходят:\n" + "\n".join(u[1] for u in users))
+        return
+    
+    user_id, name = users[0]
+    if position:
+        await db.execute("UPDATE members SET rating = ?, position = ? WHERE chat_id = ? AND user_id = ?",
+                         (rating, position, chat_id, user_id))
+    else:
+        await db.execute("UPDATE members SET rating = ? WHERE chat_id = ? AND user_id = ?",
+                         (rating, chat_id, user_id))
+    await message.answer(f"✅ {name}: рейтинг {rating:g}" + (f", {POSITIONS[position]}" if position else ""))
+
+IMPORT_USAGE = (
+    "📥 Пришлите файл с подписью /import или ответьте /import на сообщение с файлом.\n\n"
+    "• <b>Игроки</b> — CSV с колонками имя, user_id, рейтинг, амплуа (Н/З/В). "
+    "Строки без user_id обновляют рейтинг и амплуа игроков команды с тем же именем\n"
+    "• <b>Расписание</b> — CSV с колонками дата (ДД.ММ.ГГГГ или ГГГГ-ММ-ДД), время, тип "
+    "или файл календаря .ics"
+)
+
+# Текст итога импорта; bad_lines — номера неразобранных строк
+def import_summary(report):
+    if report['kind'] == EVENTS:
+        text = f"✅ Импорт расписания: добавлено событий {report['added']}"
+        if report['past']:
+            text += f" (прошедших {report['past']} — сразу в архиве)"
+        if report['duplicates']:
+            text += f", уже были {report['duplicates']}"
+    else:
+        text = f"✅ Импорт игроков: добавлено {report['added']}, обновлено {report['updated']}"
+        if report['not_found']:
+            text += f", не найдено по имени {report['not_found']}"
+    bad = report['bad_lines']
+    if bad:
+        text += f"\n⚠️ Не разобраны строки ({len(bad)}): " + ", ".join(map(str, bad[:10]))
+        text += "…" if len(bad) > 10 else ""
+    return text
+
+# Импорт игроков или расписания из документа (тренер). Ход импорта — в одном
+# сообщении, которое правится не чаще ROSTER_EDIT_INTERVAL (см. live_roster)
+async def import_command(message: types.Message):
+    chat_id = await tenant_of(message.chat, message.from_user)
+    if not is_coach(chat_id, message.from_user.id):
+        await message.answer("❌ Только тренер может импортировать данные")
+        return
+    
+    reply = message.reply_to_message
+    document = message.document or (reply.document if reply else None)
+    if document is None:
+        await message.answer(IMPORT_USAGE, parse_mode="HTML")
+        return
+    if (document.file_size or 0) > IMPORT_MAX_BYTES:
+        await message.answer(f"❗ Файл больше {IMPORT_MAX_BYTES // (1024 * 1024)} МБ")
+        return
+    
+    status = await message.answer("⏳ Импорт: загружаю файл…")
+    
+    def show(text):
+        async def render():
+            return text, None
+        roster_updater.mark_dirty(message.bot, status.chat.id, status.message_id, render)
+    
+    def progress(report):
+        what = "расписания" if report['kind'] == EVENTS else "игроков"
+        show(f"⏳ Импорт {what}: обработано строк {report['rows']}…")
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'import')
+        try:
+            await message.bot.download(document, destination=path)
+            report = await import_file(db, chat_id, path, progress)
+        except ValueError as e:
+            show(f"❌ {html.escape(str(e))}")
+            return
+        except Exception as e:
+            print(f"ERROR importing {document.file_name!r} into chat {chat_id}: {e!r}")
+            show("❌ Не удалось импортировать файл")
+            return
+    show(import_summary(report))
+
+# Выгрузка посещаемости чата в CSV (тренер)
+async def export_command(message: types.Message):
+    chat_id = await tenant_of(message.chat, message.from_user)
+    if not is_coach(chat_id, message.from_user.id):
+        await message.answer("❌ Только тренер может выгружать посещаемость")
+        return
+    
+    # Отметки из журнала сначала пишем в базу
+    await attendance.flush()
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'attendance.csv')
+        rows = await db.read(lambda conn: export_attendance(conn, chat_id, path))
+        if not rows:
+            await message.answer("📭 Пока нет отметок для выгрузки")
+            return
+        await message.answer_document(FSInputFile(path, filename="attendance.csv"),
+                                      caption=f"📊 Посещаемость: ответов {rows}")
+
+# Создание события через UI: дата → тип → подтверждение.
+# Шаги хранятся в fsm_storage и переживают перезапуск бота
+class EventForm(StatesGroup):
+    date = State()
+    type = State()
+    confirm = State()
+
+EVENT_TYPES = ("Тренировка", "Игра")
+
+def cancel_row():
+    return [InlineKeyboardButton(text="❌ Отмена", callback_data=CancelEvent().pack())]
+
+async def create_event_start(callback: types.CallbackQuery, data: CreateEvent, state: FSMContext):
+    chat_id = await tenant_of(callback.message.chat, callback.from_user)
+    if not is_coach(chat_id, callback.from_user.id):
+        return callback.answer("❌ Только тренер может создавать события")
+    
+    await state.set_state(EventForm.date)
+    await state.set_data({'chat_id': chat_id})
     await callback.message.edit_text(
-        "📅 Введите дату события (в формате ДД.ММ):",
+        "📅 Введите дату события: ДД.ММ или ДД.ММ ЧЧ:ММ",
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=[cancel_row()])
+    )
+
+async def event_form_date(message: types.Message, state: FSMContext):
+    date_text, _, time_text = (message.text or '').strip().partition(' ')
+    try:
+        starts_at = parse_event_date(date_text, time_text or None)
+    except ValueError:
+        await message.answer("📌 Не понял дату. Пример: 25.10 или 25.10 19:30")
+        return
+    
+    timestamp = to_timestamp(starts_at)
+    await state.update_data(starts_at=timestamp, all_day=not time_text)
+    await state.set_state(EventForm.type)
+    await message.answer(
+        f"🏷 Событие {format_event_date(timestamp)}. Выберите тип или напишите свой:",
         reply_markup=InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="🔙 Назад", callback_data="back_to_coach_menu")]
+            [InlineKeyboardButton(text=name, callback_data=EventType(index=i).pack())
+             for i, name in enumerate(EVENT_TYPES)],
+            cancel_row()
         ])
     )
 
-# Основная функция
-async def main():
-    init_db()
-    
-    bot = Bot(token=TOKEN)
-    dp = Dispatcher()
-    
-    # Регистрация обработчиков
+async def event_form_type(message: types.Message, state: FSMContext):
+    event_type = (message.text or '').strip()
+    if not event_type or len(event_type) > EVENT_TYPE_MAX_LENGTH:
+        await message.answer(f"📌 Напишите тип события (до {EVENT_TYPE_MAX_LENGTH} символов)")
+        return
+    await ask_event_confirm(message, state, event_type)
+
+async def event_form_type_callback(callback: types.CallbackQuery, data: EventType, state: FSMContext):
+    if await state.get_state() != EventForm.type.state or not 0 <= data.index < len(EVENT_TYPES):
+        return callback.answer("⚠️ Кнопка устарела, откройте меню заново")
+    await ask_event_confirm(callback.message, state, EVENT_TYPES[data.index], edit=True)
+
+async def ask_event_confirm(message: types.Message, state: FSMContext, event_type, edit=False):
+    form = await state.update_data(type=event_type)
+    await state.set_state(EventForm.confirm)
+    # Тип события может быть введён вручную — экранируем для HTML
+    text = f"Создать событие <b>{html.escape(event_type)} {format_event_date(form['starts_at'])}</b>?"
+    reply_markup = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="✅ Создать", callback_data=ConfirmEvent().pack())],
+        cancel_row()
+    ])
+    if edit:
+        await message.edit_text(text, reply_markup=reply_markup, parse_mode="HTML")
+    else:
+        await message.answer(text, reply_markup=reply_markup, parse_mode="HTML")
+
+async def event_form_confirm(callback: types.CallbackQuery, data: ConfirmEvent, state: FSMContext):
+    if await state.get_state() != EventForm.confirm.state:
+        return callback.answer("⚠️ Кнопка устарела, откройте меню заново")
+    form = await state.get_data()
+    # Права могли снять, пока шёл диалог
+    if not is_coach(form['chat_id'], callback.from_user.id):
+        await state.clear()
+        return callback.answer("❌ Только тренер может создавать события")
+    
+    await state.clear()
+    await callback.message.edit_text(
+        f"✅ Событие создано: {form['type']} {format_event_date(form['starts_at'])}"
+    )
+    await publish_event(callback.message, form['chat_id'], form['starts_at'], form['type'],
+                        form.get('all_day', False))
+
+async def event_form_cancel(callback: types.CallbackQuery, data: CancelEvent, state: FSMContext):
+    await state.clear()
+    await callback.message.edit_text("Создание события отменено")
+
+# Регистрация обработчиков
+def create_dispatcher(storage=None):
+    dp = Dispatcher(storage=storage)
     dp.message.register(start_command, Command("start"))
-    dp.message.register(handle_main_menu, lambda m: m.text in ["📅 Просмотреть события", "✅ Отметиться на событии", "👑 Тренерское меню", "ℹ️ Помощь"])
+    dp.message.register(handle_main_menu, lambda m: m.text in ["📅 Просмотреть события", "✅ Отметиться на событии", "👑 Тренерское меню", "👑 Назначить первого тренера", "ℹ️ Помощь"])
     dp.message.register(create_event, Command("create_event"))
     dp.message.register(form_teams_start, Command("form_teams"))
-    dp.callback_query.register(handle_callback)
+    dp.message.register(set_coach_search, Command("set_coach"))
+    dp.message.register(rate_player, Command("rate"))
+    dp.message.register(show_stats, Command("stats"))
+    # Файл с подписью /import или ответ /import на сообщение с файлом
+    dp.message.register(import_command, Command("import"))
+    dp.message.register(export_command, Command("export"))
+    # Ответы на шаги диалога создания события
+    dp.message.register(event_form_date, EventForm.date)
+    dp.message.register(event_form_type, EventForm.type)
+    
+    # Inline-кнопки: маршрутизация по префиксу callback_data
+    callbacks = CallbackRouter()
+    callbacks.register(SelectEvent, select_event)
+    callbacks.register(Mark, mark_callback)
+    callbacks.register(CreateEvent, create_event_start)
+    callbacks.register(EventType, event_form_type_callback)
+    callbacks.register(ConfirmEvent, event_form_confirm)
+    callbacks.register(CancelEvent, event_form_cancel)
+    callbacks.register(FormTeams, form_teams_callback)
+    callbacks.register(SetCoach, set_coach_start)
+    callbacks.register(SelectCoach, select_coach)
+    callbacks.register(BackToCoachMenu, back_to_coach_menu)
+    callbacks.register(BackToEvents, back_to_events)
+    callbacks.register(PageNav, page_callback)
+    dp.callback_query.register(callbacks.dispatch)
+    
+    # Время обработки по обработчикам и маршрутам callback_data
+    dp.message.middleware(HandlerMetricsMiddleware('message'))
+    dp.callback_query.middleware(HandlerMetricsMiddleware('callback_query', router=callbacks))
+    
+    # Смена администраторов сразу отражается в кэше
+    dp.chat_member.register(admin_cache.on_chat_member)
+    
     # обработчики проверки бд
     dp.message.register(check_db_exists, Command("checkdb"))
     dp.message.register(check_db_structure, Command("checkdb_str"))
+    return dp
+
+# Бот с очередью исходящих (если передана) и метриками запросов к API.
+# BOT_API_URL — адрес своего сервера Bot API вместо api.telegram.org
+def create_bot(outbox=None):
+    session = AiohttpSession(api=TelegramAPIServer.from_base(BOT_API_URL)) if BOT_API_URL else None
+    bot = Bot(token=TOKEN, session=session)
+    if outbox is not None:
+        # Все исходящие сообщения идут через общую очередь с ограничением частоты
+        bot.session.middleware(OutboxMiddleware(outbox))
+    # После очереди: меряем сами запросы к API, включая повторы после 429
+    bot.session.middleware(ApiMetricsMiddleware())
+    return bot
+
+# Метрики очередей и кэшей отдаются вместе с остальными
+def register_collectors(outbox):
+    registry.collector('outbox', outbox.metrics)
+    registry.collector('roster', lambda: roster_updater.stats)
+    registry.collector('admin_cache', admin_cache.metrics)
+    registry.collector('tenants', lambda: tenants.stats)
+    registry.collector('fsm', fsm_storage.metrics)
+    registry.collector('attendance', attendance.metrics)
+    registry.collector('render_cache', render_cache.metrics)
+    registry.collector('scheduler', scheduler.metrics)
+
+# Приём обновлений через webhook или polling
+async def receive_updates(bot, dp, **polling_options):
+    if WEBHOOK_URL:
+        await run_webhook(bot, dp)
+    else:
+        # Polling не работает, пока у бота установлен webhook
+        await bot.delete_webhook()
+        # Сессию закрывает вызывающий: после остановки polling обработчики ещё дорабатывают
+        await dp.start_polling(bot, close_bot_session=False, **polling_options)
+
+# Основная функция
+async def main():
+    await db.open()
+    db.observer = observe_sql
+    # Схема обновляется один раз при запуске
+    await migrate(db)
+    # Номер последнего обработанного обновления ведёт процесс, принимающий обновления
+    await update_offset.restore(db)
+    update_offset.on_done = startup.handled
+    if WORKERS:
+        # Рабочие процессы открывают базу сами
+        await run_ingress()
+        return
+    update_offset.start()
+    # Кэши из снимка, сохранённого при остановке; без снимка роли загружаются
+    # из базы (с проверкой схемы), остальное — по мере обращения
+    snapshot = CacheSnapshot(WARM_CACHES)
+    if 'roles' not in await snapshot.load(db):
+        await roles.load(db)
+    # Незавершённые диалоги продолжаются после перезапуска
+    await fsm_storage.restore(db)
+    fsm_storage.start()
+    await scheduler.restore(db)
+    
+    bot = create_bot(outbox)
+    outbox.start()
+    scheduler.start(bot)
+    backups.start()
+    dp = create_dispatcher(fsm_storage)
+    dp.update.outer_middleware(deduplicator)
+    dp.update.outer_middleware(update_offset)
+    dp.startup.register(startup.ready)
+    
+    register_collectors(outbox)
+    registry.collector('dedup', lambda: deduplicator.stats)
+    registry.collector('updates', update_offset.metrics)
+    registry.collector('startup', startup.metrics)
+    registry.collector('snapshot', snapshot.metrics)
+    registry.collector('backup', backups.metrics)
+    metrics_runner = await start_metrics_server()
+    loop_lag = asyncio.create_task(watch_loop_lag())
     
     # ЗАПУСК БОТА (КРИТИЧЕСКИ ВАЖНО!)
-    await dp.start_polling(bot)
+    try:
+        await receive_updates(bot, dp)
+    finally:
+        # Принятые обновления дообрабатываются: Telegram их уже не пришлёт
+        await update_offset.drain()
+        loop_lag.cancel()
+        await roster_updater.flush_all()
+        await scheduler.close()
+        await attendance.close()
+        await outbox.close()
+        await fsm_storage.close()
+        await update_offset.close()
+        await backups.close()
+        # Снимок — после записи всех отложенных изменений
+        await snapshot.save(db)
+        await bot.session.close()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        await db.close()
+
+# Входной процесс (WORKERS > 0): принимает обновления, отбрасывает повторы и
+# раздаёт их рабочим процессам по chat_id. Обработчики здесь не выполняются —
+# Dispatcher нужен для polling/webhook и списка типов обновлений
+async def run_ingress():
+    bot = create_bot()
+    dp = create_dispatcher()
+    ingress = Ingress(worker_main)
+    # Обновление обработано, когда о нём отчитался рабочий процесс
+    update_offset.deferred = True
+    ingress.on_done = update_offset.done
+    dp.update.outer_middleware(deduplicator)
+    dp.update.outer_middleware(update_offset)
+    dp.update.outer_middleware(ingress)
+    dp.startup.register(startup.ready)
+    await ingress.start()
+    update_offset.start()
+    registry.collector('ingress', ingress.metrics)
+    registry.collector('dedup', lambda: deduplicator.stats)
+    registry.collector('updates', update_offset.metrics)
+    registry.collector('startup', startup.metrics)
+    metrics_runner = await start_metrics_server()
+    try:
+        # Обновления передаются по одному: пока очередь рабочего процесса
+        # заполнена, следующий getUpdates не вызывается
+        await receive_updates(bot, dp, handle_as_tasks=False)
+    finally:
+        # Рабочие процессы дорабатывают свои очереди и отчитываются об обработанном
+        await ingress.close()
+        await update_offset.close()
+        await bot.session.close()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        await db.close()
+
+# Рабочий процесс: свой Dispatcher, соединения с базой и очередь исходящих.
+# Остановку (Ctrl+C) получает входной процесс и передаёт сюда через очередь
+def worker_main(index, inbox, results):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    asyncio.run(run_worker(index, inbox, results))
+
+async def run_worker(index, inbox, results):
+    await db.open()
+    db.observer = observe_sql
+    # Свой снимок кэшей у каждого процесса; годится только при том же числе процессов
+    snapshot = CacheSnapshot(WARM_CACHES, suffix=f".{index}", owner=(index, WORKERS))
+    if 'roles' not in await snapshot.load(db):
+        await roles.load(db)
+    # Диалоги и таймеры чатов, которые обслуживает этот процесс (см. workers.Ingress)
+    owns = lambda chat_id: chat_id % WORKERS == index
+    await fsm_storage.restore(db, owns=owns)
+    fsm_storage.start()
+    await scheduler.restore(db, owns=owns)
+    # Роли, группы пользователей и составы, изменённые здесь, обновляются в кэшах
+    # остальных процессов (отметку из личного чата обрабатывает не процесс группы)
+    publish = publisher(index, results)
+    roles.on_change = lambda *args: publish('coach', *args)
+    tenants.on_change = lambda *args: publish('tenant', *args)
+    attendance.on_change = lambda *args: publish('mark', *args)
+    attendance.on_forget = lambda *args: publish('forget', *args)
+    render_cache.on_change = lambda *args: publish('events', *args)
+    scheduler.on_change = lambda *args: publish('timer', *args)
+    
+    def apply_sync(kind, *args):
+        if kind == 'coach':
+            roles.set_coach(*args, notify=False)
+        elif kind == 'tenant':
+            tenants.remember(*args, notify=False)
+        elif kind == 'mark':
+            attendance.apply(*args)
+        elif kind == 'forget':
+            attendance.forget(*args, notify=False)
+        elif kind == 'events':
+            render_cache.bump(*args, notify=False)
+        elif kind == 'timer':
+            scheduler.add([args], notify=False)
+    
+    # Общий лимит Telegram делится между процессами; лимиты чата соблюдает
+    # процесс, которому этот чат принадлежит
+    worker_outbox = Outbox(global_rate=GLOBAL_RATE / WORKERS)
+    bot = create_bot(worker_outbox)
+    worker_outbox.start()
+    scheduler.start(bot)
+    # Резервные копии делает один процесс
+    if index == 0:
+        backups.start()
+    dp = create_dispatcher(fsm_storage)
+    register_collectors(worker_outbox)
+    registry.collector('snapshot', snapshot.metrics)
+    registry.collector('backup', backups.metrics)
+    metrics_runner = await start_metrics_server(port=METRICS_PORT + 1 + index if METRICS_PORT else 0)
+    loop_lag = asyncio.create_task(watch_loop_lag())
+    try:
+        await serve_worker(index, inbox, results, bot, dp, apply_sync)
+    finally:
+        loop_lag.cancel()
+        await roster_updater.flush_all()
+        await scheduler.close()
+        await attendance.close()
+        await worker_outbox.close()
+        await fsm_storage.close()
+        await backups.close()
+        await snapshot.save(db)
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        await bot.session.close()
+        await db.close()
 
 if __name__ == "__main__":
     asyncio.run(main())
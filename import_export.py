@@ -0,0 +1,295 @@
+import os
+import re
+import csv
+import time
+import codecs
+import asyncio
+from datetime import datetime, timezone
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+from event_time import EVENT_TYPE_MAX_LENGTH, EVENT_TZ, format_event_date, from_timestamp, parse_event_date, to_timestamp
+from lineup import POSITIONS
+from render_cache import render_cache
+from scheduler import closes_at, scheduler
+
+# Сколько строк файла записывать одной транзакцией
+IMPORT_CHUNK = int(os.getenv('IMPORT_CHUNK', '1000'))
+# Больше Bot API всё равно не даёт скачать
+IMPORT_MAX_BYTES = 20 * 1024 * 1024
+
+PLAYERS = 'players'
+EVENTS = 'events'
+
+# Заголовки колонок CSV (без учёта регистра) -> поле
+COLUMNS = {
+    'user_id': 'user_id', 'id': 'user_id', 'telegram_id': 'user_id',
+    'name': 'name', 'имя': 'name', 'игрок': 'name',
+    'rating': 'rating', 'рейтинг': 'rating',
+    'position': 'position', 'амплуа': 'position', 'позиция': 'position',
+    'date': 'date', 'дата': 'date',
+    'time': 'time', 'время': 'time',
+    'type': 'type', 'тип': 'type', 'событие': 'type',
+}
+# Амплуа — как в /rate (Н, З, В) или кодом (F, D, G)
+POSITION_CODES = {**{label: code for code, label in POSITIONS.items()}, **{code: code for code in POSITIONS}}
+ISO_DATE_RE = re.compile(r'(\d{4})-(\d{2})-(\d{2})$')
+
+
+# Импорт игроков (CSV) и расписания (CSV, iCalendar) из присланного файла и
+# выгрузка посещаемости в CSV.
+# Файл читается потоком: в памяти только текущая пачка строк. Разбор пачки
+# идёт в отдельном потоке, запись — одной транзакцией executemany на пачку,
+# поэтому между пачками успевают записываться нажатия других чатов.
+# Повторный импорт того же файла ничего не дублирует: игроки обновляются,
+# уже существующие события (тот же чат, время и тип) пропускаются.
+
+# Текстовый файл: UTF-8 (с BOM или без), иначе Windows-1251 — так сохраняет CSV Excel
+def open_text(path):
+    with open(path, 'rb') as file:
+        head = file.read(65536)
+    try:
+        # Незаконченный символ в конце куска — не ошибка
+        codecs.getincrementaldecoder('utf-8')().decode(head)
+        encoding = 'utf-8-sig'
+    except UnicodeDecodeError:
+        encoding = 'cp1251'
+    return open(path, encoding=encoding, newline='')
+
+
+# Что в файле и итератор его записей: (номер строки, запись или None, если
+# строку не разобрать). Бросает ValueError, если формат не распознан
+def read_records(file):
+    first = file.readline()
+    if first.strip().upper() == 'BEGIN:VCALENDAR':
+        return EVENTS, ical_events(file)
+    delimiter = max(',;\t', key=first.count)
+    header = next(csv.reader([first], delimiter=delimiter), [])
+    fields = [COLUMNS.get(name.strip().lower()) for name in header]
+    rows = csv.reader(file, delimiter=delimiter)
+    if 'date' in fields and 'type' in fields:
+        return EVENTS, csv_records(rows, fields, parse_event_row)
+    if 'name' in fields:
+        return PLAYERS, csv_records(rows, fields, parse_player_row)
+    raise ValueError("Не распознан формат: нужна строка заголовков с колонками "
+                     "«имя» (игроки) или «дата» и «тип» (расписание), либо файл iCalendar (.ics)")
+
+
+def csv_records(rows, fields, parse):
+    for line, row in enumerate(rows, start=2):
+        if not any(cell.strip() for cell in row):
+            continue
+        values = {field: cell.strip() for field, cell in zip(fields, row) if field}
+        try:
+            yield line, parse(values)
+        except (KeyError, ValueError):
+            yield line, None
+
+
+# Игрок: (user_id или None, имя, рейтинг или None, амплуа или None).
+# Без user_id строка обновляет рейтинг и амплуа игрока команды с таким именем
+def parse_player_row(values):
+    name = values['name']
+    if not name:
+        raise ValueError("Нет имени")
+    user_id = int(values['user_id']) if values.get('user_id') else None
+    if user_id is not None and user_id <= 0:
+        raise ValueError("Неверный user_id")
+    rating = float(values['rating'].replace(',', '.')) if values.get('rating') else None
+    if rating is not None and not 1 <= rating <= 10:
+        raise ValueError("Рейтинг вне 1–10")
+    position = POSITION_CODES[values['position'].upper()] if values.get('position') else None
+    return user_id, name, rating, position
+
+
+# Событие: (starts_at, тип, без времени). Дата — «ДД.ММ[.ГГГГ]» или «ГГГГ-ММ-ДД»
+def parse_event_row(values):
+    event_type = values['type']
+    if not event_type or len(event_type) > EVENT_TYPE_MAX_LENGTH:
+        raise ValueError("Неверный тип события")
+    date_text, _, time_text = values['date'].partition(' ')
+    time_text = values.get('time') or time_text or None
+    match = ISO_DATE_RE.match(date_text)
+    if match:
+        date_text = f"{match[3]}.{match[2]}.{match[1]}"
+    return to_timestamp(parse_event_date(date_text, time_text)), event_type, time_text is None
+
+
+# Строки iCalendar с учётом переносов (продолжение начинается с пробела или табуляции)
+def ical_lines(file):
+    line, number = None, 1
+    for current, text in enumerate(file, start=2):
+        text = text.rstrip('\r\n')
+        if text[:1] in (' ', '\t') and line is not None:
+            line += text[1:]
+            continue
+        if line is not None:
+            yield number, line
+        line, number = text, current
+    if line is not None:
+        yield number, line
+
+
+def ical_events(file):
+    event = None
+    for number, line in ical_lines(file):
+        name, _, value = line.partition(':')
+        name, *params = name.split(';')
+        name = name.upper()
+        if name == 'BEGIN' and value.upper() == 'VEVENT':
+            event = {'line': number}
+        elif name == 'END' and value.upper() == 'VEVENT' and event is not None:
+            try:
+                yield event['line'], parse_vevent(event)
+            except (KeyError, ValueError):
+                yield event['line'], None
+            event = None
+        elif event is not None and name in ('DTSTART', 'SUMMARY'):
+            event[name] = (params, value)
+
+
+def parse_vevent(event):
+    params, value = event['DTSTART']
+    value = value.strip()
+    summary = event['SUMMARY'][1]
+    for escaped, text in (('\\n', ' '), ('\\N', ' '), ('\\,', ','), ('\\;', ';'), ('\\\\', '\\')):
+        summary = summary.replace(escaped, text)
+    summary = summary.strip()[:EVENT_TYPE_MAX_LENGTH]
+    if not summary:
+        raise ValueError("Нет названия события")
+    return to_timestamp(parse_ical_time(params, value)), summary, len(value) == 8
+
+
+# DTSTART: дата (целый день), время UTC («…Z»), время в TZID или «плавающее» — в часовом поясе команды
+def parse_ical_time(params, value):
+    if len(value) == 8:
+        return datetime.strptime(value, '%Y%m%d').replace(tzinfo=EVENT_TZ)
+    if value.endswith('Z'):
+        return datetime.strptime(value, '%Y%m%dT%H%M%SZ').replace(tzinfo=timezone.utc)
+    tz = EVENT_TZ
+    for param in params:
+        key, _, zone = param.partition('=')
+        if key.upper() == 'TZID':
+            try:
+                tz = ZoneInfo(zone.strip('"'))
+            except (ZoneInfoNotFoundError, ValueError):
+                pass
+    return datetime.strptime(value, '%Y%m%dT%H%M%S').replace(tzinfo=tz)
+
+
+# Следующая пачка записей: (разобранные, номера неразобранных строк, файл кончился)
+def take(records, size):
+    chunk, bad = [], []
+    for line, record in records:
+        if record is None:
+            bad.append(line)
+        else:
+            chunk.append(record)
+        if len(chunk) + len(bad) >= size:
+            return chunk, bad, False
+    return chunk, bad, True
+
+
+# Игроки с user_id заводятся в команде (имя, рейтинг и амплуа из файла
+# заменяют прежние); без user_id — обновляются игроки команды с тем же именем.
+# Возвращает (добавлено, обновлено, не найдено по имени)
+def write_players(conn, chat_id, players):
+    known = [player for player in players if player[0] is not None]
+    conn.executemany('''INSERT INTO users (user_id, name, last_chat_id) VALUES (?, ?, ?)
+                        ON CONFLICT(user_id) DO UPDATE SET last_chat_id = COALESCE(last_chat_id, excluded.last_chat_id)''',
+                     [(user_id, name, chat_id) for user_id, name, _, _ in known])
+    added = conn.executemany("INSERT OR IGNORE INTO members (chat_id, user_id, name) VALUES (?, ?, ?)",
+                             [(chat_id, user_id, name) for user_id, name, _, _ in known]).rowcount
+    conn.executemany('''UPDATE members SET name = ?, rating = COALESCE(?, rating), position = COALESCE(?, position)
+                        WHERE chat_id = ? AND user_id = ?''',
+                     [(name, rating, position, chat_id, user_id) for user_id, name, rating, position in known])
+    by_name = [player for player in players if player[0] is None]
+    matched = conn.executemany('''UPDATE members SET rating = COALESCE(?, rating), position = COALESCE(?, position)
+                                  WHERE chat_id = ? AND name = ?''',
+                               [(rating, position, chat_id, name) for _, name, rating, position in by_name]).rowcount
+    return added, len(known) - added + matched, max(len(by_name) - matched, 0)
+
+
+# Новые события чата; уже прошедшие записываются закрытыми и в статистике не
+# учитываются (stats.roll_up), остальные получают таймеры. Возвращает
+# (добавлено, из них прошедших, таймеры для scheduler.add)
+def write_events(conn, chat_id, events, now):
+    last_id = conn.execute("SELECT COALESCE(MAX(event_id), 0) FROM events").fetchone()[0]
+    rows = []
+    for starts_at, event_type, all_day in events:
+        past = closes_at(starts_at, all_day, scheduler.close_after) <= now
+        rows.append((chat_id, format_event_date(starts_at), event_type, starts_at, int(all_day),
+                     'closed' if past else 'open', int(past), chat_id, starts_at, event_type))
+    added = conn.executemany('''INSERT INTO events (chat_id, date, type, starts_at, all_day, status, counted)
+                                SELECT ?, ?, ?, ?, ?, ?, ? WHERE NOT EXISTS
+                                    (SELECT 1 FROM events WHERE chat_id = ? AND starts_at = ? AND type = ?)''',
+                             rows).rowcount
+    timers, past = [], 0
+    for event_id, starts_at, all_day, status in conn.execute(
+            "SELECT event_id, starts_at, all_day, status FROM events WHERE event_id > ?", (last_id,)).fetchall():
+        if status == 'open':
+            timers.extend(scheduler.schedule(conn, event_id, chat_id, starts_at, all_day))
+        else:
+            past += 1
+    return added, past, timers
+
+
+# Импорт файла в чат chat_id. progress(report) вызывается после каждой пачки.
+# Возвращает отчёт: что импортировано, сколько строк добавлено / обновлено /
+# пропущено и номера неразобранных строк
+async def import_file(db, chat_id, path, progress=None, chunk_size=IMPORT_CHUNK):
+    file = await asyncio.to_thread(open_text, path)
+    try:
+        kind, records = await asyncio.to_thread(read_records, file)
+        report = {'kind': kind, 'rows': 0, 'added': 0, 'updated': 0, 'past': 0, 'duplicates': 0,
+                  'not_found': 0, 'bad_lines': []}
+        done = False
+        while not done:
+            chunk, bad, done = await asyncio.to_thread(take, records, chunk_size)
+            report['rows'] += len(chunk) + len(bad)
+            report['bad_lines'].extend(bad)
+            if kind == PLAYERS:
+                added, updated, not_found = await db.transaction(
+                    lambda conn: write_players(conn, chat_id, chunk))
+                report['added'] += added
+                report['updated'] += updated
+                report['not_found'] += not_found
+            else:
+                added, past, timers = await db.transaction(
+                    lambda conn: write_events(conn, chat_id, chunk, time.time()))
+                report['added'] += added
+                report['past'] += past
+                report['duplicates'] += len(chunk) - added
+                scheduler.add(timers)
+                if added:
+                    render_cache.bump(chat_id)
+            if progress is not None:
+                progress(report)
+        return report
+    finally:
+        file.close()
+
+
+# Выгрузка посещаемости чата в CSV (для Excel: «;» и BOM): строка на каждый
+# ответ «Буду» / «Не буду». Строки пишутся по мере чтения. Возвращает их число
+def export_attendance(conn, chat_id, path):
+    rows = conn.execute('''SELECT e.event_id, e.starts_at, e.date, e.type, e.status, p.user_id, m.name, 1
+                           FROM events e JOIN participants p ON p.event_id = e.event_id
+                           LEFT JOIN members m ON m.chat_id = e.chat_id AND m.user_id = p.user_id
+                           WHERE e.chat_id = ?
+                           UNION ALL
+                           SELECT e.event_id, e.starts_at, e.date, e.type, e.status, d.user_id, m.name, 0
+                           FROM events e JOIN declined d ON d.event_id = e.event_id
+                           LEFT JOIN members m ON m.chat_id = e.chat_id AND m.user_id = d.user_id
+                           WHERE e.chat_id = ?
+                           ORDER BY 2, 1, 8 DESC, 7''', (chat_id, chat_id))
+    count = 0
+    with open(path, 'w', encoding='utf-8-sig', newline='') as file:
+        writer = csv.writer(file, delimiter=';')
+        writer.writerow(['event_id', 'дата', 'время', 'тип', 'статус', 'user_id', 'имя', 'ответ'])
+        for event_id, starts_at, date, event_type, status, user_id, name, going in rows:
+            moment = from_timestamp(starts_at) if starts_at is not None else None
+            writer.writerow([event_id, f"{moment:%Y-%m-%d}" if moment else date,
+                             f"{moment:%H:%M}" if moment else '', event_type,
+                             'открыто' if status == 'open' else 'закрыто', user_id, name or '',
+                             'Буду' if going else 'Не буду'])
+            count += 1
+    return count
@@ -0,0 +1,150 @@
+import time
+from collections import namedtuple
+import numpy as np
+
+# Составы на игру: все отметившиеся делятся на N сбалансированных пятёрок.
+# Полевые распределяются локальным поиском по обменам игроков между командами,
+# вратари — отдельно, сильнейший вратарь достаётся слабейшей команде.
+
+TEAM_SIZE = 5
+MIN_TEAMS = 1
+MAX_TEAMS = 4
+TEAM_COLORS = ["Красная", "Синяя", "Белая", "Чёрная"]
+# Бюджет времени на оптимизацию (секунды)
+TIME_BUDGET = 0.1
+# Штраф за разницу в числе защитников между командами (в единицах рейтинга)
+DEFENSE_WEIGHT = 0.5
+# Сколько встряхиваний подряд без улучшения считать сходимостью
+MAX_STALLS = 50
+
+FORWARD = 'F'
+DEFENSE = 'D'
+GOALIE = 'G'
+POSITIONS = {FORWARD: "Н", DEFENSE: "З", GOALIE: "В"}
+DEFAULT_RATING = 5.0
+
+Player = namedtuple('Player', 'user_id name rating position')
+Lineup = namedtuple('Lineup', 'teams goalies spread iterations')
+
+
+def team_count(skaters, team_size=TEAM_SIZE):
+    return max(MIN_TEAMS, min(MAX_TEAMS, skaters // team_size))
+
+
+# Змейка по рейтингу: 0, 1, ..., N-1, N-1, ..., 0 — хорошая стартовая точка
+def snake_assignment(ratings, teams):
+    order = np.argsort(-ratings, kind='stable')
+    pattern = np.concatenate([np.arange(teams), np.arange(teams)[::-1]])
+    assignment = np.empty(len(ratings), dtype=np.intp)
+    assignment[order] = np.resize(pattern, len(ratings))
+    return assignment
+
+
+# Разброс средних рейтингов команд (max - min) и числа защитников
+def cost(ratings, defense, assignment, teams):
+    counts = np.bincount(assignment, minlength=teams)
+    means = np.bincount(assignment, weights=ratings, minlength=teams) / counts
+    defenders = np.bincount(assignment, weights=defense, minlength=teams)
+    return np.ptp(means) + DEFENSE_WEIGHT * np.ptp(defenders)
+
+
+def spread(ratings, assignment, teams):
+    counts = np.bincount(assignment, minlength=teams)
+    return float(np.ptp(np.bincount(assignment, weights=ratings, minlength=teams) / counts))
+
+
+# Локальный поиск: на каждом шаге оцениваем сразу все обмены пар игроков
+# из разных команд и делаем лучший. Размеры команд при обмене не меняются.
+# В локальном минимуме встряхиваем решение случайными обменами и продолжаем,
+# пока не кончится бюджет времени или улучшения не прекратятся;
+# возвращаем лучшее найденное.
+def optimize(ratings, defense, assignment, teams, time_budget=TIME_BUDGET, rng=None):
+    rng = rng or np.random.default_rng()
+    deadline = time.perf_counter() + time_budget
+    n = len(ratings)
+    i, j = np.triu_indices(n, 1)
+    counts = np.bincount(assignment, minlength=teams).astype(float)
+
+    current = assignment.copy()
+    current_cost = cost(ratings, defense, current, teams)
+    best, best_cost = current.copy(), current_cost
+    iterations = stalls = 0
+    while time.perf_counter() < deadline and best_cost > 1e-9 and stalls < MAX_STALLS:
+        iterations += 1
+        ti, tj = current[i], current[j]
+        mask = ti != tj
+        pi, pj, ti, tj = i[mask], j[mask], ti[mask], tj[mask]
+        if not len(pi):
+            break
+        sums = np.bincount(current, weights=ratings, minlength=teams)
+        dsum = np.bincount(current, weights=defense, minlength=teams)
+        # Суммы команд после каждого обмена: строка на кандидата
+        delta = ratings[pj] - ratings[pi]
+        new_sums = np.broadcast_to(sums, (len(pi), teams)).copy()
+        k = np.arange(len(pi))
+        new_sums[k, ti] += delta
+        new_sums[k, tj] -= delta
+        ddelta = defense[pj] - defense[pi]
+        new_def = np.broadcast_to(dsum, (len(pi), teams)).copy()
+        new_def[k, ti] += ddelta
+        new_def[k, tj] -= ddelta
+        costs = np.ptp(new_sums / counts, axis=1) + DEFENSE_WEIGHT * np.ptp(new_def, axis=1)
+        move = int(np.argmin(costs))
+        if costs[move] < current_cost - 1e-12:
+            a, b = pi[move], pj[move]
+            current[a], current[b] = current[b], current[a]
+            current_cost = float(costs[move])
+            if current_cost < best_cost:
+                best, best_cost = current.copy(), current_cost
+                stalls = 0
+        else:
+            stalls += 1
+            # Локальный минимум: несколько случайных обменов от лучшего решения
+            current = best.copy()
+            for _ in range(max(1, n // 10)):
+                a, b = rng.integers(n, size=2)
+                current[a], current[b] = current[b], current[a]
+            current_cost = cost(ratings, defense, current, teams)
+    return best, iterations
+
+
+# Деление отметившихся на команды. Полевые — все, без «лишних»: при 12 игроках
+# и двух командах получатся шестёрки. Возвращает Lineup: списки игроков по
+# командам, вратарей по командам, итоговый разброс средних рейтингов.
+def form_lines(players, teams=None, time_budget=TIME_BUDGET, seed=None):
+    skaters = [p for p in players if p.position != GOALIE]
+    goalies = [p for p in players if p.position == GOALIE]
+    teams = teams or team_count(len(skaters))
+    teams = max(1, min(teams, len(skaters)))
+
+    ratings = np.array([p.rating for p in skaters], dtype=float)
+    defense = np.array([p.position == DEFENSE for p in skaters], dtype=float)
+    assignment = snake_assignment(ratings, teams)
+    iterations = 0
+    if teams > 1:
+        assignment, iterations = optimize(ratings, defense, assignment, teams, time_budget,
+                                          np.random.default_rng(seed))
+
+    lines = [[] for _ in range(teams)]
+    for player, team in zip(skaters, assignment):
+        lines[team].append(player)
+    for line in lines:
+        line.sort(key=lambda p: (p.position != DEFENSE, -p.rating, p.name))
+
+    # Вратари: сильнейший — команде со слабейшим составом
+    strength = [sum(p.rating for p in line) / max(1, len(line)) for line in lines]
+    keepers = [[] for _ in range(teams)]
+    for index, goalie in enumerate(sorted(goalies, key=lambda p: -p.rating)):
+        order = sorted(range(teams), key=lambda t: strength[t])
+        keepers[order[index % teams]].append(goalie)
+    return Lineup(lines, keepers, spread(ratings, assignment, teams) if teams > 1 else 0.0, iterations)
+
+
+# Прежний способ: случайное перемешивание, для сравнения качества
+def random_lines(players, teams=None, seed=None):
+    skaters = [p for p in players if p.position != GOALIE]
+    teams = teams or team_count(len(skaters))
+    rng = np.random.default_rng(seed)
+    ratings = np.array([p.rating for p in skaters], dtype=float)
+    assignment = rng.permutation(np.resize(np.arange(teams), len(skaters)))
+    return spread(ratings, assignment, teams)
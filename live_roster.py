@@ -0,0 +1,102 @@
+import os
+import time
+import asyncio
+from collections import OrderedDict
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+
+# Не чаще одного редактирования сообщения события за это окно (секунды).
+# Лимит Telegram для групп — около 20 сообщений в минуту.
+ROSTER_EDIT_INTERVAL = float(os.getenv('ROSTER_EDIT_INTERVAL', '3'))
+# Сколько последних отрисованных текстов помнить для пропуска одинаковых правок
+ROSTER_TEXT_CACHE = 1024
+
+
+# Объединение правок списка участников.
+# Отметка лишь помечает сообщение события «грязным»; фоновая задача на каждое
+# сообщение отрисовывает актуальный состав и редактирует сообщение не чаще
+# одного раза за окно. Десять нажатий за секунду дают одну-две правки.
+class RosterUpdater:
+    def __init__(self, interval=ROSTER_EDIT_INTERVAL):
+        self.interval = interval
+        self._pending = {}
+        self._tasks = {}
+        self._last_edit = {}
+        self._last_text = OrderedDict()
+        self.stats = {'marks': 0, 'edits': 0, 'unchanged': 0, 'retry_after': 0, 'errors': 0}
+
+    # render — асинхронная функция без аргументов, возвращающая (text, reply_markup)
+    # на момент отправки, поэтому в сообщение всегда попадает последнее состояние
+    def mark_dirty(self, bot, chat_id, message_id, render):
+        key = (chat_id, message_id)
+        self.stats['marks'] += 1
+        self._pending[key] = (bot, render)
+        if key not in self._tasks:
+            self._tasks[key] = asyncio.create_task(self._flush_loop(key))
+
+    async def _flush_loop(self, key):
+        try:
+            while key in self._pending:
+                wait = self._last_edit.get(key, 0) + self.interval - time.monotonic()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                bot, render = self._pending.pop(key)
+                try:
+                    await self._flush(key, bot, render)
+                except Exception as e:
+                    self.stats['errors'] += 1
+                    print(f"ERROR rendering roster message {key}: {e}")
+        finally:
+            del self._tasks[key]
+
+    async def _flush(self, key, bot, render):
+        chat_id, message_id = key
+        text, reply_markup = await render()
+        if self._last_text.get(key) == text:
+            self.stats['unchanged'] += 1
+            return
+        try:
+            await bot.edit_message_text(
+                text=text,
+                chat_id=chat_id,
+                message_id=message_id,
+                reply_markup=reply_markup,
+                parse_mode="HTML"
+            )
+        except TelegramRetryAfter as e:
+            # Ждём сколько попросил Telegram и пробуем снова, если новых отметок не было
+            self.stats['retry_after'] += 1
+            self._pending.setdefault(key, (bot, render))
+            self._last_edit[key] = time.monotonic() + e.retry_after - self.interval
+            return
+        except TelegramBadRequest as e:
+            if 'message is not modified' not in str(e):
+                self.stats['errors'] += 1
+                print(f"ERROR editing roster message {key}: {e}")
+                return
+        else:
+            self.stats['edits'] += 1
+        self._last_edit[key] = time.monotonic()
+        self._remember(key, text)
+
+    def _remember(self, key, text):
+        self._last_text[key] = text
+        self._last_text.move_to_end(key)
+        while len(self._last_text) > ROSTER_TEXT_CACHE:
+            old, _ = self._last_text.popitem(last=False)
+            self._last_edit.pop(old, None)
+
+    # Снимок последних текстов для быстрого перезапуска (см. warm_start.CacheSnapshot):
+    # после перезапуска не отправляются правки, которые ничего не меняют
+    def snapshot(self):
+        return list(self._last_text.items())
+
+    def load_snapshot(self, state):
+        self._last_text = OrderedDict(state)
+
+    # Дожидаемся отправки всех отложенных правок (при остановке бота)
+    async def flush_all(self):
+        while self._tasks:
+            await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+
+
+roster_updater = RosterUpdater()
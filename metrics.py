@@ -0,0 +1,252 @@
+import os
+import json
+import time
+import bisect
+import functools
+import asyncio
+from aiohttp import web
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+
+# Метрики отдаются в текстовом формате Prometheus на http://METRICS_HOST:METRICS_PORT/metrics.
+# METRICS_PORT=0 отключает сервер метрик.
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', '9101'))
+# METRICS_JSON_LOG=1 — печатать каждое обработанное обновление и ошибки API строкой JSON
+METRICS_JSON_LOG = os.getenv('METRICS_JSON_LOG', '') not in ('', '0')
+# Как часто проверять задержку цикла событий (секунды)
+LOOP_LAG_INTERVAL = 0.5
+
+# Границы корзин гистограмм, секунды
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+ROW_BUCKETS = (0, 1, 5, 10, 50, 100, 500, 1000, 5000)
+SQL_LABEL_LENGTH = 80
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=''):
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.label_names = labels
+        self.values = {}
+
+    def inc(self, *labels, value=1):
+        self.values[labels] = self.values.get(labels, 0) + value
+
+    def samples(self):
+        for labels, value in sorted(self.values.items()):
+            yield f"{self.name}{_labels(self.label_names, labels)} {_number(value)}"
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def set(self, *labels, value):
+        self.values[labels] = value
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=BUCKETS):
+        self.name = name
+        self.help = help
+        self.label_names = labels
+        self.buckets = buckets
+        # labels -> [счётчики по корзинам..., сумма, количество]
+        self.values = {}
+
+    def observe(self, value, *labels):
+        entry = self.values.get(labels)
+        if entry is None:
+            entry = self.values[labels] = [0] * (len(self.buckets) + 2)
+        entry[bisect.bisect_left(self.buckets, value)] += 1
+        entry[-2] += value
+        entry[-1] += 1
+
+    def samples(self):
+        for labels, entry in sorted(self.values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), entry):
+                cumulative += count
+                le = f'le="{_number(bound)}"'
+                yield f"{self.name}_bucket{_labels(self.label_names, labels, le)} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.label_names, labels)} {_number(entry[-2])}"
+            yield f"{self.name}_count{_labels(self.label_names, labels)} {entry[-1]}"
+
+
+# Реестр метрик. Кроме собственных метрик при каждом запросе опрашивает
+# collectors — функции, возвращающие словарь чисел (outbox.metrics() и т. п.);
+# их значения отдаются как gauge с префиксом.
+class Registry:
+    def __init__(self, namespace='hockey'):
+        self.namespace = namespace
+        self._metrics = []
+        self._collectors = []
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self._add(Counter(f"{self.namespace}_{name}", help, labels))
+
+    def gauge(self, name, help, labels=()):
+        return self._add(Gauge(f"{self.namespace}_{name}", help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=BUCKETS):
+        return self._add(Histogram(f"{self.namespace}_{name}", help, labels, buckets))
+
+    def collector(self, prefix, fn):
+        self._collectors.append((f"{self.namespace}_{prefix}", fn))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        for prefix, fn in self._collectors:
+            for key, value in fn().items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    lines.append(f"# TYPE {prefix}_{key} gauge")
+                    lines.append(f"{prefix}_{key} {_number(value)}")
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+handler_seconds = registry.histogram(
+    'handler_seconds', "Время обработки обновления", ('event', 'handler', 'route'))
+handler_errors = registry.counter(
+    'handler_errors_total', "Исключения в обработчиках", ('event', 'handler', 'error'))
+sql_seconds = registry.histogram(
+    'sql_seconds', "Время выполнения запроса или транзакции SQLite", ('statement',))
+sql_rows = registry.histogram(
+    'sql_rows', "Строк вернул или изменил запрос", ('statement',), buckets=ROW_BUCKETS)
+api_seconds = registry.histogram(
+    'api_seconds', "Время запроса к Bot API", ('method',))
+api_errors = registry.counter(
+    'api_errors_total', "Ошибки запросов к Bot API", ('method', 'error'))
+loop_lag_seconds = registry.histogram(
+    'loop_lag_seconds', "Запаздывание цикла событий")
+loop_lag_max = registry.gauge(
+    'loop_lag_max_seconds', "Наибольшее запаздывание цикла событий")
+
+
+def log_json(**fields):
+    if METRICS_JSON_LOG:
+        print(json.dumps({'ts': round(time.time(), 3), **fields}, ensure_ascii=False))
+
+
+# Подпись SQL для метки: без переносов и длинных хвостов
+@functools.lru_cache(maxsize=1024)
+def sql_label(sql):
+    label = ' '.join(sql.split())
+    return label if len(label) <= SQL_LABEL_LENGTH else label[:SQL_LABEL_LENGTH - 1] + '…'
+
+
+# Наблюдатель для Database.observer
+def observe_sql(statement, seconds, rows):
+    statement = sql_label(statement)
+    sql_seconds.observe(seconds, statement)
+    if rows is not None and rows >= 0:
+        sql_rows.observe(rows, statement)
+
+
+# Middleware обработчиков сообщений и callback-запросов (регистрируется как inner,
+# поэтому известен выбранный обработчик). Для callback-запросов вместо общего
+# диспетчера callbacks.dispatch подставляется обработчик маршрута.
+class HandlerMetricsMiddleware(BaseMiddleware):
+    def __init__(self, event, router=None):
+        self.event = event
+        self.router = router
+
+    def _names(self, event, data):
+        if self.router is not None:
+            return self.router.route_name(event.data or '')
+        handler = data.get('handler')
+        callback = getattr(handler, 'callback', None)
+        return getattr(callback, '__name__', 'unknown'), ''
+
+    async def __call__(self, handler, event, data):
+        name, route = self._names(event, data)
+        start = time.perf_counter()
+        error = None
+        try:
+            return await handler(event, data)
+        except Exception as e:
+            error = type(e).__name__
+            handler_errors.inc(self.event, name, error)
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            handler_seconds.observe(elapsed, self.event, name, route)
+            log_json(kind='update', event=self.event, handler=name, route=route,
+                     ms=round(elapsed * 1000, 3), error=error)
+
+
+# Middleware сессии бота: время и ошибки каждого запроса к Bot API.
+# Подключается после OutboxMiddleware, поэтому меряет сам HTTP-запрос,
+# а повторы после 429 считаются отдельными запросами.
+class ApiMetricsMiddleware(BaseRequestMiddleware):
+    async def __call__(self, make_request, bot, method):
+        name = type(method).__name__
+        start = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except Exception as e:
+            api_errors.inc(name, type(e).__name__)
+            log_json(kind='api_error', method=name, error=type(e).__name__, message=str(e)[:200])
+            raise
+        finally:
+            api_seconds.observe(time.perf_counter() - start, name)
+
+
+# Фоновая задача: насколько позже запланированного просыпается цикл событий
+async def watch_loop_lag(interval=LOOP_LAG_INTERVAL):
+    loop = asyncio.get_running_loop()
+    worst = 0.0
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        lag = max(0.0, loop.time() - start - interval)
+        loop_lag_seconds.observe(lag)
+        worst = max(worst, lag)
+        loop_lag_max.set(value=worst)
+
+
+# HTTP-сервер метрик; возвращает AppRunner (runner.cleanup() при остановке) или None
+async def start_metrics_server(host=METRICS_HOST, port=METRICS_PORT):
+    if not port:
+        return None
+
+    async def handle(request):
+        return web.Response(text=registry.render(), content_type='text/plain', charset='utf-8')
+
+    app = web.Application()
+    app.router.add_get('/metrics', handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    print(f"Метрики: http://{host}:{port}/metrics")
+    return runner
@@ -0,0 +1,339 @@
+import time
+import sqlite3
+from datetime import time as day_start
+from event_time import backfill_starts_at, from_timestamp
+from tenants import LEGACY_CHAT_ID
+from scheduler import CLOSE, REMIND, closes_at, reminds_at, schedule_event
+
+# Версионированные миграции схемы базы данных.
+# Текущая версия хранится в PRAGMA user_version, при запуске применяются
+# только ещё не выполненные миграции — все вместе в одной транзакции.
+# Старые файлы hockey.db (версия 0) обновляются на месте.
+# Миграция — SQL-скрипт или функция от соединения, если нужен перенос данных.
+
+
+# events.date хранит «ДД.ММ» без года; время события переносим в starts_at
+def migrate_event_dates(conn):
+    for statement in split_statements('''
+        ALTER TABLE events ADD COLUMN starts_at INTEGER;
+        DROP INDEX IF EXISTS idx_events_status_date;
+        CREATE INDEX idx_events_status_starts ON events(status, starts_at);
+        CREATE INDEX idx_events_starts ON events(starts_at);
+    '''):
+        conn.execute(statement)
+    backfill_starts_at(conn)
+
+
+# Разделение данных по чатам. Роль, рейтинг и амплуа относятся к игроку в
+# конкретной команде и переезжают в members; события получают chat_id.
+# Индексы начинаются с chat_id, поэтому запросы одного чата не читают чужие строки.
+# Всё, что было до миграции, принадлежит чату LEGACY_CHAT_ID.
+def migrate_tenants(conn):
+    conn.execute('''CREATE TABLE members
+        (chat_id INTEGER NOT NULL,
+         user_id INTEGER NOT NULL REFERENCES users(user_id) ON DELETE CASCADE,
+         name TEXT,
+         is_coach INTEGER NOT NULL DEFAULT 0,
+         rating REAL NOT NULL DEFAULT 5,
+         position TEXT NOT NULL DEFAULT 'F' CHECK (position IN ('F', 'D', 'G')),
+         PRIMARY KEY (chat_id, user_id)) WITHOUT ROWID''')
+    conn.execute('''INSERT INTO members (chat_id, user_id, name, is_coach, rating, position)
+                    SELECT ?, user_id, name, COALESCE(is_coach, 0), rating, position FROM users''',
+                 (LEGACY_CHAT_ID,))
+    for statement in split_statements('''
+        CREATE INDEX idx_members_name ON members(chat_id, name, user_id);
+        CREATE INDEX idx_members_user ON members(user_id);
+        DROP INDEX idx_users_name;
+        ALTER TABLE users DROP COLUMN is_coach;
+        ALTER TABLE users DROP COLUMN rating;
+        ALTER TABLE users DROP COLUMN position;
+        ALTER TABLE users ADD COLUMN last_chat_id INTEGER;
+
+        ALTER TABLE events ADD COLUMN chat_id INTEGER NOT NULL DEFAULT 0;
+        DROP INDEX idx_events_status_starts;
+        DROP INDEX idx_events_starts;
+        CREATE INDEX idx_events_chat_status_starts ON events(chat_id, status, starts_at);
+        CREATE INDEX idx_events_chat_starts ON events(chat_id, starts_at);
+    '''):
+        conn.execute(statement)
+    conn.execute("UPDATE users SET last_chat_id = ?", (LEGACY_CHAT_ID,))
+    conn.execute("UPDATE events SET chat_id = ?", (LEGACY_CHAT_ID,))
+
+
+def migrate_team_players(conn):
+    for statement in split_statements('''
+        CREATE TABLE team_players
+            (team_id INTEGER NOT NULL REFERENCES teams(team_id) ON DELETE CASCADE,
+             user_id INTEGER NOT NULL REFERENCES users(user_id) ON DELETE CASCADE,
+             -- порядок в составе: вратари, затем полевые
+             position INTEGER NOT NULL,
+             PRIMARY KEY (team_id, user_id)) WITHOUT ROWID;
+        CREATE INDEX idx_team_players_user ON team_players(user_id);
+    '''):
+        conn.execute(statement)
+    # Составы хранились строкой имён через запятую: сопоставляем имена с игроками
+    # чата события; неоднозначные и ненайденные имена пропускаем
+    unknown = 0
+    for team_id, chat_id, players in conn.execute('''SELECT t.team_id, e.chat_id, t.players FROM teams t
+                                                    JOIN events e ON e.event_id = t.event_id''').fetchall():
+        for position, name in enumerate(name for name in (players or '').split(',') if name):
+            rows = conn.execute("SELECT user_id FROM members WHERE chat_id = ? AND name = ?",
+                                (chat_id, name)).fetchall()
+            if len(rows) != 1:
+                unknown += 1
+                continue
+            conn.execute("INSERT OR IGNORE INTO team_players (team_id, user_id, position) VALUES (?, ?, ?)",
+                         (team_id, rows[0][0], position))
+    if unknown:
+        print(f"Составы: не удалось сопоставить имён: {unknown}")
+
+    for statement in split_statements('''
+        ALTER TABLE teams DROP COLUMN players;
+
+        -- Проведённые события учитываются в статистике один раз (см. stats.roll_up)
+        ALTER TABLE events ADD COLUMN counted INTEGER NOT NULL DEFAULT 0;
+        CREATE INDEX idx_events_uncounted ON events(chat_id, starts_at) WHERE counted = 0;
+        CREATE TABLE chat_stats
+            (chat_id INTEGER PRIMARY KEY,
+             held INTEGER NOT NULL DEFAULT 0);
+        -- joined_held — сколько событий чата прошло до первого посещённого
+        CREATE TABLE player_stats
+            (chat_id INTEGER NOT NULL,
+             user_id INTEGER NOT NULL,
+             attended INTEGER NOT NULL DEFAULT 0,
+             joined_held INTEGER NOT NULL DEFAULT 0,
+             streak INTEGER NOT NULL DEFAULT 0,
+             best_streak INTEGER NOT NULL DEFAULT 0,
+             PRIMARY KEY (chat_id, user_id)) WITHOUT ROWID;
+        CREATE TABLE linemates
+            (chat_id INTEGER NOT NULL,
+             user_id INTEGER NOT NULL,
+             mate_id INTEGER NOT NULL,
+             games INTEGER NOT NULL,
+             PRIMARY KEY (chat_id, user_id, mate_id)) WITHOUT ROWID;
+        INSERT INTO linemates (chat_id, user_id, mate_id, games)
+            SELECT e.chat_id, a.user_id, b.user_id, COUNT(*) FROM team_players a
+            JOIN team_players b ON b.team_id = a.team_id AND b.user_id != a.user_id
+            JOIN teams t ON t.team_id = a.team_id
+            JOIN events e ON e.event_id = t.event_id
+            GROUP BY e.chat_id, a.user_id, b.user_id;
+
+        -- Поздние отметки на уже учтённые события
+        CREATE TRIGGER participants_counted_insert AFTER INSERT ON participants
+        WHEN (SELECT counted FROM events WHERE event_id = NEW.event_id) = 1
+        BEGIN
+            INSERT INTO player_stats (chat_id, user_id, attended, joined_held)
+                SELECT e.chat_id, NEW.user_id, 1, c.held - 1 FROM events e
+                JOIN chat_stats c ON c.chat_id = e.chat_id
+                WHERE e.event_id = NEW.event_id
+                ON CONFLICT DO UPDATE SET attended = attended + 1;
+        END;
+        CREATE TRIGGER participants_counted_delete AFTER DELETE ON participants
+        WHEN (SELECT counted FROM events WHERE event_id = OLD.event_id) = 1
+        BEGIN
+            UPDATE player_stats SET attended = MAX(attended - 1, 0)
+                WHERE chat_id = (SELECT chat_id FROM events WHERE event_id = OLD.event_id)
+                AND user_id = OLD.user_id;
+        END;
+    '''):
+        conn.execute(statement)
+
+
+# Таймеры закрытия событий и напоминаний (см. scheduler). Открытые события с
+# известным временем получают таймеры сразу: давно прошедшие закроются при
+# первом запуске, напоминания ставятся только тем, до которых ещё не дошло
+def migrate_timers(conn):
+    for statement in split_statements('''
+        CREATE TABLE timers
+            (event_id INTEGER NOT NULL REFERENCES events(event_id) ON DELETE CASCADE,
+             kind TEXT NOT NULL CHECK (kind IN ('close', 'remind')),
+             chat_id INTEGER NOT NULL,
+             due_at INTEGER NOT NULL,
+             PRIMARY KEY (event_id, kind)) WITHOUT ROWID;
+        -- Ответы «Не буду» (participants хранит только «Буду»): им не напоминаем
+        CREATE TABLE declined
+            (event_id INTEGER NOT NULL REFERENCES events(event_id) ON DELETE CASCADE,
+             user_id INTEGER NOT NULL,
+             PRIMARY KEY (event_id, user_id)) WITHOUT ROWID;
+        -- Неразосланные напоминания
+        CREATE TABLE reminders
+            (chat_id INTEGER NOT NULL,
+             event_id INTEGER NOT NULL REFERENCES events(event_id) ON DELETE CASCADE,
+             user_id INTEGER NOT NULL,
+             PRIMARY KEY (chat_id, event_id, user_id)) WITHOUT ROWID;
+    '''):
+        conn.execute(statement)
+    for event_id, chat_id, starts_at in conn.execute(
+            "SELECT event_id, chat_id, starts_at FROM events WHERE status = 'open' AND starts_at IS NOT NULL"
+    ).fetchall():
+        schedule_event(conn, event_id, chat_id, starts_at)
+
+
+# События без времени (начало — полночь по времени команды, как их и
+# показывает format_event_date) отмечаются all_day. Их таймеры переносятся:
+# закрытие — на конец дня, напоминание — на REMIND_HOUR; событие, закрытое
+# утром в день игры, открывается снова до конца дня. Уже сработавших таймеров
+# в таблице нет, поэтому второго напоминания не будет
+def migrate_all_day(conn):
+    conn.execute("ALTER TABLE events ADD COLUMN all_day INTEGER NOT NULL DEFAULT 0")
+    now = time.time()
+    rows = conn.execute("SELECT event_id, chat_id, starts_at, status FROM events WHERE starts_at IS NOT NULL").fetchall()
+    for event_id, chat_id, starts_at, status in rows:
+        if from_timestamp(starts_at).time() != day_start():
+            continue
+        conn.execute("UPDATE events SET all_day = 1 WHERE event_id = ?", (event_id,))
+        close_at = closes_at(starts_at, all_day=True)
+        if status == 'closed' and close_at > now and not conn.execute(
+                "SELECT 1 FROM timers WHERE event_id = ? AND kind = ?", (event_id, CLOSE)).fetchone():
+            conn.execute("UPDATE events SET status = 'open' WHERE event_id = ?", (event_id,))
+            conn.execute("INSERT INTO timers (due_at, event_id, kind, chat_id) VALUES (?, ?, ?, ?)",
+                         (close_at, event_id, CLOSE, chat_id))
+            continue
+        conn.execute("UPDATE timers SET due_at = ? WHERE event_id = ? AND kind = ?", (close_at, event_id, CLOSE))
+        conn.execute("UPDATE timers SET due_at = ? WHERE event_id = ? AND kind = ?",
+                     (reminds_at(starts_at, all_day=True), event_id, REMIND))
+
+
+MIGRATIONS = [
+    (1, "Базовая схема", '''
+        CREATE TABLE IF NOT EXISTS users
+            (user_id INTEGER PRIMARY KEY, name TEXT, is_coach INTEGER DEFAULT 0);
+        CREATE TABLE IF NOT EXISTS events
+            (event_id INTEGER PRIMARY KEY AUTOINCREMENT, date TEXT, type TEXT, status TEXT DEFAULT 'open', group_msg_id INTEGER);
+        CREATE TABLE IF NOT EXISTS participants
+            (event_id INTEGER, user_id INTEGER,
+             FOREIGN KEY(event_id) REFERENCES events(event_id),
+             FOREIGN KEY(user_id) REFERENCES users(user_id));
+        CREATE TABLE IF NOT EXISTS teams
+            (team_id INTEGER PRIMARY KEY AUTOINCREMENT,
+             event_id INTEGER,
+             color TEXT,
+             players TEXT);
+    '''),
+    (2, "Уникальные отметки, индексы и внешние ключи", '''
+        -- Отметки: одна на пару (событие, игрок); дубли и отметки
+        -- несуществующих игроков/событий (их и так не было видно в списке) отбрасываем
+        CREATE TABLE participants_new
+            (event_id INTEGER NOT NULL REFERENCES events(event_id) ON DELETE CASCADE,
+             user_id INTEGER NOT NULL REFERENCES users(user_id) ON DELETE CASCADE,
+             UNIQUE (event_id, user_id));
+        INSERT OR IGNORE INTO participants_new (event_id, user_id)
+            SELECT p.event_id, p.user_id FROM participants p
+            JOIN events e ON e.event_id = p.event_id
+            JOIN users u ON u.user_id = p.user_id;
+        DROP TABLE participants;
+        ALTER TABLE participants_new RENAME TO participants;
+        CREATE INDEX idx_participants_user ON participants(user_id);
+
+        CREATE TABLE teams_new
+            (team_id INTEGER PRIMARY KEY AUTOINCREMENT,
+             event_id INTEGER REFERENCES events(event_id) ON DELETE CASCADE,
+             color TEXT,
+             players TEXT);
+        INSERT INTO teams_new (team_id, event_id, color, players)
+            SELECT t.team_id, e.event_id, t.color, t.players FROM teams t
+            LEFT JOIN events e ON e.event_id = t.event_id;
+        DROP TABLE teams;
+        ALTER TABLE teams_new RENAME TO teams;
+        CREATE INDEX idx_teams_event ON teams(event_id);
+
+        CREATE INDEX idx_events_status_date ON events(status, date);
+    '''),
+    (3, "Индекс для постраничного списка игроков", '''
+        CREATE INDEX idx_users_name ON users(name, user_id);
+    '''),
+    (4, "Время событий как метка времени", migrate_event_dates),
+    (5, "Рейтинг и амплуа игроков", '''
+        -- F — нападающий, D — защитник, G — вратарь
+        ALTER TABLE users ADD COLUMN rating REAL NOT NULL DEFAULT 5;
+        ALTER TABLE users ADD COLUMN position TEXT NOT NULL DEFAULT 'F'
+            CHECK (position IN ('F', 'D', 'G'));
+    '''),
+    (6, "Данные по чатам", migrate_tenants),
+    (7, "Состояния диалогов", '''
+        -- Ключ — поля aiogram StorageKey; пустые thread_id и business_connection_id — 0 и ''
+        CREATE TABLE fsm_states (
+            bot_id INTEGER NOT NULL,
+            chat_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            thread_id INTEGER NOT NULL DEFAULT 0,
+            business_connection_id TEXT NOT NULL DEFAULT '',
+            destiny TEXT NOT NULL DEFAULT 'default',
+            state TEXT,
+            data TEXT NOT NULL DEFAULT '{}',
+            updated_at REAL NOT NULL,
+            PRIMARY KEY (bot_id, chat_id, user_id, thread_id, business_connection_id, destiny)
+        ) WITHOUT ROWID;
+        CREATE INDEX idx_fsm_states_updated ON fsm_states(updated_at);
+    '''),
+    (8, "Составы по игрокам и статистика посещаемости", migrate_team_players),
+    (9, "Таймеры закрытия событий и напоминаний", migrate_timers),
+    (10, "Состояние бота между перезапусками", '''
+        -- Последнее обработанное обновление и метка снимка кэшей (см. warm_start)
+        CREATE TABLE bot_state (key TEXT PRIMARY KEY, value) WITHOUT ROWID;
+    '''),
+    (11, "События без времени", migrate_all_day),
+]
+
+
+class MigrationError(Exception):
+    pass
+
+
+def schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+# Применяем недостающие миграции на соединении писателя.
+# Вся пачка выполняется в одной транзакции: база либо обновляется целиком,
+# либо остаётся на прежней версии.
+def apply_migrations(conn, migrations=MIGRATIONS):
+    version = schema_version(conn)
+    pending = [m for m in migrations if m[0] > version]
+    if not pending:
+        return version
+
+    # Пересборка таблиц требует отключённых внешних ключей (вне транзакции)
+    conn.execute("PRAGMA foreign_keys = OFF")
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        for number, name, script in pending:
+            try:
+                if callable(script):
+                    script(conn)
+                else:
+                    # executescript сам завершает открытую транзакцию, поэтому скрипт
+                    # выполняем по одной инструкции
+                    for statement in split_statements(script):
+                        conn.execute(statement)
+            except Exception as e:
+                conn.execute("ROLLBACK")
+                raise MigrationError(f"Миграция {number} ({name}) не применена: {e}") from e
+            print(f"Миграция {number}: {name}")
+        violations = conn.execute("PRAGMA foreign_key_check").fetchall()
+        if violations:
+            conn.execute("ROLLBACK")
+            raise MigrationError(f"Нарушены внешние ключи: {violations[:5]}")
+        conn.execute(f"PRAGMA user_version = {pending[-1][0]}")
+        conn.execute("COMMIT")
+    finally:
+        conn.execute("PRAGMA foreign_keys = ON")
+    return pending[-1][0]
+
+
+# Разбиваем скрипт на отдельные инструкции
+def split_statements(script):
+    statement = ''
+    for line in script.splitlines(keepends=True):
+        if line.strip().startswith('--'):
+            continue
+        statement += line
+        if sqlite3.complete_statement(statement):
+            yield statement.strip()
+            statement = ''
+    if statement.strip():
+        yield statement.strip()
+
+
+async def migrate(db):
+    return await db.with_writer(apply_migrations)
@@ -0,0 +1,316 @@
+import os
+import time
+import heapq
+import asyncio
+import itertools
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import (
+    AnswerCallbackQuery,
+    DeleteMessage,
+    EditMessageReplyMarkup,
+    EditMessageText,
+    SendDocument,
+    SendMessage,
+)
+
+# Лимиты Telegram: не больше ~30 сообщений в секунду всего,
+# ~1 в секунду в личный чат и ~20 в минуту в группу
+GLOBAL_RATE = float(os.getenv('OUTBOX_GLOBAL_RATE', '30'))
+PRIVATE_RATE = float(os.getenv('OUTBOX_PRIVATE_RATE', '1'))
+GROUP_RATE = float(os.getenv('OUTBOX_GROUP_RATE', str(20 / 60)))
+PRIVATE_BURST = 3
+GROUP_BURST = 5
+OUTBOX_WORKERS = int(os.getenv('OUTBOX_WORKERS', '8'))
+MAX_RETRIES = 5
+
+# Короткие тексты подряд в один чат склеиваются в одно сообщение
+SMALL_TEXT = 1000
+MESSAGE_LIMIT = 4096
+
+# Приоритеты: меньше — раньше
+PRIORITY_CALLBACK = 0
+PRIORITY_EDIT = 1
+PRIORITY_MESSAGE = 2
+PRIORITY_BULK = 3
+
+PRIORITIES = {
+    AnswerCallbackQuery: PRIORITY_CALLBACK,
+    EditMessageText: PRIORITY_EDIT,
+    EditMessageReplyMarkup: PRIORITY_EDIT,
+    DeleteMessage: PRIORITY_EDIT,
+    SendMessage: PRIORITY_MESSAGE,
+    SendDocument: PRIORITY_MESSAGE,
+}
+
+# Приоритет запросов, отправленных в текущем контексте (см. bulk)
+_priority = contextvars.ContextVar('outbox_priority', default=None)
+
+
+# Запросы, отправленные внутри блока (и в задачах, созданных в нём), идут
+# с приоритетом рассылки: после ответов на нажатия и обычных сообщений
+@contextmanager
+def bulk():
+    token = _priority.set(PRIORITY_BULK)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    # Сколько ждать до появления токена
+    def delay(self, now):
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+    def full(self, now):
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+class _Job:
+    __slots__ = ('priority', 'seq', 'make_request', 'bot', 'method', 'futures', 'enqueued', 'attempts')
+
+    def __init__(self, priority, seq, make_request, bot, method, future):
+        self.priority = priority
+        self.seq = seq
+        self.make_request = make_request
+        self.bot = bot
+        self.method = method
+        self.futures = [future]
+        self.enqueued = time.monotonic()
+        self.attempts = 0
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+# Очередь одного чата: отправляется не больше одного запроса за раз,
+# поэтому порядок сообщений внутри чата сохраняется
+class _Lane:
+    __slots__ = ('jobs', 'bucket', 'state', 'paused_until', 'tail')
+
+    def __init__(self, bucket):
+        self.jobs = []
+        self.bucket = bucket
+        self.state = 'idle'  # idle / waiting / ready / busy
+        self.paused_until = 0.0
+        self.tail = None
+
+    def delay(self, now):
+        wait = max(0.0, self.paused_until - now)
+        if self.bucket is not None:
+            wait = max(wait, self.bucket.delay(now))
+        return wait
+
+
+# Центральная очередь исходящих запросов к Bot API.
+# Приоритетная очередь, token bucket на каждый чат и общий, повтор после
+# retry_after и склейка коротких сообщений. Подключается к сессии бота как
+# middleware, поэтому через неё идут все message.answer / edit_text обработчиков.
+class Outbox:
+    def __init__(self, global_rate=GLOBAL_RATE, private_rate=PRIVATE_RATE, group_rate=GROUP_RATE,
+                 workers=OUTBOX_WORKERS):
+        self.private_rate = private_rate
+        self.group_rate = group_rate
+        self.workers = workers
+        self._global = TokenBucket(global_rate, max(1, global_rate))
+        self._lanes = {}
+        self._ready = []
+        # Запросы без чата (ответы на callback) не считаются сообщениями
+        # и не расходуют общий лимит
+        self._ready_free = []
+        self._seq = itertools.count()
+        self._wakeup = None
+        self._tasks = []
+        self._depth = 0
+        self._waits = deque(maxlen=1000)
+        self.stats = {'sent': 0, 'merged': 0, 'retries': 0, 'failed': 0, 'max_depth': 0}
+
+    def start(self):
+        if self._tasks:
+            return
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    # Дожидаемся отправки очереди и останавливаем обработчики
+    async def close(self):
+        while self._depth or any(lane.state == 'busy' for lane in self._lanes.values()):
+            await asyncio.sleep(0.05)
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def _bucket_for(self, chat_id):
+        if chat_id is None:
+            return None
+        if isinstance(chat_id, int) and chat_id > 0:
+            return TokenBucket(self.private_rate, PRIVATE_BURST)
+        return TokenBucket(self.group_rate, GROUP_BURST)
+
+    async def submit(self, make_request, bot, method, priority=None):
+        self.start()
+        if priority is None:
+            priority = PRIORITIES.get(type(method), PRIORITY_MESSAGE)
+        future = asyncio.get_running_loop().create_future()
+        chat_id = getattr(method, 'chat_id', None)
+        # Запросы без чата (ответы на callback) не ждут друг друга
+        key = chat_id if chat_id is not None else ('nochat', next(self._seq))
+        lane = self._lanes.get(key)
+        if lane is None:
+            lane = self._lanes[key] = _Lane(self._bucket_for(chat_id))
+
+        if lane.tail is not None and self._merge(lane.tail, method, future):
+            self.stats['merged'] += 1
+        else:
+            job = _Job(priority, next(self._seq), make_request, bot, method, future)
+            heapq.heappush(lane.jobs, job)
+            lane.tail = job
+            self._depth += 1
+            self.stats['max_depth'] = max(self.stats['max_depth'], self._depth)
+            self._schedule(key)
+        return await future
+
+    @staticmethod
+    def _mergeable(method):
+        return (isinstance(method, SendMessage) and isinstance(method.text, str)
+                and len(method.text) <= SMALL_TEXT and method.reply_markup is None
+                and not method.entities)
+
+    # Дописываем текст к ещё не отправленному сообщению в тот же чат
+    def _merge(self, job, method, future):
+        if not (self._mergeable(job.method) and self._mergeable(method)):
+            return False
+        if job.method.model_dump(exclude={'text'}) != method.model_dump(exclude={'text'}):
+            return False
+        text = f"{job.method.text}\n\n{method.text}"
+        if len(text) > MESSAGE_LIMIT:
+            return False
+        job.method.text = text
+        job.futures.append(future)
+        return True
+
+    def _schedule(self, key):
+        lane = self._lanes.get(key)
+        if lane is None or lane.state != 'idle' or not lane.jobs:
+            return
+        delay = lane.delay(time.monotonic())
+        if delay > 0:
+            lane.state = 'waiting'
+            asyncio.get_running_loop().call_later(delay, self._wake_lane, key)
+        else:
+            lane.state = 'ready'
+            head = lane.jobs[0]
+            ready = self._ready if lane.bucket is not None else self._ready_free
+            heapq.heappush(ready, (head.priority, head.seq, key))
+            self._wakeup.set()
+
+    def _wake_lane(self, key):
+        lane = self._lanes.get(key)
+        if lane is not None and lane.state == 'waiting':
+            lane.state = 'idle'
+            self._schedule(key)
+
+    async def _worker(self):
+        while True:
+            while not (self._ready or self._ready_free):
+                self._wakeup.clear()
+                await self._wakeup.wait()
+            if self._ready_free:
+                _, _, key = heapq.heappop(self._ready_free)
+            else:
+                now = time.monotonic()
+                delay = self._global.delay(now)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                    continue
+                _, _, key = heapq.heappop(self._ready)
+                self._global.take(now)
+                self._lanes[key].bucket.take(now)
+            lane = self._lanes[key]
+            job = heapq.heappop(lane.jobs)
+            if lane.tail is job:
+                lane.tail = None
+            self._depth -= 1
+            lane.state = 'busy'
+            try:
+                await self._send(job, lane)
+            finally:
+                lane.state = 'idle'
+                if lane.jobs:
+                    self._schedule(key)
+                elif lane.bucket is None or lane.bucket.full(time.monotonic()):
+                    del self._lanes[key]
+
+    async def _send(self, job, lane):
+        if job.attempts == 0:
+            self._waits.append(time.monotonic() - job.enqueued)
+        try:
+            result = await job.make_request(job.bot, job.method)
+        except TelegramRetryAfter as e:
+            self.stats['retries'] += 1
+            lane.paused_until = time.monotonic() + e.retry_after
+            if job.attempts < MAX_RETRIES:
+                job.attempts += 1
+                heapq.heappush(lane.jobs, job)
+                self._depth += 1
+                return
+            self._fail(job, e)
+        except Exception as e:
+            self._fail(job, e)
+        else:
+            self.stats['sent'] += 1
+            for future in job.futures:
+                if not future.done():
+                    future.set_result(result)
+
+    def _fail(self, job, error):
+        self.stats['failed'] += 1
+        for future in job.futures:
+            if not future.done():
+                future.set_exception(error)
+
+    # Метрики: глубина очереди и время ожидания отправки
+    def metrics(self):
+        waits = sorted(self._waits)
+        return {
+            **self.stats,
+            'depth': self._depth,
+            'in_flight': sum(lane.state == 'busy' for lane in self._lanes.values()),
+            'wait_avg_ms': sum(waits) / len(waits) * 1000 if waits else 0.0,
+            'wait_p95_ms': waits[int(len(waits) * 0.95)] * 1000 if waits else 0.0,
+            'wait_max_ms': waits[-1] * 1000 if waits else 0.0,
+        }
+
+
+class OutboxMiddleware(BaseRequestMiddleware):
+    def __init__(self, outbox):
+        self.outbox = outbox
+
+    async def __call__(self, make_request, bot, method):
+        # getUpdates, getChatAdministrators и прочие запросы идут напрямую
+        if type(method) not in PRIORITIES:
+            return await make_request(bot, method)
+        return await self.outbox.submit(make_request, bot, method, _priority.get())
+
+
+outbox = Outbox()
@@ -0,0 +1,130 @@
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+from callbacks import CompactCallback
+
+PAGE_SIZE = 8
+# Префикс поиска хранится в callback_data, поэтому ограничиваем его длину
+MAX_QUERY = 16
+
+
+class PageNav(CompactCallback, prefix='pg'):
+    kind: str
+    cursor: int
+    forward: bool
+    query: str
+
+
+def clean_query(query):
+    return (query or '').replace(':', '').strip()[:MAX_QUERY]
+
+
+# Верхняя граница для поиска по префиксу через индекс: name >= 'Ив' AND name < 'Иг'
+def prefix_upper_bound(prefix):
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+# Постраничная inline-клавиатура с keyset-пагинацией.
+# Страница выбирается условием (ключи) > (ключи строки-курсора) по индексу,
+# без OFFSET, поэтому любая страница стоит одинаково. В callback_data кнопок
+# «назад/вперёд» хранится только id граничной строки.
+#
+# table      — таблица, id_column — её первичный ключ
+# columns    — выбираемые колонки; render получает строку (id, *columns)
+# keys       — колонки сортировки, последняя должна быть уникальной
+# where      — постоянное условие (например status = 'open')
+# search     — колонка для поиска по префиксу
+# tenant     — колонка чата; значение передаётся в fetch/keyboard/navigate,
+#              и страница, и строка-курсор ищутся только в этом чате
+class KeysetPaginator:
+    registry = {}
+
+    def __init__(self, kind, table, id_column, columns, keys, render, where=None, search=None,
+                 tenant=None, descending=False, page_size=PAGE_SIZE, extra_rows=None):
+        if kind in self.registry:
+            raise ValueError(f"Paginator {kind!r} is already registered")
+        self.kind = kind
+        self.table = table
+        self.id_column = id_column
+        self.columns = columns
+        self.keys = keys
+        self.render = render
+        self.where = where
+        self.search = search
+        self.tenant = tenant
+        self.descending = descending
+        self.page_size = page_size
+        self.extra_rows = extra_rows or []
+        self.registry[kind] = self
+
+    def _sql(self, cursor, forward, query, tenant=None):
+        conditions = [self.where] if self.where else []
+        params = []
+        # id строки уникален только внутри чата (members), поэтому чат — и в подзапросе курсора
+        scope, scope_params = '', []
+        if self.tenant:
+            scope, scope_params = f"{self.tenant} = ? AND ", [tenant]
+            conditions.insert(0, f"{self.tenant} = ?")
+            params += scope_params
+        if query and self.search:
+            conditions.append(f"{self.search} >= ? AND {self.search} < ?")
+            params += [query, prefix_upper_bound(query)]
+        # Направление чтения: при переходе назад идём в обратном порядке и разворачиваем
+        descending = self.descending == forward
+        if cursor is not None:
+            keys = ', '.join(self.keys)
+            conditions.append(f"({keys}) {'<' if descending else '>'} "
+                              f"(SELECT {keys} FROM {self.table} WHERE {scope}{self.id_column} = ?)")
+            params += scope_params + [cursor]
+        order = ', '.join(f"{key} {'DESC' if descending else 'ASC'}" for key in self.keys)
+        sql = (f"SELECT {self.id_column}, {self.columns} FROM {self.table} "
+               f"WHERE {' AND '.join(conditions) or '1'} ORDER BY {order} LIMIT ?")
+        params.append(self.page_size + 1)
+        return sql, params
+
+    async def fetch(self, db, cursor=None, forward=True, query='', tenant=None):
+        sql, params = self._sql(cursor, forward, query, tenant)
+        rows = await db.fetchall(sql, params)
+        more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if not forward:
+            rows.reverse()
+        # Есть ли страницы до и после текущей
+        has_prev = more if not forward else cursor is not None
+        has_next = more if forward else cursor is not None
+        return rows, has_prev, has_next
+
+    # Клавиатура страницы; None, если строк нет совсем
+    async def keyboard(self, db, cursor=None, forward=True, query='', tenant=None):
+        query = clean_query(query)
+        rows, has_prev, has_next = await self.fetch(db, cursor, forward, query, tenant)
+        if not rows and cursor is not None:
+            # Граничная строка могла исчезнуть — начинаем сначала
+            rows, has_prev, has_next = await self.fetch(db, None, True, query, tenant)
+        if not rows:
+            return None
+
+        keyboard = [[self.render(row)] for row in rows]
+        nav = []
+        if has_prev:
+            nav.append(InlineKeyboardButton(
+                text="◀️", callback_data=PageNav(kind=self.kind, cursor=rows[0][0], forward=False, query=query).pack()
+            ))
+        if has_next:
+            nav.append(InlineKeyboardButton(
+                text="▶️", callback_data=PageNav(kind=self.kind, cursor=rows[-1][0], forward=True, query=query).pack()
+            ))
+        if nav:
+            keyboard.append(nav)
+        keyboard.extend(self.extra_rows)
+        return InlineKeyboardMarkup(inline_keyboard=keyboard)
+
+    # Обработчик кнопок «◀️ / ▶️»: меняем только клавиатуру сообщения.
+    # Чат в callback_data не хранится — его определяет вызывающий
+    @classmethod
+    async def navigate(cls, db, callback, data, tenant=None):
+        pager = cls.registry.get(data.kind)
+        if pager is None:
+            return callback.answer("⚠️ Кнопка устарела, откройте меню заново")
+        markup = await pager.keyboard(db, data.cursor, data.forward, data.query, tenant)
+        if markup is None:
+            return callback.answer("📭 Список пуст")
+        await callback.message.edit_reply_markup(reply_markup=markup)
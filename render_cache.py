@@ -0,0 +1,74 @@
+import itertools
+from collections import OrderedDict
+
+# Сколько готовых представлений (текст / клавиатура) держать в памяти
+RENDER_CACHE_SIZE = 4096
+
+
+# Кэш готовых текстов и клавиатур списков событий и меню.
+# У каждого чата есть «версия событий» — монотонно растущее число; её повышает
+# всё, что меняет список событий чата (создание, смена статуса). Представление
+# хранится вместе с версией, на которой построено, и отдаётся без запросов к
+# базе, пока версия чата не изменилась. Ключ — (вид, чат, роль).
+class RenderCache:
+    def __init__(self, size=RENDER_CACHE_SIZE):
+        self.size = size
+        self._clock = itertools.count(1)
+        # chat_id -> версия событий
+        self._versions = {}
+        # (view, chat_id, role) -> (версия, представление)
+        self._entries = OrderedDict()
+        # Вызывается при повышении версии (chat_id): в режиме рабочих процессов
+        # сбрасывает представления этого чата в остальных процессах
+        self.on_change = None
+        self.stats = {'hits': 0, 'misses': 0, 'bumps': 0}
+
+    def version(self, chat_id):
+        return self._versions.get(chat_id, 0)
+
+    # Список событий чата изменился (notify=False — изменение пришло из другого процесса)
+    def bump(self, chat_id, notify=True):
+        self._versions[chat_id] = next(self._clock)
+        self.stats['bumps'] += 1
+        if notify and self.on_change is not None:
+            self.on_change(chat_id)
+
+    # build — асинхронная функция без аргументов, строящая представление
+    async def get(self, view, chat_id, role, build):
+        key = (view, chat_id, role)
+        version = self.version(chat_id)
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] == version:
+            self.stats['hits'] += 1
+            self._entries.move_to_end(key)
+            return entry[1]
+        self.stats['misses'] += 1
+        value = await build()
+        # Версия взята до построения: если её повысили, пока шли запросы,
+        # запись устареет и следующий показ построит представление заново
+        self._entries[key] = (version, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+        return value
+
+    # Снимок для быстрого перезапуска (см. warm_start.CacheSnapshot): версии
+    # чатов продолжаются с сохранённых, поэтому записи снимка остаются действительны
+    def snapshot(self):
+        return {'versions': dict(self._versions), 'entries': list(self._entries.items())}
+
+    def load_snapshot(self, state):
+        self._versions = state['versions']
+        self._entries = OrderedDict(state['entries'])
+        self._clock = itertools.count(max(self._versions.values(), default=0) + 1)
+
+    def metrics(self):
+        lookups = self.stats['hits'] + self.stats['misses']
+        return {
+            **self.stats,
+            'entries': len(self._entries),
+            'hit_rate': self.stats['hits'] / lookups if lookups else 0.0,
+        }
+
+
+render_cache = RenderCache()
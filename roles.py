@@ -0,0 +1,57 @@
+# Кэш ролей пользователей в памяти процесса.
+# Загружается один раз при запуске (вместе с проверкой схемы) и обновляется
+# при каждой записи роли, поэтому проверка прав — это поиск в словаре без SQL.
+# Роль относится к игроку в конкретном чате: ключ — (chat_id, user_id).
+
+COACH = 'coach'
+
+
+class RoleCache:
+    def __init__(self):
+        self._roles = {}
+        self.loaded = False
+        # Вызывается при каждом изменении роли (chat_id, user_id, is_coach):
+        # в режиме рабочих процессов сообщает о нём остальным процессам
+        self.on_change = None
+
+    # Проверка схемы: выполняется один раз при запуске, а не на каждый запрос
+    @staticmethod
+    def _validate_schema(conn):
+        if not conn.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='members'").fetchone():
+            raise RuntimeError("Table 'members' does not exist")
+        columns = [col[1] for col in conn.execute("PRAGMA table_info(members)")]
+        if 'is_coach' not in columns:
+            raise RuntimeError(f"Column 'is_coach' does not exist in members table. Columns: {columns}")
+
+    def _load(self, conn):
+        self._validate_schema(conn)
+        return {(row[0], row[1]): COACH
+                for row in conn.execute("SELECT chat_id, user_id FROM members WHERE is_coach = 1")}
+
+    async def load(self, db):
+        self._roles = await db.read(self._load)
+        self.loaded = True
+        print(f"Роли загружены: тренеров {len(self._roles)}")
+
+    def is_coach(self, chat_id, user_id):
+        return self._roles.get((chat_id, user_id)) == COACH
+
+    # Вызывается после успешной записи в members (notify=False — изменение пришло из другого процесса)
+    def set_coach(self, chat_id, user_id, is_coach=True, notify=True):
+        if is_coach:
+            self._roles[(chat_id, user_id)] = COACH
+        else:
+            self._roles.pop((chat_id, user_id), None)
+        if notify and self.on_change is not None:
+            self.on_change(chat_id, user_id, is_coach)
+
+    # Снимок для быстрого перезапуска (см. warm_start.CacheSnapshot)
+    def snapshot(self):
+        return dict(self._roles)
+
+    def load_snapshot(self, state):
+        self._roles = state
+        self.loaded = True
+
+
+roles = RoleCache()
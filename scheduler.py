@@ -0,0 +1,284 @@
+import os
+import html
+import time
+import heapq
+import asyncio
+from datetime import datetime, time as day_start, timedelta
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+from database import db
+from attendance import attendance
+from callbacks import Mark
+from event_time import EVENT_TZ, format_event_date, from_timestamp, to_timestamp
+from outbox import bulk
+from render_cache import render_cache
+from stats import roll_up
+
+# Через сколько секунд после начала событие закрывается и пропадает из списков
+EVENT_CLOSE_AFTER = float(os.getenv('EVENT_CLOSE_AFTER', str(6 * 3600)))
+# За сколько секунд до начала напомнить тем, кто ещё не отметился
+REMIND_BEFORE = float(os.getenv('REMIND_BEFORE', '86400'))
+# В котором часу (по времени команды) напоминать о событиях без времени
+REMIND_HOUR = int(os.getenv('REMIND_HOUR', '12'))
+# Сколько напоминаний отправлять одной пачкой
+REMIND_BATCH = int(os.getenv('REMIND_BATCH', '30'))
+# Дольше не спим, даже если до ближайшего таймера далеко: на случай перевода часов
+MAX_SLEEP = 300
+# Через сколько повторить таймеры, которые не удалось выполнить (секунды)
+RETRY_DELAY = 60
+
+CLOSE = 'close'
+REMIND = 'remind'
+
+
+# Когда закрыть событие: через close_after после начала. Событие без времени
+# (all_day, starts_at — полночь) закрывается в конце своего дня, иначе оно
+# пропало бы из списков утром в день игры
+def closes_at(starts_at, all_day=False, close_after=EVENT_CLOSE_AFTER):
+    if all_day:
+        day = from_timestamp(starts_at).date() + timedelta(days=1)
+        return to_timestamp(datetime.combine(day, day_start(), tzinfo=EVENT_TZ))
+    return int(starts_at + close_after)
+
+
+# Когда напомнить: за remind_before до начала; о событии без времени — в
+# REMIND_HOUR того же дня, а не в полночь
+def reminds_at(starts_at, all_day=False, remind_before=REMIND_BEFORE):
+    due = int(starts_at - remind_before)
+    if all_day:
+        day = from_timestamp(due).date()
+        due = to_timestamp(datetime.combine(day, day_start(REMIND_HOUR), tzinfo=EVENT_TZ))
+    return due
+
+
+# Таймеры нового события (на соединении писателя): закрытие после начала и
+# напоминание, если до него ещё не дошло. Возвращает записи для Scheduler.add
+def schedule_event(conn, event_id, chat_id, starts_at, all_day=False, now=None,
+                   close_after=EVENT_CLOSE_AFTER, remind_before=REMIND_BEFORE):
+    now = time.time() if now is None else now
+    timers = [(closes_at(starts_at, all_day, close_after), event_id, CLOSE, chat_id)]
+    remind_at = reminds_at(starts_at, all_day, remind_before)
+    if remind_at > now:
+        timers.append((remind_at, event_id, REMIND, chat_id))
+    conn.executemany("INSERT OR IGNORE INTO timers (due_at, event_id, kind, chat_id) VALUES (?, ?, ?, ?)",
+                     timers)
+    return timers
+
+
+# Планировщик закрытия событий и напоминаний.
+# Таймеры хранятся в таблице timers, а в памяти — куча ближайших сроков:
+# задача спит до первого срока и к базе между срабатываниями не обращается.
+# Таймер выполняется в одной транзакции с удалением своей строки; если строки
+# уже нет (таймер выполнен до перезапуска или другим процессом), он пропускается.
+# Напоминание ставит в очередь reminders всех игроков чата, не ответивших ни
+# «Буду», ни «Не буду»; очередь рассылается пачками по REMIND_BATCH с низким
+# приоритетом (outbox.bulk). Пачка удаляется из очереди до отправки, поэтому
+# после перезапуска никому не придёт второе напоминание.
+class Scheduler:
+    def __init__(self, db, close_after=EVENT_CLOSE_AFTER, remind_before=REMIND_BEFORE,
+                 batch_size=REMIND_BATCH):
+        self.db = db
+        self.close_after = close_after
+        self.remind_before = remind_before
+        self.batch_size = batch_size
+        self.bot = None
+        self.owns = None
+        # (due_at, event_id, kind, chat_id)
+        self._heap = []
+        # Чаты с неразосланными напоминаниями (по кругу, пачка за пачкой)
+        self._chats = {}
+        self._wakeup = None
+        self._task = None
+        self._delivery = None
+        self._closing = False
+        # Вызывается для таймеров чужих чатов (event_id, ...): в режиме рабочих
+        # процессов таймер добавляется в процессе, которому принадлежит чат
+        self.on_change = None
+        self.stats = {'timers': 0, 'fired': 0, 'skipped': 0, 'closed': 0, 'queued': 0,
+                      'sent': 0, 'unreachable': 0, 'errors': 0}
+
+    # Таймеры нового события в транзакции conn; после commit передать результат в add
+    def schedule(self, conn, event_id, chat_id, starts_at, all_day=False):
+        return schedule_event(conn, event_id, chat_id, starts_at, all_day,
+                              close_after=self.close_after, remind_before=self.remind_before)
+
+    # Загрузка таймеров и неразосланных напоминаний при запуске. owns(chat_id) —
+    # какие чаты обслуживает этот процесс (в режиме рабочих процессов)
+    async def restore(self, db=None, owns=None):
+        self.db = db or self.db
+        self.owns = owns
+
+        def load_timers(conn):
+            timers = conn.execute("SELECT due_at, event_id, kind, chat_id FROM timers").fetchall()
+            chats = [row[0] for row in conn.execute("SELECT DISTINCT chat_id FROM reminders")]
+            return timers, chats
+
+        timers, chats = await self.db.read(load_timers)
+        self._heap = [timer for timer in timers if owns is None or owns(timer[3])]
+        heapq.heapify(self._heap)
+        self._chats = dict.fromkeys(chat_id for chat_id in chats if owns is None or owns(chat_id))
+        self.stats['timers'] = len(self._heap)
+        print(f"Таймеры загружены: {len(self._heap)}, чатов с напоминаниями: {len(self._chats)}")
+
+    def start(self, bot):
+        self.bot = bot
+        self._closing = False
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+        self._deliver_soon()
+
+    def add(self, timers, notify=True):
+        for timer in timers:
+            timer = tuple(timer)
+            if self.owns is not None and not self.owns(timer[3]):
+                if notify and self.on_change is not None:
+                    self.on_change(*timer)
+                continue
+            heapq.heappush(self._heap, timer)
+            self.stats['timers'] += 1
+            # Новый срок раньше прежнего ближайшего — пересчитываем сон
+            if self._wakeup is not None and self._heap[0] is timer:
+                self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            now = time.time()
+            if not self._heap or self._heap[0][0] > now:
+                delay = min(self._heap[0][0] - now, MAX_SLEEP) if self._heap else MAX_SLEEP
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            due = []
+            while self._heap and self._heap[0][0] <= now:
+                due.append(heapq.heappop(self._heap))
+            try:
+                await self._fire(due)
+            except Exception as e:
+                self.stats['errors'] += 1
+                print(f"ERROR firing {len(due)} timers: {e!r}")
+                for due_at, *rest in due:
+                    heapq.heappush(self._heap, (int(now + RETRY_DELAY), *rest))
+
+    # Все наступившие таймеры — одной транзакцией
+    async def _fire(self, due):
+        # Отметки из журнала должны быть в базе: иначе отметившимся придёт
+        # напоминание, а закрытое событие попадёт в статистику без них
+        await attendance.flush()
+
+        def fire_timers(conn):
+            closed, closed_events, reminded, fired, queued = set(), [], set(), 0, 0
+            for _, event_id, kind, chat_id in due:
+                if not conn.execute("DELETE FROM timers WHERE event_id = ? AND kind = ?",
+                                    (event_id, kind)).rowcount:
+                    continue
+                fired += 1
+                if kind == CLOSE:
+                    if conn.execute("UPDATE events SET status = 'closed' WHERE event_id = ? AND status = 'open'",
+                                    (event_id,)).rowcount:
+                        closed.add(chat_id)
+                        closed_events.append(event_id)
+                    continue
+                rows = conn.execute('''INSERT OR IGNORE INTO reminders (chat_id, event_id, user_id)
+                                       SELECT m.chat_id, e.event_id, m.user_id FROM events e
+                                       JOIN members m ON m.chat_id = e.chat_id
+                                       WHERE e.event_id = ? AND e.status = 'open'
+                                       AND NOT EXISTS (SELECT 1 FROM participants p
+                                                       WHERE p.event_id = e.event_id AND p.user_id = m.user_id)
+                                       AND NOT EXISTS (SELECT 1 FROM declined d
+                                                       WHERE d.event_id = e.event_id AND d.user_id = m.user_id)''',
+                                    (event_id,)).rowcount
+                if rows:
+                    reminded.add(chat_id)
+                    queued += rows
+            # Закрытые события проведены — учитываем их в статистике
+            for chat_id in closed:
+                roll_up(conn, chat_id)
+            return closed, closed_events, reminded, fired, queued
+
+        closed, closed_events, reminded, fired, queued = await self.db.transaction(fire_timers)
+        self.stats['fired'] += fired
+        self.stats['skipped'] += len(due) - fired
+        self.stats['closed'] += len(closed_events)
+        self.stats['queued'] += queued
+        self.stats['timers'] = len(self._heap)
+        # Закрытые события пропадают из списков чата, отметки на них не принимаются
+        for chat_id in closed:
+            render_cache.bump(chat_id)
+        for event_id in closed_events:
+            attendance.forget(event_id)
+        for chat_id in reminded:
+            self._chats[chat_id] = None
+        self._deliver_soon()
+
+    def _deliver_soon(self):
+        if self._chats and self.bot is not None and self._delivery is None and not self._closing:
+            self._delivery = asyncio.create_task(self._deliver())
+
+    # Пачка напоминаний чата забирается из очереди; напоминания по уже
+    # закрытым событиям выбрасываются
+    def _claim(self, conn, chat_id):
+        rows = conn.execute('''SELECT r.event_id, r.user_id, e.type, e.starts_at, e.status FROM reminders r
+                               JOIN events e ON e.event_id = r.event_id
+                               WHERE r.chat_id = ? LIMIT ?''', (chat_id, self.batch_size)).fetchall()
+        conn.executemany("DELETE FROM reminders WHERE chat_id = ? AND event_id = ? AND user_id = ?",
+                         [(chat_id, event_id, user_id) for event_id, user_id, *_ in rows])
+        return [row[:4] for row in rows if row[4] == 'open'], len(rows)
+
+    async def _deliver(self):
+        try:
+            while self._chats and not self._closing:
+                chat_id = next(iter(self._chats))
+                del self._chats[chat_id]
+                batch, claimed = await self.db.transaction(lambda conn: self._claim(conn, chat_id))
+                if claimed == self.batch_size:
+                    # В очереди чата могут остаться ещё — после пачек других чатов
+                    self._chats[chat_id] = None
+                with bulk():
+                    await asyncio.gather(*(self._remind(*row) for row in batch))
+        except Exception as e:
+            self.stats['errors'] += 1
+            print(f"ERROR delivering reminders: {e!r}")
+        finally:
+            self._delivery = None
+
+    async def _remind(self, event_id, user_id, event_type, starts_at):
+        keyboard = InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="✅ Буду", callback_data=Mark(event_id=event_id, going=True).pack()),
+             InlineKeyboardButton(text="❌ Не буду", callback_data=Mark(event_id=event_id, going=False).pack())]
+        ])
+        try:
+            await self.bot.send_message(
+                user_id,
+                f"⏰ <b>{html.escape(event_type)} {format_event_date(starts_at)}</b>\n"
+                "Вы ещё не отметились. Будете?",
+                reply_markup=keyboard,
+                parse_mode="HTML"
+            )
+        except (TelegramForbiddenError, TelegramBadRequest):
+            # Игрок не начинал диалог с ботом или заблокировал его
+            self.stats['unreachable'] += 1
+        except Exception as e:
+            self.stats['errors'] += 1
+            print(f"ERROR sending reminder for event {event_id} to {user_id}: {e!r}")
+        else:
+            self.stats['sent'] += 1
+
+    # Остановка: текущая пачка досылается, остальное остаётся в очереди до запуска
+    async def close(self):
+        self._closing = True
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._delivery is not None:
+            await asyncio.gather(self._delivery, return_exceptions=True)
+
+    def metrics(self):
+        return {**self.stats, 'pending_chats': len(self._chats)}
+
+
+scheduler = Scheduler(db)
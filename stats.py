@@ -0,0 +1,86 @@
+from collections import Counter
+from itertools import permutations, takewhile
+
+# Сколько самых частых партнёров по пятёрке показывать
+TOP_LINEMATES = 3
+
+
+# Статистика посещаемости по агрегатам.
+# Событие «проведено», когда оно закрыто таймером закрытия (scheduler): к
+# этому времени все отметки на него уже сделаны. Проведённые события
+# учитываются один раз (events.counted) в порядке времени начала: каждое
+# добавляет единицу к chat_stats.held, к player_stats.attended отметившихся и
+# продлевает или обрывает их серии. Учёт идёт в транзакции таймера закрытия,
+# поэтому серии не зависят от того, когда вызывают /stats. Поздние отметки на
+# уже учтённые события меняют attended триггерами (серии не пересчитываются).
+# Партнёры по пятёрке (linemates) обновляются при каждом сохранении составов.
+# Поэтому /stats читает несколько строк, сколько бы событий ни было за сезон.
+
+# Учёт закрытых, но ещё не учтённых событий чата (на соединении писателя).
+# Останавливается на первом ещё открытом событии: более позднее событие,
+# закрытое раньше него, учитывается после, чтобы серии шли по порядку
+def roll_up(conn, chat_id):
+    events = [event_id for event_id, _ in takewhile(lambda row: row[1] == 'closed', conn.execute(
+        '''SELECT event_id, status FROM events WHERE chat_id = ? AND counted = 0 AND starts_at IS NOT NULL
+           ORDER BY starts_at, event_id''', (chat_id,)))]
+    for event_id in events:
+        conn.execute('''INSERT INTO chat_stats (chat_id, held) VALUES (?, 1)
+                        ON CONFLICT DO UPDATE SET held = held + 1''', (chat_id,))
+        held = conn.execute("SELECT held FROM chat_stats WHERE chat_id = ?", (chat_id,)).fetchone()[0]
+        # Пропустившие событие обрывают серию
+        conn.execute('''UPDATE player_stats SET streak = 0
+                        WHERE chat_id = ? AND streak > 0 AND user_id NOT IN
+                            (SELECT user_id FROM participants WHERE event_id = ?)''', (chat_id, event_id))
+        conn.execute('''INSERT INTO player_stats (chat_id, user_id, attended, joined_held, streak, best_streak)
+                        SELECT ?, user_id, 1, ?, 1, 1 FROM participants WHERE event_id = ?
+                        ON CONFLICT DO UPDATE SET attended = attended + 1, streak = streak + 1,
+                            best_streak = MAX(best_streak, streak + 1)''', (chat_id, held - 1, event_id))
+        conn.execute("UPDATE events SET counted = 1 WHERE event_id = ?", (event_id,))
+    return len(events)
+
+
+# Пары игроков одной пятёрки: (user_id, партнёр) -> число совместных составов
+def _pairs(teams):
+    pairs = Counter()
+    for team in teams:
+        pairs.update(permutations(team, 2))
+    return pairs
+
+
+# Составы события заменяют прежние: teams — списки user_id по командам (в
+# порядке показа), colors — их цвета. Счётчики партнёров прежнего состава
+# вычитаются, нового — прибавляются
+def save_lineup(conn, event_id, chat_id, colors, teams):
+    old = {}
+    for team_id, user_id in conn.execute(
+            '''SELECT tp.team_id, tp.user_id FROM teams t JOIN team_players tp ON tp.team_id = t.team_id
+               WHERE t.event_id = ?''', (event_id,)):
+        old.setdefault(team_id, []).append(user_id)
+    delta = _pairs(teams)
+    delta.subtract(_pairs(old.values()))
+
+    conn.execute("DELETE FROM teams WHERE event_id = ?", (event_id,))
+    for color, team in zip(colors, teams):
+        team_id = conn.execute("INSERT INTO teams (event_id, color) VALUES (?, ?)", (event_id, color)).lastrowid
+        conn.executemany("INSERT INTO team_players (team_id, user_id, position) VALUES (?, ?, ?)",
+                         [(team_id, user_id, position) for position, user_id in enumerate(team)])
+
+    changes = [(chat_id, user_id, mate_id, games) for (user_id, mate_id), games in delta.items() if games]
+    conn.executemany('''INSERT INTO linemates (chat_id, user_id, mate_id, games) VALUES (?, ?, ?, ?)
+                        ON CONFLICT DO UPDATE SET games = games + excluded.games''', changes)
+    conn.execute("DELETE FROM linemates WHERE chat_id = ? AND games <= 0", (chat_id,))
+
+
+# Статистика игрока: None, если он ещё не был ни на одном проведённом событии
+def player_stats(conn, chat_id, user_id, top=TOP_LINEMATES):
+    row = conn.execute('''SELECT p.attended, c.held - p.joined_held, p.streak, p.best_streak
+                          FROM player_stats p JOIN chat_stats c ON c.chat_id = p.chat_id
+                          WHERE p.chat_id = ? AND p.user_id = ?''', (chat_id, user_id)).fetchone()
+    if row is None:
+        return None
+    mates = conn.execute('''SELECT m.name, l.games FROM linemates l
+                            JOIN members m ON m.chat_id = l.chat_id AND m.user_id = l.mate_id
+                            WHERE l.chat_id = ? AND l.user_id = ?
+                            ORDER BY l.games DESC, m.name LIMIT ?''', (chat_id, user_id, top)).fetchall()
+    attended, held, streak, best_streak = row
+    return {'attended': attended, 'held': held, 'streak': streak, 'best_streak': best_streak, 'linemates': mates}
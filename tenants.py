@@ -0,0 +1,74 @@
+import os
+
+# Данные, созданные до разделения по чатам, принадлежат этому чату.
+# Укажите id группы команды, чтобы её прежние события и тренеры остались на месте.
+LEGACY_CHAT_ID = int(os.getenv('LEGACY_CHAT_ID', '0'))
+
+
+# Определение «арендатора» — чата, к которому относятся события, тренеры и
+# рейтинги. В группе это сама группа; в личном чате — последняя группа, где
+# пользователь писал боту или отмечался, а если такой нет — сам личный чат.
+# Последняя группа хранится в users.last_chat_id и кэшируется в памяти,
+# поэтому запись в базу происходит только при смене группы.
+class TenantResolver:
+    def __init__(self):
+        # user_id -> chat_id последней группы (None — групп не было)
+        self._last_chat = {}
+        self.stats = {'hits': 0, 'reads': 0, 'writes': 0}
+        # Вызывается при смене группы пользователя (user_id, chat_id), см. RoleCache.on_change
+        self.on_change = None
+
+    async def resolve(self, db, chat, user):
+        if chat.type == 'private':
+            return await self._private(db, user)
+        if self.is_new(chat, user):
+            await self.join(db, chat.id, user)
+        else:
+            self.stats['hits'] += 1
+        return chat.id
+
+    async def _private(self, db, user):
+        if user.id in self._last_chat:
+            self.stats['hits'] += 1
+        else:
+            self.stats['reads'] += 1
+            row = await db.fetchone("SELECT last_chat_id FROM users WHERE user_id = ?", (user.id,))
+            self._last_chat[user.id] = row[0] if row else None
+        last_chat = self._last_chat[user.id]
+        return last_chat if last_chat is not None else user.id
+
+    # Нужно ли запомнить группу: пользователь пишет из группы, которой нет в кэше
+    def is_new(self, chat, user):
+        return chat.type != 'private' and self._last_chat.get(user.id) != chat.id
+
+    # Запись о группе пользователя; выполняется внутри транзакции вызывающего,
+    # после фиксации — remember
+    @staticmethod
+    def record(conn, chat_id, user):
+        conn.execute('''INSERT INTO users (user_id, name, last_chat_id) VALUES (?, ?, ?)
+                        ON CONFLICT(user_id) DO UPDATE SET last_chat_id = excluded.last_chat_id''',
+                     (user.id, user.full_name, chat_id))
+        conn.execute("INSERT OR IGNORE INTO members (chat_id, user_id, name) VALUES (?, ?, ?)",
+                     (chat_id, user.id, user.full_name))
+
+    def remember(self, user_id, chat_id, notify=True):
+        self._last_chat[user_id] = chat_id
+        if notify:
+            self.stats['writes'] += 1
+            if self.on_change is not None:
+                self.on_change(user_id, chat_id)
+
+    # Пользователь появился в группе: запоминаем её и заводим участника команды
+    async def join(self, db, chat_id, user):
+        await db.transaction(lambda conn: self.record(conn, chat_id, user))
+        self.remember(user.id, chat_id)
+
+    # Снимок для быстрого перезапуска (см. warm_start.CacheSnapshot)
+    def snapshot(self):
+        return dict(self._last_chat)
+
+    def load_snapshot(self, state):
+        self._last_chat = state
+
+
+tenants = TenantResolver()
@@ -0,0 +1,267 @@
+import os
+import time
+import pickle
+import asyncio
+import secrets
+from aiogram import BaseMiddleware
+from migrations import schema_version
+
+# Как часто записывать номер последнего обработанного обновления (секунды).
+# При остановке бота он записывается сразу
+OFFSET_FLUSH_INTERVAL = float(os.getenv('OFFSET_FLUSH_INTERVAL', '1'))
+# Сколько секунд при остановке ждать обновления, которые ещё обрабатываются
+DRAIN_TIMEOUT = float(os.getenv('DRAIN_TIMEOUT', '10'))
+# Повторы после перезапуска: обновления не дальше этого числа номеров до
+# сохранённого считаются уже обработанными. Telegram доставляет повторно не
+# больше пачки getUpdates (до 100), поэтому окна с запасом хватает; номер
+# намного меньше сохранённого — Telegram начал нумерацию заново
+RESUME_WINDOW = 1000
+# Файл снимка кэшей; по умолчанию рядом с базой (<DB_PATH>.snapshot,
+# у рабочих процессов — с номером процесса в конце)
+SNAPSHOT_PATH = os.getenv('SNAPSHOT_PATH')
+
+
+# Момент запуска процесса (monotonic). Большая часть холодного старта — импорт
+# aiogram, поэтому считаем от запуска процесса (/proc в Linux), а не от
+# импорта этого модуля; где /proc нет — от импорта
+def process_started():
+    now = time.monotonic()
+    try:
+        with open('/proc/self/stat') as file:
+            # Поля после имени процесса (в скобках); starttime — 22-е поле
+            ticks = int(file.read().rsplit(')', 1)[1].split()[19])
+        with open('/proc/uptime') as file:
+            uptime = float(file.read().split()[0])
+    except (OSError, ValueError, IndexError):
+        return now
+    return now - max(uptime - ticks / os.sysconf('SC_CLK_TCK'), 0.0)
+
+
+STARTED = process_started()
+
+
+def save_state(conn, key, value):
+    conn.execute('''INSERT INTO bot_state (key, value) VALUES (?, ?)
+                    ON CONFLICT(key) DO UPDATE SET value = excluded.value''', (key, value))
+
+
+# Номер последнего обработанного обновления.
+# Outer-middleware Dispatcher (после UpdateDeduplicator): помнит обновления в
+# обработке; всё, что меньше самого раннего из них, обработано полностью.
+# Этот номер раз в OFFSET_FLUSH_INTERVAL пишется в bot_state. После
+# перезапуска Telegram доставляет заново то, что не успели подтвердить
+# (polling) или чей ответ не дошёл (webhook): обновления не дальше
+# RESUME_WINDOW номеров до сохранённого отбрасываются как обработанные.
+# Подтверждает Telegram только сам polling — offset, которого этот процесс не
+# получал, не отправляется. Номер намного меньше сохранённого означает, что
+# Telegram начал нумерацию заново (после недели без обновлений): сохранённый
+# номер забывается, обновление обрабатывается. Остановка ждёт обновления в
+# обработке (drain), поэтому подтверждённые Telegram не теряются.
+# deferred=True — обработку завершает не обработчик, а вызов done (входной
+# процесс: обновление обработано, когда рабочий процесс сообщил об этом).
+class UpdateOffset(BaseMiddleware):
+    def __init__(self, key='update_offset', flush_interval=OFFSET_FLUSH_INTERVAL, deferred=False,
+                 window=RESUME_WINDOW):
+        self.key = key
+        self.flush_interval = flush_interval
+        self.window = window
+        self.deferred = deferred
+        self.db = None
+        # Номер, сохранённый при прошлом запуске: обновления до него включительно уже обработаны
+        self.resumed = None
+        self._saved = None
+        self._last = None
+        # update_id -> когда началась обработка (monotonic)
+        self._in_flight = {}
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._task = None
+        # Вызывается после каждого обработанного обновления (update_id, секунды обработки)
+        self.on_done = None
+        self.stats = {'skipped': 0, 'resets': 0, 'handled': 0, 'flushes': 0, 'errors': 0}
+
+    async def restore(self, db):
+        self.db = db
+        row = await db.fetchone("SELECT value FROM bot_state WHERE key = ?", (self.key,))
+        self.resumed = self._saved = self._last = row[0] if row else None
+        print(f"Последнее обработанное обновление: {self.resumed}")
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._flush_loop())
+
+    async def __call__(self, handler, event, data):
+        if not self.begin(event.update_id):
+            return None
+        if self.deferred:
+            try:
+                return await handler(event, data)
+            except BaseException:
+                self.done(event.update_id)
+                raise
+        try:
+            return await handler(event, data)
+        finally:
+            self.done(event.update_id)
+
+    def begin(self, update_id):
+        if self.resumed is not None and update_id <= self.resumed:
+            if update_id > self.resumed - self.window:
+                self.stats['skipped'] += 1
+                return False
+            print(f"Нумерация обновлений началась заново: {update_id} после {self.resumed}")
+            self.stats['resets'] += 1
+            self.resumed = self._last = None
+        self._in_flight[update_id] = time.monotonic()
+        self._idle.clear()
+        if self._last is None or update_id > self._last:
+            self._last = update_id
+        return True
+
+    def done(self, update_id):
+        started = self._in_flight.pop(update_id, None)
+        if started is None:
+            return
+        self.stats['handled'] += 1
+        if not self._in_flight:
+            self._idle.set()
+        if self.on_done is not None:
+            self.on_done(update_id, time.monotonic() - started)
+
+    # Все обновления с номером до этого включительно обработаны
+    def offset(self):
+        if self._in_flight:
+            return min(self._in_flight) - 1
+        return self._last
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def flush(self):
+        offset = self.offset()
+        if offset is None or offset == self._saved:
+            return
+        try:
+            await self.db.transaction(lambda conn: save_state(conn, self.key, offset))
+        except Exception as e:
+            self.stats['errors'] += 1
+            print(f"ERROR saving update offset: {e!r}")
+            return
+        self._saved = offset
+        self.stats['flushes'] += 1
+
+    # Ждём обновления, которые ещё обрабатываются (при остановке)
+    async def drain(self, timeout=DRAIN_TIMEOUT):
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            print(f"Не дождались обработки обновлений: {len(self._in_flight)}")
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+
+    def metrics(self):
+        return {**self.stats, 'in_flight': len(self._in_flight), 'offset': self.offset() or 0}
+
+
+# Снимок кэшей в памяти для быстрого перезапуска.
+# caches — {имя: кэш}; у кэша есть snapshot() и load_snapshot(state). При
+# остановке (после записи всех отложенных изменений) снимок пишется в файл, а
+# его метка — в bot_state. При запуске метка забирается из базы: снимок
+# загружается, только если она совпала (база не менялась после остановки, бот
+# не падал) и схема базы та же. Иначе кэши заполняются из базы по мере
+# обращения, как без снимка. owner — какие чаты обслуживает процесс (в режиме
+# рабочих процессов у каждого процесса свой снимок, suffix — его номер).
+class CacheSnapshot:
+    def __init__(self, caches, suffix='', owner=None):
+        self.caches = caches
+        self.suffix = suffix
+        self.key = 'snapshot' + suffix
+        self.owner = owner
+        self.stats = {'loaded': 0, 'load_seconds': 0.0, 'save_seconds': 0.0}
+
+    def _path(self, db):
+        return (SNAPSHOT_PATH or f"{db.path}.snapshot") + self.suffix
+
+    # Возвращает имена загруженных кэшей
+    async def load(self, db):
+        start = time.perf_counter()
+        path = self._path(db)
+
+        def take_token(conn):
+            row = conn.execute("SELECT value FROM bot_state WHERE key = ?", (self.key,)).fetchone()
+            conn.execute("DELETE FROM bot_state WHERE key = ?", (self.key,))
+            return row[0] if row else None, schema_version(conn)
+
+        # Метка одноразовая: если бот упадёт, снимок устареет и не загрузится
+        token, schema = await db.transaction(take_token)
+        if token is None or not os.path.exists(path):
+            print("Снимок кэшей не найден, кэши заполнятся из базы")
+            return set()
+        try:
+            with open(path, 'rb') as file:
+                state = pickle.load(file)
+        except Exception as e:
+            print(f"ERROR reading cache snapshot {path}: {e!r}")
+            return set()
+        if (state['token'], state['schema'], state['owner']) != (token, schema, self.owner):
+            print("Снимок кэшей устарел, кэши заполнятся из базы")
+            return set()
+        loaded = set()
+        for name, cache in self.caches.items():
+            if name in state['caches']:
+                cache.load_snapshot(state['caches'][name])
+                loaded.add(name)
+        self.stats['loaded'] = 1
+        self.stats['load_seconds'] = time.perf_counter() - start
+        print(f"Снимок кэшей загружен: {', '.join(sorted(loaded))} "
+              f"({self.stats['load_seconds'] * 1000:.0f} мс)")
+        return loaded
+
+    async def save(self, db):
+        start = time.perf_counter()
+        path = self._path(db)
+        token = secrets.token_hex(8)
+        schema = await db.read(schema_version)
+        state = {'token': token, 'schema': schema, 'owner': self.owner,
+                 'caches': {name: cache.snapshot() for name, cache in self.caches.items()}}
+        with open(path + '.tmp', 'wb') as file:
+            pickle.dump(state, file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(path + '.tmp', path)
+        await db.transaction(lambda conn: save_state(conn, self.key, token))
+        self.stats['save_seconds'] = time.perf_counter() - start
+        print(f"Снимок кэшей сохранён ({self.stats['save_seconds'] * 1000:.0f} мс)")
+
+    def metrics(self):
+        return dict(self.stats)
+
+
+# Время холодного старта: от запуска процесса до приёма обновлений и до
+# первого обработанного обновления
+class StartupTimer:
+    def __init__(self, started=STARTED):
+        self.started = started
+        self.stats = {'ready_seconds': 0.0, 'first_update_seconds': 0.0, 'first_handle_seconds': 0.0}
+
+    # Dispatcher.startup: polling или webhook запущены
+    def ready(self, **kwargs):
+        self.stats['ready_seconds'] = time.monotonic() - self.started
+        print(f"Запуск: готов принимать обновления через {self.stats['ready_seconds']:.2f} с")
+
+    # UpdateOffset.on_done: первое обработанное обновление после запуска
+    def handled(self, update_id, seconds):
+        if self.stats['first_update_seconds']:
+            return
+        self.stats['first_update_seconds'] = time.monotonic() - self.started
+        self.stats['first_handle_seconds'] = seconds
+        print(f"Запуск: первый ответ через {self.stats['first_update_seconds']:.2f} с "
+              f"(обработка {seconds * 1000:.1f} мс)")
+
+    def metrics(self):
+        return dict(self.stats)
@@ -0,0 +1,49 @@
+import os
+import signal
+import asyncio
+import secrets
+from aiohttp import web
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+
+# Режим webhook включается, если задан публичный адрес бота (например https://bot.example.com).
+# Без него бот работает через start_polling.
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/webhook')
+WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8080'))
+# Секрет, который Telegram присылает в заголовке X-Telegram-Bot-Api-Secret-Token.
+# Если не задан, генерируется при каждом запуске (set_webhook вызывается заново).
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET') or secrets.token_urlsafe(32)
+
+
+# aiohttp-приложение, передающее обновления в тот же Dispatcher.
+# Обработка идёт не в фоне: если обработчик вернул метод API (например
+# callback.answer()), он уходит прямо в ответе на webhook без отдельного запроса.
+def create_app(bot, dp, secret=WEBHOOK_SECRET, path=WEBHOOK_PATH):
+    app = web.Application()
+    SimpleRequestHandler(dispatcher=dp, bot=bot, secret_token=secret, handle_in_background=False).register(app, path=path)
+    setup_application(app, dp, bot=bot)
+    return app
+
+
+async def run_webhook(bot, dp):
+    runner = web.AppRunner(create_app(bot, dp))
+    await runner.setup()
+    site = web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT)
+    await site.start()
+    await bot.set_webhook(
+        url=WEBHOOK_URL.rstrip('/') + WEBHOOK_PATH,
+        secret_token=WEBHOOK_SECRET,
+        allowed_updates=dp.resolve_used_update_types(),
+    )
+    print(f"Webhook: слушаем {WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+
+    # Останавливаемся по SIGINT/SIGTERM, дав текущим запросам завершиться
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    try:
+        await stop.wait()
+    finally:
+        await runner.cleanup()
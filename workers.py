@@ -0,0 +1,219 @@
+import os
+import time
+import asyncio
+import multiprocessing
+from collections import OrderedDict
+from aiogram import BaseMiddleware
+from aiogram.methods import TelegramMethod
+from aiogram.types import Update
+
+# WORKERS > 0 — входной процесс (polling или webhook) раздаёт обновления
+# рабочим процессам; 0 — всё обрабатывается в одном процессе, как раньше
+WORKERS = int(os.getenv('WORKERS', '0'))
+# Сколько обновлений может ждать обработки в одном рабочем процессе;
+# дальше входной процесс перестаёт принимать новые (getUpdates не вызывается,
+# webhook не отвечает), и очередь копится на стороне Telegram
+WORKER_QUEUE = int(os.getenv('WORKER_QUEUE', '100'))
+# Сколько последних update_id помнить для отбрасывания повторов
+DEDUP_WINDOW = 10000
+# Как часто проверять, живы ли рабочие процессы (секунды)
+SUPERVISE_INTERVAL = 1.0
+# Сколько ждать, пока рабочие процессы доработают при остановке (секунды)
+STOP_TIMEOUT = 30
+
+
+# Outer-middleware Dispatcher: повторно доставленные обновления (повтор webhook,
+# перезапуск с неподтверждённым offset) не обрабатываются второй раз
+class UpdateDeduplicator(BaseMiddleware):
+    def __init__(self, window=DEDUP_WINDOW):
+        self.window = window
+        self._seen = OrderedDict()
+        self.stats = {'duplicates': 0}
+
+    async def __call__(self, handler, event, data):
+        if event.update_id in self._seen:
+            self.stats['duplicates'] += 1
+            return None
+        self._seen[event.update_id] = None
+        if len(self._seen) > self.window:
+            self._seen.popitem(last=False)
+        return await handler(event, data)
+
+
+# Чат обновления: по нему выбирается рабочий процесс и соблюдается порядок
+def shard_key(data):
+    chat = data.get('event_chat')
+    if chat is not None:
+        return chat.id
+    user = data.get('event_from_user')
+    return user.id if user is not None else 0
+
+
+class _Worker:
+    def __init__(self, index, queue_size):
+        self.index = index
+        self.process = None
+        self.inbox = None
+        # Свободные места в очереди процесса
+        self.credits = asyncio.Semaphore(queue_size)
+        # Отправленные, но ещё не обработанные: update_id -> сообщение для процесса
+        self.in_flight = OrderedDict()
+        self.ready = asyncio.Event()
+
+
+# Входной процесс. Регистрируется последним outer-middleware на dp.update и
+# вместо обработки отправляет обновление рабочему процессу chat_id % workers,
+# поэтому все обновления одного чата обрабатывает один процесс и по порядку.
+# target(index, inbox, results) — точка входа рабочего процесса (см. serve_worker).
+# Рабочие процессы сообщают об изменениях кэшей (sync) — они пересылаются остальным.
+# Упавший процесс перезапускается, необработанные им обновления отправляются заново.
+class Ingress(BaseMiddleware):
+    def __init__(self, target, workers=WORKERS, queue_size=WORKER_QUEUE):
+        self.target = target
+        self.queue_size = queue_size
+        self._context = multiprocessing.get_context('spawn')
+        self._workers = [_Worker(index, queue_size) for index in range(workers)]
+        self._results = None
+        self._reader = None
+        self._supervisor = None
+        self._closing = False
+        # Вызывается, когда рабочий процесс обработал обновление (update_id)
+        self.on_done = None
+        self.stats = {'forwarded': 0, 'processed': 0, 'waits': 0, 'max_in_flight': 0,
+                      'synced': 0, 'restarts': 0}
+
+    def _spawn(self, worker):
+        worker.inbox = self._context.Queue()
+        worker.process = self._context.Process(
+            target=self.target, args=(worker.index, worker.inbox, self._results),
+            name=f"hockey-worker-{worker.index}", daemon=True)
+        worker.process.start()
+
+    async def start(self):
+        self._results = self._context.Queue()
+        for worker in self._workers:
+            self._spawn(worker)
+        self._reader = asyncio.create_task(self._read_results())
+        # Принимать обновления начинаем, когда все процессы подготовились
+        await asyncio.gather(*(worker.ready.wait() for worker in self._workers))
+        self._supervisor = asyncio.create_task(self._supervise())
+        print(f"Рабочих процессов: {len(self._workers)}")
+
+    async def __call__(self, handler, event, data):
+        key = shard_key(data)
+        worker = self._workers[key % len(self._workers)]
+        # Обратное давление: ждём, пока процесс не освободит место
+        if worker.credits.locked():
+            self.stats['waits'] += 1
+        await worker.credits.acquire()
+        message = ('update', key, event.update_id,
+                   event.model_dump_json(by_alias=True, exclude_none=True))
+        worker.in_flight[event.update_id] = message
+        worker.inbox.put(message)
+        self.stats['forwarded'] += 1
+        self.stats['max_in_flight'] = max(self.stats['max_in_flight'], len(worker.in_flight))
+        return None
+
+    async def _read_results(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            message = await loop.run_in_executor(None, self._results.get)
+            if message is None:
+                return
+            kind, index = message[0], message[1]
+            worker = self._workers[index]
+            if kind == 'done':
+                if worker.in_flight.pop(message[2], None) is not None:
+                    worker.credits.release()
+                    self.stats['processed'] += 1
+                    if self.on_done is not None:
+                        self.on_done(message[2])
+            elif kind == 'ready':
+                worker.ready.set()
+            elif kind == 'sync':
+                self.stats['synced'] += 1
+                for other in self._workers:
+                    if other is not worker:
+                        other.inbox.put(('sync',) + message[2:])
+
+    async def _supervise(self):
+        while not self._closing:
+            await asyncio.sleep(SUPERVISE_INTERVAL)
+            for worker in self._workers:
+                if worker.process.is_alive() or self._closing:
+                    continue
+                print(f"Рабочий процесс {worker.index} завершился с кодом {worker.process.exitcode}, "
+                      f"перезапуск; повторно отправляется обновлений: {len(worker.in_flight)}")
+                self.stats['restarts'] += 1
+                worker.ready.clear()
+                self._spawn(worker)
+                await worker.ready.wait()
+                for message in worker.in_flight.values():
+                    worker.inbox.put(message)
+
+    async def close(self):
+        self._closing = True
+        if self._supervisor is not None:
+            self._supervisor.cancel()
+        loop = asyncio.get_running_loop()
+        for worker in self._workers:
+            worker.inbox.put(None)
+        deadline = time.monotonic() + STOP_TIMEOUT
+        for worker in self._workers:
+            # Процесс дорабатывает свою очередь и закрывает соединения; срок общий
+            # для всех процессов. SIGTERM рабочий процесс игнорирует, поэтому
+            # зависший останавливаем SIGKILL — иначе он переживёт входной процесс
+            # (и запишет снимок кэшей после запуска нового экземпляра)
+            await loop.run_in_executor(None, worker.process.join, max(0, deadline - time.monotonic()))
+            if worker.process.is_alive():
+                worker.process.kill()
+                await loop.run_in_executor(None, worker.process.join)
+        self._results.put(None)
+        await self._reader
+
+    def metrics(self):
+        return {**self.stats, 'in_flight': sum(len(w.in_flight) for w in self._workers)}
+
+
+# Цикл рабочего процесса: обновления одного чата выполняются строго по очереди,
+# разных чатов — параллельно. apply_sync(kind, *args) применяет изменения
+# кэшей, сделанные другими процессами.
+async def serve_worker(index, inbox, results, bot, dp, apply_sync):
+    loop = asyncio.get_running_loop()
+    chains = {}
+
+    async def process(previous, key, update_id, payload):
+        if previous is not None:
+            await asyncio.wait([previous])
+        try:
+            update = Update.model_validate_json(payload, context={'bot': bot})
+            response = await dp.feed_update(bot, update)
+            if isinstance(response, TelegramMethod):
+                await dp.silent_call_request(bot=bot, result=response)
+        except Exception as e:
+            print(f"Рабочий процесс {index}: ошибка обработки обновления {update_id}: {e!r}")
+        finally:
+            results.put(('done', index, update_id))
+            if chains.get(key) is asyncio.current_task():
+                del chains[key]
+
+    results.put(('ready', index))
+    while True:
+        message = await loop.run_in_executor(None, inbox.get)
+        if message is None:
+            break
+        if message[0] == 'sync':
+            apply_sync(*message[1:])
+            continue
+        _, key, update_id, payload = message
+        task = asyncio.create_task(process(chains.get(key), key, update_id, payload))
+        chains[key] = task
+    if chains:
+        await asyncio.wait(list(chains.values()))
+
+
+# Сообщить остальным рабочим процессам об изменении кэша (вызывается из рабочего процесса)
+def publisher(index, results):
+    def publish(kind, *args):
+        results.put(('sync', index, kind) + args)
+    return publish